@@ -1,27 +1,31 @@
 from fastapi import APIRouter, Depends, HTTPException
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models.chat_log import ChatLog
-from app.schemas.chat_log import ChatLogCreate, ChatLog as ChatLogSchema
+from app.schemas.chat_log import (
+    ChatLogCreate,
+    ChatLog as ChatLogSchema,
+    ChatLogBatchCreate,
+    ChatLogBatchError,
+    ChatLogBatchResult
+)
 import logging
+import os
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# 单次批量写入允许的最大记录数
+CHAT_LOG_BATCH_MAX_ITEMS = int(os.getenv("CHAT_LOG_BATCH_MAX_ITEMS", 1000))
+
 @router.post("/", response_model=ChatLogSchema)
 async def create_chat_log(log: ChatLogCreate, db: Session = Depends(get_db)):
     """
     创建聊天日志
     """
     try:
-        db_log = ChatLog(
-            input_params=log.input_params,
-            proprietary_params=log.proprietary_params,
-            proprietary_response=log.proprietary_response,
-            general_params=log.general_params,
-            general_response=log.general_response,
-            duration=log.duration
-        )
+        db_log = ChatLog(**log.model_dump())
         db.add(db_log)
         db.commit()
         db.refresh(db_log)
@@ -30,6 +34,45 @@ async def create_chat_log(log: ChatLogCreate, db: Session = Depends(get_db)):
         logger.error(f"创建聊天日志失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"创建日志失败: {str(e)}")
 
+@router.post("/batch", response_model=ChatLogBatchResult)
+def create_chat_logs_batch(batch: ChatLogBatchCreate, db: Session = Depends(get_db)):
+    """
+    批量创建聊天日志
+    逐条校验后，将通过校验的记录在一个事务内以多行 INSERT 写入，
+    返回接受和拒绝的条数（被拒绝的记录附带下标和原因）
+    """
+    if len(batch.items) > CHAT_LOG_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"单次最多写入 {CHAT_LOG_BATCH_MAX_ITEMS} 条日志，当前 {len(batch.items)} 条"
+        )
+    
+    rows = []
+    errors = []
+    for index, item in enumerate(batch.items):
+        try:
+            rows.append(ChatLogCreate.model_validate(item).model_dump())
+        except ValidationError as e:
+            message = "; ".join(
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+            errors.append(ChatLogBatchError(index=index, error=message))
+    
+    if rows:
+        try:
+            # Core 层 executemany：所有记录使用同一列集合，驱动会合并为多行 INSERT
+            db.execute(ChatLog.__table__.insert(), rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"批量创建聊天日志失败: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"批量创建日志失败: {str(e)}")
+    
+    if errors:
+        logger.warning(f"批量创建聊天日志: 接受 {len(rows)} 条，拒绝 {len(errors)} 条")
+    
+    return ChatLogBatchResult(accepted=len(rows), rejected=len(errors), errors=errors)
+
 @router.get("/", response_model=dict)
 async def get_chat_logs(
     skip: int = 0,
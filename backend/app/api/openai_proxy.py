@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import httpx
 import logging
@@ -7,6 +8,13 @@ from fastapi import FastAPI, Request, Depends, HTTPException, status
 from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+try:
+    from app.utils.sse import DONE_PAYLOAD, SSETail
+except ImportError:
+    # 作为独立脚本运行（python app/api/openai_proxy.py）时 backend 目录不在模块搜索路径中
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from app.utils.sse import DONE_PAYLOAD, SSETail
+
 # --- 配置 ---
 # 日志文件路径：基于当前脚本所在目录
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -139,27 +147,22 @@ async def proxy_to_vllm(request: Request, path: str):
 
 
 async def stream_response_generator(vllm_response, request_data):
-    """用于流式响应的异步生成器"""
-    full_response_content = ""
+    """用于流式响应的异步生成器：原样转发字节，只保留末尾部分用于解析 usage"""
+    tail = SSETail()
     try:
         async for chunk in vllm_response.aiter_bytes():
-            full_response_content += chunk.decode('utf-8', errors='ignore')
+            tail.feed(chunk)
             yield chunk
     finally:
         await vllm_response.aclose()
         logger.info("vLLM 流式连接已关闭")
 
-    # ... (usage 解析逻辑保持不变)
+    # usage 在最后一个数据块中，只对包含 usage 的块做 JSON 解析
     try:
-        final_data = {}
-        lines = full_response_content.strip().split('\n\n')
-        for line in reversed(lines):
-            if line.startswith("data: "):
-                content = line[len("data: "):].strip()
-                if content and content != "[DONE]":
-                    final_data = json.loads(content)
-                    break
-        usage = final_data.get("usage")
+        usage = None
+        for payload in tail.events():
+            if '"usage"' in payload and payload != DONE_PAYLOAD:
+                usage = json.loads(payload).get("usage") or usage
         if usage:
             logger.info(f"流式请求完成 - Tokens: {usage.get('total_tokens', 0)}")
     except Exception as e:
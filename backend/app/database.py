@@ -36,3 +36,4 @@ def get_db():
         yield db
     finally:
         db.close()
+
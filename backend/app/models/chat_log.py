@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, JSON, Text
+from sqlalchemy import Column, Integer, String, DateTime, Float, JSON, Text, Boolean
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -21,3 +21,19 @@ class ChatLog(Base):
     
     # 耗时
     duration = Column(Float, comment="调用接口到返回消耗的时间(秒)")
+    
+    # 生成状态：completed / aborted（客户端断开等）/ failed（上游出错）
+    status = Column(String(20), nullable=True, comment="生成状态")
+    abort_reason = Column(String(255), nullable=True, comment="中止或失败原因")
+    
+    # token 用量与吞吐（TTFT 为上游请求发出到首个 token 的秒数，速率为 completion tokens/秒）
+    proprietary_prompt_tokens = Column(Integer, nullable=True, comment="专有模型 prompt token 数")
+    proprietary_completion_tokens = Column(Integer, nullable=True, comment="专有模型 completion token 数")
+    proprietary_ttft = Column(Float, nullable=True, comment="专有模型首 token 时间(秒)")
+    proprietary_tokens_per_second = Column(Float, nullable=True, comment="专有模型生成速率(token/秒)")
+    general_prompt_tokens = Column(Integer, nullable=True, comment="通用模型 prompt token 数")
+    general_completion_tokens = Column(Integer, nullable=True, comment="通用模型 completion token 数")
+    general_ttft = Column(Float, nullable=True, comment="通用模型首 token 时间(秒)")
+    general_tokens_per_second = Column(Float, nullable=True, comment="通用模型生成速率(token/秒)")
+    total_tokens = Column(Integer, nullable=True, comment="各阶段 token 总数")
+    usage_estimated = Column(Boolean, nullable=True, comment="token 数是否为本地估算（上游未返回 usage）")
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 class ChatLogBase(BaseModel):
@@ -9,6 +9,19 @@ class ChatLogBase(BaseModel):
     general_params: Optional[Dict[str, Any]] = None
     general_response: Optional[str] = None
     duration: float
+    status: Optional[str] = Field(None, max_length=20)  # completed / aborted / failed / timeout / requeued，与 chat_logs.status 列宽一致
+    abort_reason: Optional[str] = Field(None, max_length=255)  # 与 chat_logs.abort_reason 列宽一致
+    # token 用量与吞吐
+    proprietary_prompt_tokens: Optional[int] = None
+    proprietary_completion_tokens: Optional[int] = None
+    proprietary_ttft: Optional[float] = None
+    proprietary_tokens_per_second: Optional[float] = None
+    general_prompt_tokens: Optional[int] = None
+    general_completion_tokens: Optional[int] = None
+    general_ttft: Optional[float] = None
+    general_tokens_per_second: Optional[float] = None
+    total_tokens: Optional[int] = None
+    usage_estimated: Optional[bool] = None
 
 class ChatLogCreate(ChatLogBase):
     pass
@@ -19,3 +32,21 @@ class ChatLog(ChatLogBase):
 
     class Config:
         from_attributes = True
+
+
+class ChatLogBatchCreate(BaseModel):
+    """批量写入聊天日志请求"""
+    items: List[Dict[str, Any]]
+
+
+class ChatLogBatchError(BaseModel):
+    """批量写入中被拒绝的记录"""
+    index: int
+    error: str
+
+
+class ChatLogBatchResult(BaseModel):
+    """批量写入聊天日志结果"""
+    accepted: int
+    rejected: int
+    errors: List[ChatLogBatchError] = []
@@ -0,0 +1,186 @@
+"""
+SSE 编解码
+workflow-ctl 与 backend 的 OpenAI 代理共用同一份实现（两边各保留一份副本）。
+
+编码：
+- 事件头 "event: xxx\\ndata: " 预先渲染并缓存
+- 内容块只对增量文本做 JSON 字符串转义，不再每个 token 序列化一个 dict
+- DeltaCoalescer 把多个增量合并成一帧（按字符数或时间间隔），减少帧数和写次数
+
+解码：
+- SSEDecoder 直接处理上游字节流，按换行切分后才解码 UTF-8，
+  不依赖 httpx 的逐行文本解码，也不会切断多字节字符
+- parse_chunk / parse_delta_content 从 chat.completions 流式块中取出增量文本和 usage
+- SSETail 只保留流末尾的字节，结束时再解析（代理只需要最后一块中的 usage）
+"""
+import json
+import time
+from collections import deque
+from json.encoder import encode_basestring
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DONE_PAYLOAD = "[DONE]"
+
+_event_prefixes: Dict[str, str] = {}
+
+
+def event_prefix(event: str) -> str:
+    """预渲染的事件头"""
+    prefix = _event_prefixes.get(event)
+    if prefix is None:
+        prefix = _event_prefixes[event] = f"event: {event}\ndata: "
+    return prefix
+
+
+def encode_event(data: Dict[str, Any], event: str = "message") -> str:
+    """编码一个 SSE 事件"""
+    return event_prefix(event) + json.dumps(data, ensure_ascii=False) + "\n\n"
+
+
+def _content_template(event: str, content_type: str) -> str:
+    return event_prefix(event) + '{"type": ' + encode_basestring(content_type) + ', "content": '
+
+
+_content_prefixes: Dict[tuple, str] = {}
+
+
+def encode_content(content: str, event: str = "message", content_type: str = "content") -> str:
+    """
+    编码内容块事件，输出与 encode_event({"type": content_type, "content": content}, event) 完全一致，
+    但只需转义增量文本本身
+    """
+    key = (event, content_type)
+    prefix = _content_prefixes.get(key)
+    if prefix is None:
+        prefix = _content_prefixes[key] = _content_template(event, content_type)
+    return prefix + encode_basestring(content) + "}\n\n"
+
+
+class DeltaCoalescer:
+    """
+    增量合并：累计的文本达到 max_chars，或距离本帧第一个增量超过 max_delay 秒时输出一帧
+
+    时间条件在下一个增量到达时检查；流结束时调用 flush() 输出剩余内容。
+    max_chars 和 max_delay 都为 0 时不合并，每个增量单独成帧。
+    """
+
+    def __init__(self, max_chars: int = 0, max_delay: float = 0.0):
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self._parts: List[str] = []
+        self._size = 0
+        self._first_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_chars > 0 or self.max_delay > 0
+
+    def add(self, content: str) -> Optional[str]:
+        """加入一个增量，满足输出条件时返回合并后的文本"""
+        if not self.enabled:
+            return content
+        if not self._parts:
+            self._first_at = time.monotonic()
+        self._parts.append(content)
+        self._size += len(content)
+        if (self.max_chars and self._size >= self.max_chars) or (
+            self.max_delay and time.monotonic() - self._first_at >= self.max_delay
+        ):
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """输出尚未成帧的内容"""
+        if not self._parts:
+            return None
+        frame = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        return frame
+
+
+class SSEDecoder:
+    """增量 SSE 解码器：喂入上游字节块，产出每个事件的 data 内容"""
+
+    def __init__(self):
+        self._buffer = b""
+        self._data: List[str] = []
+
+    def feed(self, chunk: bytes) -> Iterator[str]:
+        """解析字节块中所有完整的事件，返回其 data 字段（多行 data 以换行拼接）"""
+        buffer = self._buffer + chunk if self._buffer else chunk
+        lines = buffer.split(b"\n")
+        self._buffer = lines.pop()
+        for raw in lines:
+            if raw.endswith(b"\r"):
+                raw = raw[:-1]
+            if not raw:
+                # 空行：一个事件结束
+                if self._data:
+                    data = "\n".join(self._data) if len(self._data) > 1 else self._data[0]
+                    self._data = []
+                    yield data
+                continue
+            if raw.startswith(b"data:"):
+                value = raw[5:]
+                if value.startswith(b" "):
+                    value = value[1:]
+                self._data.append(value.decode("utf-8", errors="replace"))
+            # event:/id:/retry: 和注释行在 chat.completions 流中不携带内容，忽略
+
+    def close(self) -> Iterator[str]:
+        """流结束：输出缓冲区中最后一个未以空行结束的事件"""
+        if self._buffer:
+            tail, self._buffer = self._buffer, b""
+            yield from self.feed(tail + b"\n\n")
+        elif self._data:
+            yield from self.feed(b"\n")
+
+
+class SSETail:
+    """
+    保留流末尾至少 max_bytes 字节的原始数据，流结束后解析其中的完整事件
+
+    转发过程中每个块只做一次 append，不解码、不拼接全文；
+    末尾被截断的第一个事件会被跳过。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024):
+        self.max_bytes = max_bytes
+        self._chunks = deque()
+        self._size = 0
+        self._truncated = False
+
+    def feed(self, chunk: bytes):
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        while len(self._chunks) > 1 and self._size - len(self._chunks[0]) >= self.max_bytes:
+            self._size -= len(self._chunks.popleft())
+            self._truncated = True
+
+    def events(self) -> List[str]:
+        """解析保留部分中的所有完整事件的 data"""
+        data = b"".join(self._chunks)
+        if self._truncated:
+            boundary = data.find(b"\n\n")
+            data = data[boundary + 2:] if boundary >= 0 else b""
+        decoder = SSEDecoder()
+        payloads = list(decoder.feed(data))
+        payloads.extend(decoder.close())
+        return payloads
+
+
+def parse_chunk(payload: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    解析 chat.completions 流式块，返回 (增量文本, usage)，没有的部分为 None
+    （JSON 无效时抛出 ValueError；usage 在 stream_options.include_usage 时随最后一块返回）
+    """
+    data = json.loads(payload)
+    choices = data.get("choices")
+    content = (choices[0].get("delta") or {}).get("content") or None if choices else None
+    return content, data.get("usage") or None
+
+
+def parse_delta_content(payload: str) -> Optional[str]:
+    """从 chat.completions 流式块中取出增量文本，无内容时返回 None（JSON 无效时抛出 ValueError）"""
+    return parse_chunk(payload)[0]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+chat_logs 表结构迁移脚本
+create_all 只会创建不存在的表，不会修改已有表。升级已有数据库时，
+在启动新版本服务前手动执行一次，为 chat_logs 补充新增的列。
+已存在的列会跳过，可重复执行。
+"""
+
+from sqlalchemy import inspect, text
+from app.database import engine
+from app.models.chat_log import ChatLog
+
+# 需要补充的列（均可为空，已有记录以 NULL 填充）
+CHAT_LOG_COLUMNS = [
+    # 生成状态与中止原因
+    "status",
+    "abort_reason",
+    # token 用量与吞吐
+    "proprietary_prompt_tokens",
+    "proprietary_completion_tokens",
+    "proprietary_ttft",
+    "proprietary_tokens_per_second",
+    "general_prompt_tokens",
+    "general_completion_tokens",
+    "general_ttft",
+    "general_tokens_per_second",
+    "total_tokens",
+    "usage_estimated",
+]
+
+
+def _existing_columns(bind):
+    return {c["name"] for c in inspect(bind).get_columns(ChatLog.__tablename__)}
+
+
+def migrate_chat_logs(bind=engine):
+    """为 chat_logs 补充缺少的列，返回本次新增的列名"""
+    if not inspect(bind).has_table(ChatLog.__tablename__):
+        print(f"表 {ChatLog.__tablename__} 不存在，请先运行 python init_db.py")
+        return []
+    
+    added = []
+    existing = _existing_columns(bind)
+    for name in CHAT_LOG_COLUMNS:
+        if name in existing:
+            print(f"列已存在，跳过: {name}")
+            continue
+        column_type = ChatLog.__table__.c[name].type.compile(dialect=bind.dialect)
+        try:
+            with bind.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {ChatLog.__tablename__} ADD COLUMN {name} {column_type} NULL"))
+        except Exception:
+            # 其他进程同时执行了迁移时列已存在，视为完成
+            if name in _existing_columns(bind):
+                print(f"列已存在，跳过: {name}")
+                continue
+            raise
+        added.append(name)
+        print(f"已为表 {ChatLog.__tablename__} 补充列: {name} {column_type}")
+    
+    return added
+
+
+if __name__ == "__main__":
+    print("正在迁移 chat_logs 表结构...")
+    try:
+        migrate_chat_logs()
+        print("chat_logs 表结构迁移完成！")
+    except Exception as e:
+        print(f"chat_logs 表结构迁移失败: {e}")
+        raise SystemExit(1)
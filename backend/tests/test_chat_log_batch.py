@@ -0,0 +1,59 @@
+import pytest
+from fastapi import HTTPException
+
+from app.api import chat_log as chat_log_api
+from app.api.chat_log import create_chat_logs_batch
+from app.models.chat_log import ChatLog
+from app.schemas.chat_log import ChatLogBatchCreate
+
+
+def make_log(**fields):
+    return {"input_params": {"user_message": "hi"}, "duration": 1.5, **fields}
+
+
+def test_batch_inserts_all_valid_records(db):
+    items = [
+        make_log(status="completed", general_response="你好", total_tokens=12, usage_estimated=False),
+        make_log(status="aborted", abort_reason="client_disconnected"),
+        make_log(proprietary_params={"stages": []}),
+    ]
+    result = create_chat_logs_batch(ChatLogBatchCreate(items=items), db)
+    assert (result.accepted, result.rejected, result.errors) == (3, 0, [])
+
+    rows = db.query(ChatLog).order_by(ChatLog.id).all()
+    assert [row.status for row in rows] == ["completed", "aborted", None]
+    assert rows[0].general_response == "你好" and rows[0].total_tokens == 12
+    assert rows[1].abort_reason == "client_disconnected"
+    assert rows[2].proprietary_params == {"stages": []}
+    assert all(row.call_time is not None for row in rows)
+
+
+def test_invalid_records_rejected_with_index(db):
+    items = [
+        make_log(),
+        {"input_params": {}},
+        make_log(status="x" * 21),
+        make_log(abort_reason="x" * 256),
+        make_log(status="x" * 20, abort_reason="x" * 255),
+    ]
+    result = create_chat_logs_batch(ChatLogBatchCreate(items=items), db)
+    assert (result.accepted, result.rejected) == (2, 3)
+    assert [error.index for error in result.errors] == [1, 2, 3]
+    assert "duration" in result.errors[0].error
+    assert result.errors[1].error.startswith("status:")
+    assert result.errors[2].error.startswith("abort_reason:")
+    assert db.query(ChatLog).count() == 2
+
+
+def test_all_records_rejected_writes_nothing(db):
+    result = create_chat_logs_batch(ChatLogBatchCreate(items=[{"duration": "slow"}]), db)
+    assert (result.accepted, result.rejected) == (0, 1)
+    assert db.query(ChatLog).count() == 0
+
+
+def test_batch_size_limit(db, monkeypatch):
+    monkeypatch.setattr(chat_log_api, "CHAT_LOG_BATCH_MAX_ITEMS", 2)
+    with pytest.raises(HTTPException) as exc:
+        create_chat_logs_batch(ChatLogBatchCreate(items=[make_log()] * 3), db)
+    assert exc.value.status_code == 413
+    assert db.query(ChatLog).count() == 0
@@ -0,0 +1,74 @@
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import StaticPool
+
+import migrate_chat_logs
+from migrate_chat_logs import CHAT_LOG_COLUMNS, migrate_chat_logs as migrate
+
+
+def make_engine():
+    return create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+
+def columns(engine):
+    return {c["name"] for c in inspect(engine).get_columns("chat_logs")}
+
+
+def test_adds_missing_columns_and_keeps_rows():
+    engine = make_engine()
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE chat_logs (id INTEGER PRIMARY KEY, input_params JSON, duration FLOAT)"))
+        conn.execute(text("INSERT INTO chat_logs (input_params, duration) VALUES ('{}', 1.0)"))
+
+    assert migrate(engine) == CHAT_LOG_COLUMNS
+    assert set(CHAT_LOG_COLUMNS) <= columns(engine)
+    with engine.connect() as conn:
+        row = conn.execute(text(f"SELECT duration, {', '.join(CHAT_LOG_COLUMNS)} FROM chat_logs")).one()
+    assert row[0] == 1.0 and all(value is None for value in row[1:])
+
+    # 重复执行时已存在的列跳过
+    assert migrate(engine) == []
+
+
+def test_only_chat_logs_altered():
+    engine = make_engine()
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE chat_logs (id INTEGER PRIMARY KEY, status VARCHAR(20))"))
+        conn.execute(text("CREATE TABLE workflows (id INTEGER PRIMARY KEY)"))
+
+    assert "status" not in migrate(engine)
+    assert {c["name"] for c in inspect(engine).get_columns("workflows")} == {"id"}
+
+
+def test_column_added_concurrently_is_tolerated(monkeypatch):
+    engine = make_engine()
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE chat_logs (id INTEGER PRIMARY KEY)"))
+    # 模拟另一个进程在检查之后、ALTER 之前已补充了全部列
+    real_existing = migrate_chat_logs._existing_columns
+    calls = []
+
+    def existing_columns(bind):
+        calls.append(1)
+        if len(calls) == 1:
+            with bind.begin() as conn:
+                for name in CHAT_LOG_COLUMNS:
+                    conn.execute(text(f"ALTER TABLE chat_logs ADD COLUMN {name} TEXT NULL"))
+            return {"id"}
+        return real_existing(bind)
+
+    monkeypatch.setattr(migrate_chat_logs, "_existing_columns", existing_columns)
+    assert migrate(engine) == []
+
+
+def test_missing_table_skipped():
+    assert migrate(make_engine()) == []
+
+
+def test_columns_cover_model():
+    from app.models.chat_log import ChatLog
+
+    # 基线之后新增的可空列都需要由迁移脚本补充
+    baseline = {"id", "call_time", "input_params", "proprietary_params", "proprietary_response",
+                "general_params", "general_response", "duration"}
+    assert set(CHAT_LOG_COLUMNS) == {c.name for c in ChatLog.__table__.columns} - baseline
+    assert all(ChatLog.__table__.c[name].nullable for name in CHAT_LOG_COLUMNS)
@@ -21,6 +21,7 @@ pip install -r requirements.txt
 
 echo "🗄️ 初始化数据库..."
 python init_db.py
+python migrate_chat_logs.py
 
 echo "🔧 启动后端服务..."
 python main.py &
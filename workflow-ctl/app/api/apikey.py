@@ -6,7 +6,7 @@ from app.database.database import get_db
 from app.models.apikey import ApiKey
 from app.schemas.apikey import ApiKeySync, ApiKey as ApiKeySchema
 from app.schemas.common import Response
-from app.middleware.auth import verify_api_key_dependency
+from app.middleware.auth import verify_api_key_dependency, invalidate_api_key_cache
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -39,6 +39,7 @@ def sync_apikey(
     if existing:
         # 更新现有记录（基于 external_id）
         logger.info(f"发现现有记录（基于 external_id），准备更新: id={existing.id}, external_id={apikey.external_id}")
+        old_key = existing.key
         
         # 如果 key 改变，检查新 key 是否已存在于其他记录中
         if existing.key != apikey.key:
@@ -69,6 +70,7 @@ def sync_apikey(
         existing.status = apikey.status
         db.commit()
         db.refresh(existing)
+        invalidate_api_key_cache(old_key, apikey.key)
         
         logger.info(f"API Key 更新成功: id={existing.id}, external_id={apikey.external_id}")
         logger.info(f"更新前: {old_data}")
@@ -101,6 +103,7 @@ def sync_apikey(
             existing_by_key.status = apikey.status
             db.commit()
             db.refresh(existing_by_key)
+            invalidate_api_key_cache(apikey.key)
             
             logger.info(f"API Key 更新成功（基于 key）: id={existing_by_key.id}, external_id={apikey.external_id}")
             logger.info(f"更新前: {old_data}")
@@ -125,6 +128,8 @@ def sync_apikey(
             db.add(db_apikey)
             db.commit()
             db.refresh(db_apikey)
+            # 清除可能存在的负缓存
+            invalidate_api_key_cache(apikey.key)
             
             logger.info(f"API Key 创建成功: id={db_apikey.id}, external_id={apikey.external_id}")
             
@@ -154,8 +159,10 @@ def delete_apikey_by_external_id(
     
     logger.info(f"找到要删除的 API Key: id={db_apikey.id}, name={db_apikey.name}")
     
+    deleted_key = db_apikey.key
     db.delete(db_apikey)
     db.commit()
+    invalidate_api_key_cache(deleted_key)
     
     logger.info(f"API Key 删除成功: external_id={external_id}")
     
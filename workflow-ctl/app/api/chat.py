@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, Query, Body, Header
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Sequence, Tuple
+import asyncio
 import logging
 import json
-import requests
+import os
+import httpx
 import time
 from datetime import datetime
 from app.database.database import get_db
@@ -18,6 +20,35 @@ from app.schemas.llm_provider import LLMProvider as LLMProviderSchema
 from app.middleware.auth import verify_api_key_dependency
 from app.config import PROXY_BASE_URL, PROXY_API_KEY, PROXY_LOGS_URL
 from app.utils.crypto import decrypt_api_key
+from app.utils.http_client import get_http_client, UPSTREAM_CONNECT_TIMEOUT
+from app.utils.sse import (
+    DONE_PAYLOAD, DeltaCoalescer, SSEDecoder, encode_content, encode_event, event_prefix, parse_chunk
+)
+from app.utils.admission import AdmissionRejected, admission_slot, get_admission, get_admission_stats
+from app.utils.provider_pool import MODE_COMPLETE, MODE_STREAM, provider_router
+from app.utils.hedging import HEDGE_DEFAULT_QUANTILE, stage1_hedger
+from app.utils.token_usage import GenerationMeter
+from app.utils.chunking import split_paragraphs
+from app.utils.model_routing import THRESHOLD_STAGE1, ModelRoute, fast_model_stats, select_model
+from app.utils.deadline import (
+    CHAT_STAGE1_BUDGET_SHARE, CHAT_STAGE2_MIN_BUDGET, TIMEOUT_HEADER,
+    Deadline, DeadlineExceeded, iter_with_deadline, resolve_timeout
+)
+from app.utils.pipeline import (
+    STAGE_MODEL, USER_MESSAGE, Pipeline, PipelineError, PipelineStage, parse_pipeline, render_template, run_transform
+)
+from app.utils.circuit_breaker import (
+    CircuitOpenError, get_breaker, get_breaker_stats, get_max_retries, retry_backoff
+)
+from app.storage.config_snapshot import PromptConfig, get_config_snapshot
+from app.storage.chat_log_shipper import chat_log_shipper
+from app.storage.result_cache import stage1_cache, make_cache_key, STAGE1_CACHE_DEFAULT_TTL
+from app.storage.single_flight import chat_flights, make_flight_key, CHAT_COALESCE_DEFAULT_WINDOW
+from app.storage.replay_buffer import parse_last_event_id, sse_streams
+from app.storage.chat_jobs import CANCEL_REASON_SHUTDOWN, current_job
+from app.storage.chat_sessions import (
+    CHAT_SESSION_HISTORY_TOKENS, CHAT_SESSION_HISTORY_TURNS, CHAT_SESSION_MAX_HISTORY_TURNS, chat_sessions, trim_history
+)
 from pydantic import BaseModel
 
 # 配置日志
@@ -27,6 +58,38 @@ router = APIRouter()
 
 PROXY_URL = f"{PROXY_BASE_URL}/v1/chat/completions"
 
+# SSE 心跳间隔（秒）：流中超过该时间没有事件时发送注释行，防止 nginx 等代理因空闲断开连接
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", 5.0))
+SSE_HEARTBEAT = ": heartbeat\n\n"
+
+# 流式调用是否请求上游在最后一块返回 usage（stream_options.include_usage），上游不支持时可关闭
+UPSTREAM_STREAM_USAGE = os.getenv("UPSTREAM_STREAM_USAGE", "true").lower() in ("1", "true", "yes")
+
+# 聊天日志中止原因的最大长度（chat_logs.abort_reason 为 VARCHAR(255)）
+CHAT_LOG_ABORT_REASON_MAX = 255
+
+# 长文本分块（第一步 map）：默认每块字符数、默认并发数和并发上限
+CHAT_CHUNK_DEFAULT_MAX_CHARS = int(os.getenv("CHAT_CHUNK_DEFAULT_MAX_CHARS", 4000))
+CHAT_CHUNK_DEFAULT_CONCURRENCY = int(os.getenv("CHAT_CHUNK_DEFAULT_CONCURRENCY", 4))
+CHAT_CHUNK_MAX_CONCURRENCY = int(os.getenv("CHAT_CHUNK_MAX_CONCURRENCY", 16))
+
+# 批量聊天：单次最多条目数、并发数默认值和上限（按 worker 进程计算）
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", 10000))
+CHAT_BATCH_DEFAULT_CONCURRENCY = int(os.getenv("CHAT_BATCH_DEFAULT_CONCURRENCY", 4))
+CHAT_BATCH_MAX_CONCURRENCY = int(os.getenv("CHAT_BATCH_MAX_CONCURRENCY", 32))
+# 批量模式下按较大的帧合并增量，结果只取 done 事件中的完整内容
+CHAT_BATCH_SSE_OPTIONS = {"frame_chars": 4096, "frame_delay": 0.0, "include_full_content": True}
+
+# 流式响应公共响应头
+SSE_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*",
+    "Access-Control-Allow-Methods": "*",
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
 # 文风选项数据（与前端保持一致）
 WRITING_STYLES = [
     {
@@ -87,24 +150,373 @@ class ChatRequest(BaseModel):
     user_message: str  # 用户消息
     workflowId: Optional[str] = None  # workflow ID（可选，如果提供则使用对应的 workflow）
     writing_style: Optional[str] = None  # 文风（可选）
+    stream_stage1: Optional[bool] = None  # 是否转发专有模型（第一步）的 token，为空时使用 Workflow.config 中的 stage1_relay
+    include_full_content: Optional[bool] = None  # done 事件是否附带完整内容，为空时使用 Workflow.config 中的 sse.full_content
+    fast: Optional[bool] = None  # 是否使用快速模型（fast_default_model_name），为空时按 provider 配置的长度阈值路由
+    session_id: Optional[str] = None  # 会话 id（可选），提供时带上服务端保存的历史，user_message 只需包含新的一轮
+
+
+class ChatBatchRequest(BaseModel):
+    """批量聊天请求模型"""
+    items: List[ChatRequest]  # 聊天请求列表，逐条按各自的 workflowId / writing_style 处理
+    concurrency: Optional[int] = None  # 同时进行的生成数，为空时使用 CHAT_BATCH_DEFAULT_CONCURRENCY
 
 
 def generate_sse_event(data: Dict[str, Any], event: str = "message") -> str:
     """生成 SSE 格式的事件数据"""
-    event_data = json.dumps(data, ensure_ascii=False)
-    return f"event: {event}\ndata: {event_data}\n\n"
+    return encode_event(data, event)
 
 
 def save_chat_log(log_data: Dict[str, Any]):
-    """调用 Backend API 保存日志"""
+    """提交聊天日志到后台发送队列，由 chat_log_shipper 批量回传 Backend（不阻塞响应）"""
     try:
-        # 假设 Backend 运行在本地 8888 端口，实际应从配置读取
-        backend_url = "http://localhost:8888/api/chat-logs/"
-        requests.post(backend_url, json=log_data, timeout=5)
+        chat_log_shipper.submit(log_data)
     except Exception as e:
         logger.error(f"保存聊天日志失败: {str(e)}")
 
 
+def finalize_chat_log(
+    log_info: Optional[Dict[str, Any]],
+    status: str = "completed",
+    reason: Optional[str] = None,
+    stage: Optional[str] = None
+):
+    """
+    补全耗时和生成状态后提交聊天日志，每个请求只提交一次
+    
+    Args:
+        status: completed / aborted（客户端断开）/ failed（上游出错）/ timeout（超出时间预算）/
+            requeued（异步任务因 worker 退出放回队列，由 finalize_chat_log 根据当前任务判断）
+        reason: 中止或失败原因
+        stage: 中止或失败发生的阶段（proprietary / general），记录在该阶段参数中
+    """
+    if not log_info or "start_time" not in log_info:
+        return
+    job = current_job.get()
+    if status == "aborted" and job is not None and job.cancel_reason:
+        # 异步任务中没有客户端连接，中止来自任务被取消、被接手或进程退出
+        reason = job.cancel_reason
+        if reason == CANCEL_REASON_SHUTDOWN:
+            status = "requeued"
+    try:
+        log_info["duration"] = time.time() - log_info["start_time"]
+        log_info["status"] = status
+        # 与 chat_logs.abort_reason 列宽一致，过长的上游错误信息截断后再提交
+        log_info["abort_reason"] = reason[:CHAT_LOG_ABORT_REASON_MAX] if reason else reason
+        if stage and isinstance(log_info.get(f"{stage}_params"), dict):
+            log_info[f"{stage}_params"]["status"] = status
+        apply_usage_fields(log_info)
+        
+        # 移除临时字段
+        log_info.pop("workflow_type", None)
+        log_info.pop("start_time", None)
+        log_info.pop("writing_style_info", None)
+        
+        save_chat_log(log_info)
+    except Exception as e:
+        logger.error(f"记录日志出错: {str(e)}")
+
+
+def apply_usage_fields(log_info: Dict[str, Any]):
+    """把各阶段参数中的 usage 展开为 ChatLog 的结构化字段（token 数、TTFT、生成速率）"""
+    total_tokens = None
+    estimated = None
+    for stage in ("proprietary", "general"):
+        params = log_info.get(f"{stage}_params")
+        usage = params.get("usage") if isinstance(params, dict) else None
+        if not usage:
+            continue
+        log_info[f"{stage}_prompt_tokens"] = usage["prompt_tokens"]
+        log_info[f"{stage}_completion_tokens"] = usage["completion_tokens"]
+        log_info[f"{stage}_ttft"] = usage["ttft"]
+        log_info[f"{stage}_tokens_per_second"] = usage["tokens_per_second"]
+        total_tokens = (total_tokens or 0) + usage["total_tokens"]
+        estimated = bool(estimated) or usage["source"] == "estimate"
+    log_info["total_tokens"] = total_tokens
+    log_info["usage_estimated"] = estimated
+
+
+def get_stage1_cache_config(workflow_config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    从 Workflow.config 中读取专有模型结果缓存配置，未启用时返回 None
+    
+    配置格式: {"stage1_cache": {"enabled": true, "ttl": 3600}}
+    """
+    if not isinstance(workflow_config, dict):
+        return None
+    cache_config = workflow_config.get("stage1_cache")
+    if not isinstance(cache_config, dict) or not cache_config.get("enabled"):
+        return None
+    try:
+        ttl = float(cache_config.get("ttl", STAGE1_CACHE_DEFAULT_TTL))
+    except (ValueError, TypeError):
+        ttl = STAGE1_CACHE_DEFAULT_TTL
+    return {"ttl": ttl}
+
+
+def get_coalesce_config(workflow_config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    从 Workflow.config 中读取相同请求合并配置，未启用时返回 None
+    
+    配置格式: {"coalesce": {"enabled": true, "window": 30}}
+    window 为合并窗口（秒）：生成开始后超过该时间到达的相同请求不再合并
+    """
+    if not isinstance(workflow_config, dict):
+        return None
+    coalesce_config = workflow_config.get("coalesce")
+    if not isinstance(coalesce_config, dict) or not coalesce_config.get("enabled"):
+        return None
+    try:
+        window = float(coalesce_config.get("window", CHAT_COALESCE_DEFAULT_WINDOW))
+    except (ValueError, TypeError):
+        window = CHAT_COALESCE_DEFAULT_WINDOW
+    return {"window": window}
+
+
+def get_sse_options(workflow_config: Optional[Dict[str, Any]], include_full_content: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    从 Workflow.config 中读取 SSE 输出选项
+    
+    配置格式: {"sse": {"frame_chars": 32, "frame_ms": 50, "full_content": false}}
+    - frame_chars / frame_ms: 增量累计到指定字符数或时间间隔后合并为一个事件发送，默认不合并
+    - full_content: done 事件是否附带完整内容，默认附带；请求中的 include_full_content 优先
+    """
+    sse_config = workflow_config.get("sse") if isinstance(workflow_config, dict) else None
+    if not isinstance(sse_config, dict):
+        sse_config = {}
+    try:
+        frame_chars = max(int(sse_config.get("frame_chars", 0)), 0)
+        frame_delay = max(float(sse_config.get("frame_ms", 0)), 0.0) / 1000
+    except (ValueError, TypeError):
+        logger.warning(f"Workflow.config.sse 配置无效: {sse_config}，不合并增量")
+        frame_chars, frame_delay = 0, 0.0
+    if include_full_content is None:
+        include_full_content = bool(sse_config.get("full_content", True))
+    return {
+        "frame_chars": frame_chars,
+        "frame_delay": frame_delay,
+        "include_full_content": include_full_content
+    }
+
+
+def get_resume_grace(workflow_config: Optional[Dict[str, Any]]) -> Optional[float]:
+    """
+    从 Workflow.config 中读取断线续传的等待时间（秒），未配置时返回 None（使用 SSE_RESUME_GRACE）
+    
+    配置格式: {"sse": {"resume_grace": 30}}
+    大于 0 时客户端断开后生成继续执行该秒数等待重连；0 表示断开即取消生成
+    """
+    sse_config = workflow_config.get("sse") if isinstance(workflow_config, dict) else None
+    if not isinstance(sse_config, dict) or sse_config.get("resume_grace") in (None, ""):
+        return None
+    try:
+        return max(float(sse_config["resume_grace"]), 0.0)
+    except (ValueError, TypeError):
+        logger.warning(f"Workflow.config.sse.resume_grace 配置无效: {sse_config['resume_grace']}，使用默认值")
+        return None
+
+
+def get_hedge_config(workflow_config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    从 Workflow.config 中读取专有模型（第一步，非流式）对冲请求配置，未启用时返回 None
+    
+    配置格式: {"stage1_hedge": {"enabled": true, "delay_ms": 1500}}
+    或 {"stage1_hedge": {"enabled": true, "quantile": 0.95}}
+    未配置 delay_ms 时按最近调用延迟的分位数（默认 p95）决定何时发出对冲请求
+    """
+    if not isinstance(workflow_config, dict):
+        return None
+    hedge_config = workflow_config.get("stage1_hedge")
+    if not isinstance(hedge_config, dict) or not hedge_config.get("enabled"):
+        return None
+    try:
+        delay = hedge_config.get("delay_ms")
+        delay = float(delay) / 1000 if delay not in (None, "") else None
+        quantile = min(max(float(hedge_config.get("quantile", HEDGE_DEFAULT_QUANTILE)), 0.0), 1.0)
+    except (ValueError, TypeError):
+        logger.warning(f"Workflow.config.stage1_hedge 配置无效: {hedge_config}，使用默认值")
+        delay, quantile = None, HEDGE_DEFAULT_QUANTILE
+    return {"delay": delay, "quantile": quantile}
+
+
+def get_chunk_config(workflow_config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    从 Workflow.config 中读取长文本分块配置（仅 proprietary->general 流程），未启用时返回 None
+    
+    配置格式: {"stage1_chunking": {"enabled": true, "max_chars": 4000, "concurrency": 4, "separator": "\n\n"}}
+    user_message 超过 max_chars 时按段落切块，各块并发调用专有模型，结果用 separator 按原文顺序拼接
+    """
+    if not isinstance(workflow_config, dict):
+        return None
+    chunk_config = workflow_config.get("stage1_chunking")
+    if not isinstance(chunk_config, dict) or not chunk_config.get("enabled"):
+        return None
+    try:
+        max_chars = int(chunk_config.get("max_chars", CHAT_CHUNK_DEFAULT_MAX_CHARS))
+        concurrency = int(chunk_config.get("concurrency", CHAT_CHUNK_DEFAULT_CONCURRENCY))
+    except (ValueError, TypeError):
+        logger.warning(f"Workflow.config.stage1_chunking 配置无效: {chunk_config}，使用默认值")
+        max_chars, concurrency = CHAT_CHUNK_DEFAULT_MAX_CHARS, CHAT_CHUNK_DEFAULT_CONCURRENCY
+    separator = chunk_config.get("separator", "\n\n")
+    return {
+        "max_chars": max(max_chars, 1),
+        "concurrency": min(max(concurrency, 1), CHAT_CHUNK_MAX_CONCURRENCY),
+        "separator": separator if isinstance(separator, str) else "\n\n"
+    }
+
+
+def build_chunked_messages(
+    prompt,
+    text: str,
+    suffix: str,
+    chunk_config: Optional[Dict[str, Any]],
+    history: Optional[List[Dict[str, str]]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    按分块配置把长文本切块并分别渲染提示词，文本不需要切分时返回 None
+    
+    suffix（文风信息）拼接到每一块后面，保证各块使用相同的写作要求；会话历史（history）带在每一块中
+    """
+    if not chunk_config:
+        return None
+    chunks = split_paragraphs(text, chunk_config["max_chars"])
+    if len(chunks) <= 1:
+        return None
+    return {
+        "messages": [build_messages(prompt, chunk + suffix, history) for chunk in chunks],
+        "chars": [len(chunk) for chunk in chunks],
+        "concurrency": chunk_config["concurrency"],
+        "separator": chunk_config["separator"]
+    }
+
+
+def get_session_config(workflow_config: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    从 Workflow.config 中读取会话历史的裁剪配置
+    
+    配置格式: {"session": {"history_tokens": 4000, "history_turns": 20}}
+    每轮从最近的历史往前选取，估算 token 数不超过 history_tokens、轮数不超过 history_turns
+    """
+    session_config = workflow_config.get("session") if isinstance(workflow_config, dict) else None
+    if not isinstance(session_config, dict):
+        session_config = {}
+    try:
+        history_tokens = int(session_config.get("history_tokens", CHAT_SESSION_HISTORY_TOKENS))
+        history_turns = int(session_config.get("history_turns", CHAT_SESSION_HISTORY_TURNS))
+    except (ValueError, TypeError):
+        logger.warning(f"Workflow.config.session 配置无效: {session_config}，使用默认值")
+        history_tokens, history_turns = CHAT_SESSION_HISTORY_TOKENS, CHAT_SESSION_HISTORY_TURNS
+    return {
+        "history_tokens": max(history_tokens, 0),
+        "history_turns": min(max(history_turns, 0), CHAT_SESSION_MAX_HISTORY_TURNS)
+    }
+
+
+def get_deadline(workflow_config: Optional[Dict[str, Any]], requested_timeout: Optional[str] = None) -> Optional[Deadline]:
+    """
+    确定本次请求的整体截止时间，不限制时返回 None
+    
+    配置格式: {"deadline": {"timeout": 120, "stage1_share": 0.6, "stage2_min": 10}}
+    - timeout: 整体超时（秒），请求头 X-Request-Timeout 优先，都未设置时使用 CHAT_DEFAULT_TIMEOUT
+    - stage1_share: 第一步可使用剩余时间的比例；stage2_min: 至少留给第二步的秒数
+    """
+    deadline_config = workflow_config.get("deadline") if isinstance(workflow_config, dict) else None
+    if not isinstance(deadline_config, dict):
+        deadline_config = {}
+    
+    requested = None
+    if requested_timeout not in (None, ""):
+        try:
+            requested = float(requested_timeout)
+        except (ValueError, TypeError):
+            requested = -1.0
+        if requested <= 0:
+            raise HTTPException(status_code=400, detail=f"{TIMEOUT_HEADER} 必须是大于 0 的秒数")
+    
+    try:
+        configured = deadline_config.get("timeout")
+        configured = float(configured) if configured not in (None, "") else None
+        stage1_share = min(max(float(deadline_config.get("stage1_share", CHAT_STAGE1_BUDGET_SHARE)), 0.05), 1.0)
+        stage2_min = max(float(deadline_config.get("stage2_min", CHAT_STAGE2_MIN_BUDGET)), 0.0)
+    except (ValueError, TypeError):
+        logger.warning(f"Workflow.config.deadline 配置无效: {deadline_config}，使用默认值")
+        configured, stage1_share, stage2_min = None, CHAT_STAGE1_BUDGET_SHARE, CHAT_STAGE2_MIN_BUDGET
+    
+    timeout = resolve_timeout(requested, configured)
+    if timeout is None:
+        return None
+    return Deadline(timeout, stage1_share, stage2_min)
+
+
+def check_admission(providers: Sequence):
+    """
+    开始生成前的快速检查：池中没有可用上游时直接拒绝
+    
+    有上游等待队列已满时返回 429，所有上游都处于熔断中时返回 503，均带 Retry-After
+    """
+    rejections = []
+    for provider in providers:
+        breaker = get_breaker(provider)
+        if not breaker.available():
+            rejections.append(CircuitOpenError(f"上游 {breaker.name} 熔断中，暂停请求", breaker.retry_after()))
+            continue
+        try:
+            get_admission(provider).check()
+            return
+        except AdmissionRejected as e:
+            rejections.append(e)
+    if rejections:
+        e = min(rejections, key=lambda r: r.retry_after)
+        status_code = 429 if any(isinstance(r, AdmissionRejected) for r in rejections) else 503
+        logger.warning(f"上游不可用: {str(e)}")
+        raise HTTPException(
+            status_code=status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+def is_stage1_relay_enabled(workflow_config: Optional[Dict[str, Any]], override: Optional[bool] = None) -> bool:
+    """
+    是否以 stage1 事件转发专有模型（第一步）的 token
+    
+    请求中的 stream_stage1 优先，否则读取 Workflow.config: {"stage1_relay": true}
+    """
+    if override is not None:
+        return override
+    if not isinstance(workflow_config, dict):
+        return False
+    return bool(workflow_config.get("stage1_relay", False))
+
+
+def get_provider_temperature(provider, default: float = 0.7) -> float:
+    """从 provider 的 custom_config 中读取 temperature"""
+    temperature = default
+    if provider.custom_config and isinstance(provider.custom_config, dict):
+        temp_value = provider.custom_config.get("temperature")
+        if temp_value:
+            try:
+                temperature = float(temp_value)
+            except (ValueError, TypeError):
+                pass
+    return temperature
+
+
+def build_messages(prompt, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
+    """用提示词模板渲染 system/user 消息，history（会话历史）放在 system 与本轮 user 消息之间"""
+    system_prompt = prompt.system_prompt or ""
+    user_prompt_template = prompt.user_prompt or "{user_message}"
+    user_content = user_prompt_template.replace("{user_message}", user_message)
+    
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    if history:
+        messages.extend(history)
+    messages.append({"role": "user", "content": user_content})
+    return messages
+
+
 def parse_writing_style(user_message: str) -> Optional[Dict[str, str]]:
     """从用户消息中解析文风信息
     
@@ -145,14 +557,19 @@ def parse_writing_style(user_message: str) -> Optional[Dict[str, str]]:
 
 
 
-def call_llm_non_stream(
+async def call_llm_non_stream(
     messages: List[Dict[str, str]],
     api_base: str,
     api_key: str,
     model: str,
-    temperature: float = 0.7
+    temperature: float = 0.7,
+    usage: Optional[Dict[str, Any]] = None,
+    generation: Optional[Dict[str, Any]] = None
 ) -> str:
-    """非流式调用 LLM（用于专有模型第一步）"""
+    """
+    非流式调用 LLM（用于专有模型第一步），传入 usage 时写入上游返回的 token 用量
+    generation 为该模型的生成参数（max_tokens / top_p / stop），合并进请求体
+    """
     try:
         request_body = {
             "model": model,
@@ -160,22 +577,27 @@ def call_llm_non_stream(
             "temperature": temperature,
             "stream": False
         }
+        if generation:
+            request_body.update(generation)
         
         logger.info(f"非流式调用: {api_base}/chat/completions")
         logger.info(f"请求体: {json.dumps(request_body, ensure_ascii=False, indent=2)}")
         
-        response = requests.post(
+        client = get_http_client()
+        response = await client.post(
             f"{api_base}/chat/completions",
             headers={
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json"
             },
             json=request_body,
-            timeout=120
+            timeout=httpx.Timeout(120, connect=UPSTREAM_CONNECT_TIMEOUT)
         )
         
         response.raise_for_status()
         data = response.json()
+        if usage is not None and isinstance(data.get("usage"), dict):
+            usage.update(data["usage"])
         
         # 提取内容
         if "choices" in data and len(data["choices"]) > 0:
@@ -191,430 +613,1471 @@ def call_llm_non_stream(
         raise
 
 
-def stream_chat_response(
+async def iter_llm_stream(
     messages: List[Dict[str, str]],
     api_base: str,
     api_key: str,
     model: str,
     temperature: float = 0.7,
-    log_info: Dict[str, Any] = None
-):
-    """流式生成聊天响应"""
-    try:
-        # 发送初始事件
-        yield generate_sse_event(
-            {"type": "start", "message": "开始生成响应..."},
-            event="start"
-        )
-        
-        # 构建请求体
-        request_body = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-            "stream": True
-        }
-        
-        logger.info(f"流式调用: {api_base}/chat/completions")
-        logger.info(f"请求体: {json.dumps(request_body, ensure_ascii=False, indent=2)}")
-        
-        # 使用 requests 调用服务（流式）
-        response = requests.post(
-            f"{api_base}/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json=request_body,
-            stream=True,
-            timeout=None
-        )
-        
+    usage: Optional[Dict[str, Any]] = None,
+    generation: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[str]:
+    """
+    流式调用 LLM，逐个产出增量内容（content delta），传入 usage 时写入最后一块中的 token 用量
+    generation 为该模型的生成参数（max_tokens / top_p / stop），合并进请求体
+    """
+    # 构建请求体
+    request_body = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "stream": True
+    }
+    if generation:
+        request_body.update(generation)
+    if UPSTREAM_STREAM_USAGE:
+        request_body["stream_options"] = {"include_usage": True}
+    
+    logger.info(f"流式调用: {api_base}/chat/completions")
+    logger.info(f"请求体: {json.dumps(request_body, ensure_ascii=False, indent=2)}")
+    
+    # 使用共享连接池调用服务（流式）
+    client = get_http_client()
+    async with client.stream(
+        "POST",
+        f"{api_base}/chat/completions",
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        },
+        json=request_body
+    ) as response:
         response.raise_for_status()
         
-        # 解析流式响应
-        full_content = ""
-        line_count = 0
-        for line in response.iter_lines():
-            if line:
-                line_count += 1
-                line_text = line.decode('utf-8')
-                
-                # 跳过空行和 [DONE] 标记
-                if not line_text.strip() or line_text.strip() == "data: [DONE]":
-                    continue
-                
-                # 解析 SSE 格式：data: {...}
-                if line_text.startswith("data: "):
-                    data_str = line_text[6:]
+        # 直接按字节解析 SSE，不再逐行解码文本
+        decoder = SSEDecoder()
+        async for chunk in response.aiter_bytes():
+            for content in _iter_delta_contents(decoder.feed(chunk), usage):
+                yield content
+        for content in _iter_delta_contents(decoder.close(), usage):
+            yield content
+
+
+def _iter_delta_contents(payloads, usage: Optional[Dict[str, Any]] = None) -> List[str]:
+    """从一组 SSE data 中取出非空的增量文本，usage 不为空时写入其中的 token 用量"""
+    contents = []
+    for payload in payloads:
+        if payload == DONE_PAYLOAD:
+            continue
+        try:
+            content, chunk_usage = parse_chunk(payload)
+        except ValueError as e:
+            logger.warning(f"无法解析 SSE 数据: {payload}, 错误: {e}")
+            continue
+        if content:
+            contents.append(content)
+        if chunk_usage and usage is not None:
+            usage.update(chunk_usage)
+    return contents
+
+
+# ==================== Provider 池调用 ====================
+
+class UpstreamAdmitted:
+    """iter_provider_call 选定 provider 并获得准入名额时产出的标记"""
+
+    def __init__(self, provider, queue_wait: float, temperature: float, model: str, route: str,
+                 generation: Dict[str, Any]):
+        self.provider = provider
+        self.queue_wait = queue_wait
+        self.temperature = temperature
+        # 实际调用的模型和路由原因（见 app.utils.model_routing）
+        self.model = model
+        self.route = route
+        # 该模型的生成参数（见 app.utils.generation_params）
+        self.generation = generation
+        # 是否为对冲请求（见 iter_hedged_provider_call）
+        self.hedge = False
+
+
+def is_failover_error(e: Exception) -> bool:
+    """是否可以换下一个 provider 重试：连接/传输错误、5xx、429、准入被拒绝或熔断"""
+    if isinstance(e, (AdmissionRejected, CircuitOpenError)):
+        return True
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return isinstance(e, httpx.TransportError)
+
+
+def is_retryable_error(e: Exception) -> bool:
+    """是否可以在同一 provider 上退避重试：连接失败或上游暂时不可用（429/502/503/504）"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code in (429, 502, 503, 504)
+    return isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError))
+
+
+def is_upstream_failure(e: Exception) -> bool:
+    """是否计入熔断器失败：连接/传输错误或 5xx"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+async def iter_provider_call(
+    providers: Sequence,
+    messages: List[Dict[str, str]],
+    tenant: Any = None,
+    stream: bool = True,
+    params: Optional[Dict[str, Any]] = None,
+    rank: bool = True,
+    route: Optional[ModelRoute] = None
+):
+    """
+    在同类 provider 池中调用 LLM：按 provider_router 排序（rank 为 False 时按传入顺序）依次尝试
+
+    在发出第一个 token（非流式为完整结果）之前：
+    - 连接失败或 429/502/503/504 时在同一 provider 上按 jitter 退避重试（最多 max_retries 次）
+    - 重试用尽、熔断器打开或遇到其他可转移错误时换下一个 provider
+    每次请求前检查该上游的熔断器，打开时直接跳过。
+
+    先产出 UpstreamAdmitted（每次尝试一个），之后产出内容：
+    流式为增量内容，非流式为一个完整结果。
+    params 不为空时把重试次数和换 provider 的记录写入 params["retries"] / params["failover"]，
+    把实际生成的 token 用量、TTFT 和生成速率写入 params["usage"]（见 GenerationMeter）。
+    route 不为空时按各 provider 的配置在快速模型和默认模型之间选择（见 ModelRoute）。
+    全部 provider 失败时抛出最后一个错误。
+    """
+    mode = MODE_STREAM if stream else MODE_COMPLETE
+    candidates = provider_router.rank(providers, mode) if rank else list(providers)
+    last_error: Optional[Exception] = None
+    for provider in candidates:
+        breaker = get_breaker(provider)
+        max_retries = get_max_retries(provider)
+        model_name, model_route = select_model(provider, route)
+        generation = provider.get_generation_params(model_name)
+        attempt = 0
+        while True:
+            started = False
+            # 熔断器是否已得到本次请求的结果（首个 token / 完整响应 / 出错）
+            settled = False
+            probe = False
+            try:
+                probe = breaker.acquire()
+                async with admission_slot(get_admission(provider), tenant) as queue_wait:
+                    api_key = decrypt_api_key(provider.api_key) if provider.api_key else ""
+                    temperature = get_provider_temperature(provider)
+                    started_at = provider_router.begin(provider)
                     try:
-                        data = json.loads(data_str)
-                        
-                        # 提取内容
-                        if "choices" in data and len(data["choices"]) > 0:
-                            delta = data["choices"][0].get("delta", {})
-                            content = delta.get("content", "")
-                            
-                            if content:
-                                full_content += content
-                                # 发送内容块
-                                yield generate_sse_event(
-                                    {"type": "content", "content": content},
-                                    event="message"
-                                )
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"无法解析 SSE 数据: {data_str}, 错误: {e}")
+                        yield UpstreamAdmitted(provider, queue_wait, temperature, model_name, model_route, generation)
+                        meter = GenerationMeter(messages, stream)
+                        if stream:
+                            async for content in iter_llm_stream(
+                                messages, provider.api_base, api_key, model_name, temperature,
+                                usage=meter.usage, generation=generation
+                            ):
+                                if not started:
+                                    started = settled = True
+                                    provider_router.first_byte(provider, mode, started_at)
+                                    breaker.on_success(probe)
+                                meter.add(content)
+                                yield content
+                            record_usage(params, meter)
+                            observe_model_latency(provider, mode, model_name, meter)
+                        else:
+                            content = await call_llm_non_stream(
+                                messages, provider.api_base, api_key, model_name, temperature,
+                                usage=meter.usage, generation=generation
+                            )
+                            started = settled = True
+                            provider_router.first_byte(provider, mode, started_at)
+                            breaker.on_success(probe)
+                            meter.add(content)
+                            # 先记录用量再产出结果（对冲调用中胜出后其余部分可能被取消）
+                            record_usage(params, meter)
+                            observe_model_latency(provider, mode, model_name, meter)
+                            yield content
+                        if not settled:
+                            # 流正常结束但没有内容，上游仍然可用
+                            settled = True
+                            breaker.on_success(probe)
+                        return
+                    finally:
+                        provider_router.end(provider)
+            except (asyncio.CancelledError, GeneratorExit):
+                if not settled:
+                    breaker.on_cancel(probe)
+                elif stream:
+                    # 客户端断开：记录已生成部分的用量
+                    record_usage(params, meter)
+                raise
+            except Exception as e:
+                if isinstance(e, (AdmissionRejected, CircuitOpenError)):
+                    breaker.on_cancel(probe)
+                elif is_upstream_failure(e):
+                    provider_router.fail(provider, mode, str(e))
+                    breaker.on_failure(str(e), probe and not settled)
+                else:
+                    # 4xx 等请求本身的问题：provider 可用，不计入延迟惩罚和熔断
+                    provider_router.reject(provider, str(e))
+                    if not settled:
+                        breaker.on_success(probe)
+                if started and stream:
+                    record_usage(params, meter)
+                if started or not is_failover_error(e):
+                    raise
+                if attempt < max_retries and is_retryable_error(e) and breaker.available():
+                    delay = retry_backoff(attempt)
+                    attempt += 1
+                    logger.warning(
+                        f"provider {provider.name} 在首个 token 前调用失败，"
+                        f"{delay:.2f}s 后第 {attempt} 次重试: {str(e)}"
+                    )
+                    if params is not None:
+                        params["retries"] = params.get("retries", 0) + 1
+                    await asyncio.sleep(delay)
+                    continue
+                last_error = e
+                logger.warning(f"provider {provider.name} 在首个 token 前调用失败: {str(e)}")
+                if params is not None:
+                    params.setdefault("failover", []).append({"provider": provider.name, "error": str(e)})
+                break
+    if last_error is None:
+        raise Exception("没有可用的模型配置")
+    raise last_error
+
+
+async def iter_hedged_provider_call(
+    providers: Sequence,
+    messages: List[Dict[str, str]],
+    tenant: Any = None,
+    params: Optional[Dict[str, Any]] = None,
+    hedge_config: Optional[Dict[str, Any]] = None,
+    route: Optional[ModelRoute] = None
+):
+    """
+    带对冲的非流式调用，产出内容与 iter_provider_call(stream=False) 相同
+
+    第一个请求超过对冲延迟仍未返回时，向排在下一位的 provider 再发一个相同请求
+    （池中只有一个 provider 时发往同一上游，由其后的副本负载均衡承接），
+    先返回的结果胜出，另一个请求被取消。对冲请求的 UpstreamAdmitted 标记 hedge=True。
+    只有所有已发出的请求都失败时才抛出错误。
+    """
+    hedge_config = hedge_config or {}
+    ranked = provider_router.rank(providers, MODE_COMPLETE)
+    hedge_order = ranked[1:] + ranked[:1]
+    delay = stage1_hedger.hedge_delay(hedge_config.get("delay"), hedge_config.get("quantile", HEDGE_DEFAULT_QUANTILE))
+    hedge_info = {"delay": round(delay, 3), "hedged": False, "winner": None}
+    if params is not None:
+        params["hedge"] = hedge_info
+    
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def run_attempt(index: int, order: List):
+        started_at = time.monotonic()
+        try:
+            async for item in iter_provider_call(order, messages, tenant, stream=False, params=params, rank=False, route=route):
+                if isinstance(item, UpstreamAdmitted):
+                    item.hedge = index > 0
+                await queue.put((index, item, time.monotonic() - started_at))
+        except Exception as e:
+            await queue.put((index, e, time.monotonic() - started_at))
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + delay
+    tasks = [asyncio.ensure_future(run_attempt(0, ranked))]
+    admitted: Dict[int, UpstreamAdmitted] = {}
+    failures = 0
+    waiting_hedge = True
+    try:
+        while True:
+            timeout = max(deadline - loop.time(), 0) if waiting_hedge else None
+            try:
+                index, item, elapsed = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                waiting_hedge = False
+                if stage1_hedger.allow_hedge():
+                    hedge_info["hedged"] = True
+                    logger.info(f"专有模型 {delay:.3f}s 内未返回，发出对冲请求: {hedge_order[0].name}")
+                    tasks.append(asyncio.ensure_future(run_attempt(1, hedge_order)))
+                continue
+            
+            if isinstance(item, UpstreamAdmitted):
+                admitted[index] = item
+                yield item
+                continue
+            if isinstance(item, Exception):
+                failures += 1
+                if failures >= len(tasks):
+                    # 第一个请求在对冲前就已失败（池内故障转移已用尽）或两个请求都失败
+                    raise item
+                continue
+            
+            # 先返回的结果胜出
+            hedge_won = index > 0
+            hedge_info["winner"] = "hedge" if hedge_won else "primary"
+            if hedge_won:
+                record_upstream(params, admitted[index])
+            stage1_hedger.record(hedge_info["hedged"], hedge_won)
+            stage1_hedger.observe(elapsed)
+            yield item
+            return
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def record_usage(params: Optional[Dict[str, Any]], meter: GenerationMeter):
+    """把一次上游调用的 token 用量和吞吐写入阶段参数"""
+    if params is None:
+        return
+    params["usage"] = meter.summary()
+
+
+def observe_model_latency(provider, mode: str, model: str, meter: GenerationMeter):
+    """记录一次成功调用的延迟，用于快速模型与默认模型的对比报告"""
+    meter.finish()
+    ttft = meter.first_token_at - meter.started_at if meter.first_token_at is not None else None
+    fast_model_stats.observe(provider, mode, model, meter.finished_at - meter.started_at, ttft)
+
+
+def record_upstream(params: Optional[Dict[str, Any]], admitted: UpstreamAdmitted):
+    """把实际使用的 provider 和模型写入阶段参数"""
+    if params is None:
+        return
+    provider = admitted.provider
+    params.update({
+        "provider": provider.name,
+        "model": admitted.model,
+        "model_route": admitted.route,
+        "generation": admitted.generation,
+        "temperature": admitted.temperature,
+        "api_base": provider.api_base,
+        "queue_wait": admitted.queue_wait
+    })
+
+
+async def iter_chunked_provider_calls(
+    providers: Sequence,
+    chunked: Dict[str, Any],
+    tenant: Any,
+    params: Dict[str, Any],
+    results: List[Optional[str]],
+    fast: Optional[bool] = None
+):
+    """
+    分块并发调用（map）：每块一次非流式调用，同时进行的调用数不超过 chunked["concurrency"]
+    
+    每块完成时输出 chunk_completed 阶段事件，结果按块序号写入 results；
+    各块的 provider、模型、耗时和用量记录在 params["chunks"] 中。任一块失败时取消其余块并抛出异常。
+    各块按自身长度路由快速模型（fast 为请求中的 fast 标记）。
+    """
+    chunk_messages = chunked["messages"]
+    total = len(chunk_messages)
+    chunk_params = params["chunks"] = [
+        {"index": index, "chars": chars} for index, chars in enumerate(chunked["chars"])
+    ]
+    semaphore = asyncio.Semaphore(chunked["concurrency"])
+    completed: asyncio.Queue = asyncio.Queue()
+    map_start = time.time()
+    
+    async def run(index: int):
+        chunk = chunk_params[index]
+        try:
+            async with semaphore:
+                started = time.time()
+                chunk["started_at"] = round(started - map_start, 3)
+                parts = []
+                route = ModelRoute(chunk["chars"], requested=fast)
+                async for content in iter_provider_call(
+                    providers, chunk_messages[index], tenant, stream=False, params=chunk, route=route
+                ):
+                    if isinstance(content, UpstreamAdmitted):
+                        record_upstream(chunk, content)
                         continue
+                    parts.append(content)
+                chunk["duration"] = time.time() - started
+                chunk["status"] = "completed"
+            await completed.put((index, "".join(parts), None))
+        except asyncio.CancelledError:
+            chunk["status"] = "aborted"
+            raise
+        except Exception as e:
+            chunk["status"] = "failed"
+            await completed.put((index, None, e))
+    
+    tasks = [asyncio.ensure_future(run(index)) for index in range(total)]
+    try:
+        for _ in range(total):
+            index, content, error = await completed.get()
+            if error is not None:
+                raise error
+            results[index] = content
+            yield generate_stage_event(
+                "proprietary", "chunk_completed",
+                index=index,
+                total=total,
+                duration=round(chunk_params[index]["duration"], 3),
+                content_length=len(content)
+            )
+        params["map_duration"] = time.time() - map_start
+        logger.info(
+            f"分块调用完成: {total} 块, 耗时 {params['map_duration']:.3f}s, "
+            f"串行耗时 {sum(c['duration'] for c in chunk_params):.3f}s"
+        )
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def stream_chat_response(
+    messages: List[Dict[str, str]],
+    providers: Sequence,
+    log_info: Dict[str, Any] = None,
+    emit_start: bool = True,
+    tenant: Any = None,
+    frame_chars: int = 0,
+    frame_delay: float = 0.0,
+    include_full_content: bool = True,
+    stage_label: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    route: Optional[ModelRoute] = None
+):
+    """
+    流式生成聊天响应（异步生成器，不占用线程池）
+    
+    providers 为同类 provider 池，由 iter_provider_call 选择并在首个 token 前故障转移；
+    每次尝试先在该上游的准入队列中排队（按 tenant 公平轮转），
+    获得名额后发送 admitted 阶段事件（含 provider 和排队时间），生成结束后归还名额。
+    frame_chars / frame_delay 大于 0 时把多个增量合并成一个 message 事件；
+    include_full_content 为 False 时 done 事件不再重复完整内容。
+    stage_label 为进度事件中的阶段名（pipeline 中为输出阶段 id），默认与日志阶段相同。
+    deadline 不为空时本阶段的预算为剩余的全部时间，超时后取消上游调用并发送 code=504 的 error 事件。
+    route 不为空时按其选择快速模型或默认模型。
+    """
+    # 本次流式调用在日志中所属的阶段（两段式流程和 pipeline 的最后一步记录为 general）
+    stage = "general" if log_info and log_info.get("workflow_type") in ("proprietary->general", "pipeline") else "proprietary"
+    stage_label = stage_label or stage
+    parts = []
+    try:
+        # 发送初始事件（两段式流程中由外层生成器提前发送）
+        if emit_start:
+            yield generate_sse_event(
+                {"type": "start", "message": "开始生成响应..."},
+                event="start"
+            )
+        
+        params = log_info.get(f"{stage}_params") if log_info else None
+        coalescer = DeltaCoalescer(frame_chars, frame_delay)
+        upstream = iter_provider_call(providers, messages, tenant, stream=True, params=params, route=route)
+        if deadline is not None:
+            budget = deadline.remaining()
+            if params is not None:
+                params["budget"] = round(budget, 3)
+            upstream = iter_with_deadline(upstream, budget, stage_label)
+        async for content in upstream:
+            if isinstance(content, UpstreamAdmitted):
+                record_upstream(params, content)
+                yield generate_stage_event(
+                    stage_label, "admitted",
+                    provider=content.provider.name,
+                    queue_wait=round(content.queue_wait, 3)
+                )
+                continue
+            parts.append(content)
+            # 发送内容块（启用合并时按帧发送）
+            frame = coalescer.add(content)
+            if frame:
+                yield encode_content(frame)
+        frame = coalescer.flush()
+        if frame:
+            yield encode_content(frame)
         
+        full_content = "".join(parts)
         logger.info(f"流式响应完成，累计内容长度: {len(full_content)}")
+        # 先写入最终内容，外层在转发 done 事件前可以读取（见 record_session_turn）
+        if log_info:
+            log_info[f"{stage}_response"] = full_content
         
         # 发送完成事件
-        yield generate_sse_event(
-            {"type": "done", "message": "响应生成完成", "full_content": full_content},
-            event="done"
-        )
+        done_data = {"type": "done", "message": "响应生成完成"}
+        if include_full_content:
+            done_data["full_content"] = full_content
+        yield generate_sse_event(done_data, event="done")
         
         # 记录日志
         if log_info:
-            try:
-                # 更新响应内容和耗时
-                if log_info.get("workflow_type") == "proprietary":
-                    log_info["proprietary_response"] = full_content
-                elif log_info.get("workflow_type") == "proprietary->general":
-                    log_info["general_response"] = full_content
-                
-                log_info["duration"] = time.time() - log_info.get("start_time", 0)
-                
-                # 移除临时字段
-                log_info.pop("workflow_type", None)
-                log_info.pop("start_time", None)
-                log_info.pop("writing_style_info", None)
-                
-                save_chat_log(log_info)
-            except Exception as e:
-                logger.error(f"记录日志出错: {str(e)}")
+            finalize_chat_log(log_info)
         
-    except requests.exceptions.RequestException as e:
+    except (asyncio.CancelledError, GeneratorExit):
+        # 客户端断开：取消本协程会关闭上游连接，记录已生成的部分内容
+        logger.info(f"客户端已断开，中止 {stage} 阶段生成，已生成内容长度: {sum(len(p) for p in parts)}")
+        if log_info:
+            log_info[f"{stage}_response"] = "".join(parts)
+            finalize_chat_log(log_info, status="aborted", reason="client_disconnected", stage=stage)
+        raise
+    except DeadlineExceeded as e:
+        logger.warning(f"{str(e)}，已生成内容长度: {sum(len(p) for p in parts)}")
+        if log_info:
+            log_info[f"{stage}_response"] = "".join(parts)
+        finalize_chat_log(log_info, status="timeout", reason=str(e), stage=stage)
+        yield generate_sse_event(
+            {"type": "error", "stage": stage_label, "code": 504, "message": str(e)},
+            event="error"
+        )
+    except (AdmissionRejected, CircuitOpenError) as e:
+        logger.warning(f"上游不可用: {str(e)}")
+        finalize_chat_log(log_info, status="failed", reason=str(e), stage=stage)
+        code = 429 if isinstance(e, AdmissionRejected) else 503
+        yield generate_sse_event(
+            {"type": "error", "stage": stage_label, "code": code, "retry_after": e.retry_after, "message": str(e)},
+            event="error"
+        )
+    except httpx.HTTPError as e:
         logger.error(f"请求服务失败: {str(e)}")
+        if log_info:
+            log_info[f"{stage}_response"] = "".join(parts)
+        finalize_chat_log(log_info, status="failed", reason=f"请求服务失败: {str(e)}", stage=stage)
         yield generate_sse_event(
             {"type": "error", "message": f"请求服务失败: {str(e)}"},
             event="error"
         )
     except Exception as e:
         logger.error(f"流式响应生成失败: {str(e)}", exc_info=True)
+        if log_info:
+            log_info[f"{stage}_response"] = "".join(parts)
+        finalize_chat_log(log_info, status="failed", reason=f"生成响应失败: {str(e)}", stage=stage)
         yield generate_sse_event(
             {"type": "error", "message": f"生成响应失败: {str(e)}"},
             event="error"
         )
 
 
-@router.post("/stream")
-async def stream_chat(
-    request: ChatRequest = Body(..., description="聊天请求"),
-    db: Session = Depends(get_db),
-    api_key: ApiKey = Depends(verify_api_key_dependency)
+def generate_stage_event(stage: str, status: str, **extra) -> str:
+    """生成阶段进度事件（event: stage）"""
+    data = {"type": "stage", "stage": stage, "status": status}
+    data.update(extra)
+    return generate_sse_event(data, event="stage")
+
+
+async def stream_two_stage_response(
+    proprietary_messages: List[Dict[str, str]],
+    proprietary_providers: Sequence,
+    general_prompt,
+    general_providers: Sequence,
+    log_info: Dict[str, Any],
+    cache_config: Optional[Dict[str, Any]] = None,
+    relay_stage1: bool = False,
+    tenant: Any = None,
+    sse_options: Optional[Dict[str, Any]] = None,
+    hedge_config: Optional[Dict[str, Any]] = None,
+    chunked: Optional[Dict[str, Any]] = None,
+    deadline: Optional[Deadline] = None,
+    stage1_route: Optional[ModelRoute] = None,
+    fast: Optional[bool] = None
+):
+    """
+    专有模型 -> 通用模型 两段式流式响应
+    
+    响应在第一步开始前就已打开：先发送 start 事件和 stage 进度事件，
+    第一步（专有模型）进行期间由 with_heartbeat 发送心跳注释；
+    relay_stage1 为 True 时第一步改为流式调用，token 以 stage1 事件转发给客户端。
+    第二步（通用模型）以 message 事件流式输出，与单段流程一致。
+    两步各自在 provider 池中选择上游（首个 token 前可故障转移），
+    并在所选上游的准入队列中排队，名额只在该步调用期间占用。
+    sse_options（见 get_sse_options）同时作用于 stage1 转发和第二步输出。
+    hedge_config（见 get_hedge_config）不为空且第一步为非流式调用时启用对冲请求。
+    chunked（见 build_chunked_messages）不为空时第一步改为分块并发调用（map），
+    结果按原文顺序拼接后交给第二步（reduce）；分块模式下不转发 stage1 token，也不对冲。
+    deadline 不为空时第一步按 Deadline.stage1_budget 限时，第二步使用剩余时间；
+    超时的阶段取消上游调用，并发送带阶段名、code=504 的 error 事件。
+    stage1_route 为第一步的快速模型路由；第二步按第一步结果的长度（fast_stage1_chars）路由，
+    fast 为请求中的 fast 标记。
+    """
+    sse_options = sse_options or {}
+    relay_stage1 = relay_stage1 and not chunked
+    stage1_budget = deadline.stage1_budget() if deadline is not None else None
+    # 当前所处阶段，客户端断开时据此记录中止位置
+    current_stage = "proprietary"
+    parts = []
+    try:
+        yield generate_sse_event(
+            {"type": "start", "message": "开始生成响应..."},
+            event="start"
+        )
+        
+        # 第一步：调用专有模型
+        logger.info("步骤1: 调用专有模型")
+        stage1_start = time.time()
+        yield generate_stage_event("proprietary", "started", relay=relay_stage1)
+        
+        # 专有模型结果缓存（按 workflow 配置启用）
+        proprietary_result = None
+        cache_key = None
+        if cache_config:
+            # 同一池中的 provider 视为等价后端，缓存键取首选 provider 的模型参数（快速模型与默认模型分开缓存）
+            preferred = proprietary_providers[0]
+            cache_key = make_cache_key(
+                proprietary_messages,
+                select_model(preferred, stage1_route)[0],
+                get_provider_temperature(preferred)
+            )
+            proprietary_result = stage1_cache.get(cache_key)
+            log_info["proprietary_params"]["cache"] = {
+                "hit": proprietary_result is not None,
+                "hits": stage1_cache.hits,
+                "misses": stage1_cache.misses
+            }
+            if proprietary_result is not None:
+                logger.info(f"专有模型结果命中缓存，内容长度: {len(proprietary_result)}")
+        
+        cached = proprietary_result is not None
+        if proprietary_result is None:
+            try:
+                params = log_info["proprietary_params"]
+                if chunked:
+                    # 长文本分块：各块并发调用专有模型，按原文顺序拼接结果
+                    chunk_results: List[Optional[str]] = [None] * len(chunked["messages"])
+                    yield generate_stage_event(
+                        "proprietary", "chunked",
+                        chunks=len(chunk_results),
+                        concurrency=chunked["concurrency"]
+                    )
+                    map_events = iter_chunked_provider_calls(
+                        proprietary_providers, chunked, tenant, params, chunk_results, fast=fast
+                    )
+                    if stage1_budget is not None:
+                        params["budget"] = round(stage1_budget, 3)
+                        map_events = iter_with_deadline(map_events, stage1_budget, "proprietary")
+                    async for event in map_events:
+                        yield event
+                    proprietary_result = chunked["separator"].join(chunk_results)
+                    params["usage"] = merge_usage([c["usage"] for c in params["chunks"] if c.get("usage")])
+                else:
+                    # relay_stage1 时流式调用专有模型，逐个转发 token；否则非流式调用，产出一个完整结果
+                    coalescer = DeltaCoalescer(
+                        sse_options.get("frame_chars", 0),
+                        sse_options.get("frame_delay", 0.0)
+                    )
+                    if hedge_config and not relay_stage1:
+                        upstream = iter_hedged_provider_call(
+                            proprietary_providers, proprietary_messages, tenant, params=params,
+                            hedge_config=hedge_config, route=stage1_route
+                        )
+                    else:
+                        upstream = iter_provider_call(
+                            proprietary_providers, proprietary_messages, tenant, stream=relay_stage1, params=params,
+                            route=stage1_route
+                        )
+                    if stage1_budget is not None:
+                        params["budget"] = round(stage1_budget, 3)
+                        upstream = iter_with_deadline(upstream, stage1_budget, "proprietary")
+                    async for content in upstream:
+                        if isinstance(content, UpstreamAdmitted):
+                            # 对冲请求只发送进度事件，胜出时才写入日志参数
+                            if not content.hedge:
+                                record_upstream(params, content)
+                            yield generate_stage_event(
+                                "proprietary", "hedged" if content.hedge else "admitted",
+                                provider=content.provider.name,
+                                queue_wait=round(content.queue_wait, 3)
+                            )
+                            continue
+                        parts.append(content)
+                        if relay_stage1:
+                            frame = coalescer.add(content)
+                            if frame:
+                                yield encode_content(frame, event="stage1", content_type="stage1")
+                    frame = coalescer.flush()
+                    if frame:
+                        yield encode_content(frame, event="stage1", content_type="stage1")
+                    proprietary_result = "".join(parts)
+                logger.info(f"专有模型返回内容长度: {len(proprietary_result)}")
+            except DeadlineExceeded as e:
+                logger.warning(f"专有模型调用超时: {str(e)}")
+                if parts:
+                    log_info["proprietary_response"] = "".join(parts)
+                finalize_chat_log(log_info, status="timeout", reason=str(e), stage="proprietary")
+                yield generate_sse_event(
+                    {"type": "error", "stage": "proprietary", "code": 504, "message": str(e)},
+                    event="error"
+                )
+                return
+            except (AdmissionRejected, CircuitOpenError) as e:
+                logger.warning(f"专有模型上游不可用: {str(e)}")
+                finalize_chat_log(log_info, status="failed", reason=str(e), stage="proprietary")
+                code = 429 if isinstance(e, AdmissionRejected) else 503
+                yield generate_sse_event(
+                    {"type": "error", "stage": "proprietary", "code": code, "retry_after": e.retry_after, "message": str(e)},
+                    event="error"
+                )
+                return
+            except Exception as e:
+                logger.error(f"专有模型调用失败: {str(e)}")
+                finalize_chat_log(log_info, status="failed", reason=f"专有模型调用失败: {str(e)}", stage="proprietary")
+                yield generate_sse_event(
+                    {"type": "error", "stage": "proprietary", "message": f"专有模型调用失败: {str(e)}"},
+                    event="error"
+                )
+                return
+            
+            if cache_key:
+                stage1_cache.set(cache_key, proprietary_result, cache_config["ttl"])
+        
+        log_info["proprietary_response"] = proprietary_result
+        stage1_duration = time.time() - stage1_start
+        log_info["proprietary_params"]["duration"] = stage1_duration
+        yield generate_stage_event(
+            "proprietary", "completed",
+            duration=round(stage1_duration, 3),
+            cached=cached,
+            content_length=len(proprietary_result)
+        )
+        
+        # 第二步：调用通用模型（流式），将专有模型的结果作为通用模型的 user_message
+        logger.info("步骤2: 调用通用模型（流式）")
+        current_stage = "general"
+        yield generate_stage_event("general", "started")
+        
+        general_messages = build_messages(general_prompt, proprietary_result)
+        
+        async for event in stream_chat_response(
+            messages=general_messages,
+            providers=general_providers,
+            log_info=log_info,
+            emit_start=False,
+            tenant=tenant,
+            deadline=deadline,
+            route=ModelRoute(len(proprietary_result), THRESHOLD_STAGE1, fast),
+            **sse_options
+        ):
+            yield event
+    except (asyncio.CancelledError, GeneratorExit):
+        # 客户端断开：取消本协程会关闭进行中的上游连接
+        logger.info(f"客户端已断开，中止 {current_stage} 阶段")
+        if current_stage == "proprietary" and parts:
+            log_info["proprietary_response"] = "".join(parts)
+        # 第二步中断时由 stream_chat_response 记录，这里不会重复提交
+        finalize_chat_log(log_info, status="aborted", reason="client_disconnected", stage=current_stage)
+        raise
+
+
+def merge_usage(usages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """合并多次上游调用的 usage：token 数相加，TTFT 和生成速率对合并结果没有意义，置空"""
+    if not usages:
+        return None
+    prompt_tokens = sum(u["prompt_tokens"] for u in usages)
+    completion_tokens = sum(u["completion_tokens"] for u in usages)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "ttft": None,
+        "tokens_per_second": None,
+        "source": "estimate" if any(u["source"] == "estimate" for u in usages) else "upstream",
+    }
+
+
+async def run_pipeline_stage(
+    stage: PipelineStage,
+    values: Dict[str, str],
+    runtime: Dict[str, Tuple[Any, Sequence]],
+    tenant: Any,
+    params: Dict[str, Any],
+    events: asyncio.Queue,
+    fast: Optional[bool] = None,
+    history: Optional[List[Dict[str, str]]] = None
+) -> str:
+    """
+    执行 pipeline 中的一个非输出阶段，返回阶段输出；model 阶段非流式调用，进度事件放入 events
+    
+    model 阶段按渲染后的输入长度路由快速模型（fast 为请求中的 fast 标记）；
+    会话历史（history）只带给不依赖其他阶段的 model 阶段
+    """
+    if stage.type != STAGE_MODEL:
+        return run_transform(stage, values)
+    prompt, providers = runtime[stage.id]
+    stage_input = render_template(stage.template, values)
+    messages = build_messages(prompt, stage_input, None if stage.inputs else history)
+    route = ModelRoute(len(stage_input), requested=fast)
+    parts = []
+    async for content in iter_provider_call(providers, messages, tenant, stream=False, params=params, route=route):
+        if isinstance(content, UpstreamAdmitted):
+            record_upstream(params, content)
+            await events.put(generate_stage_event(
+                stage.id, "admitted",
+                provider=content.provider.name,
+                queue_wait=round(content.queue_wait, 3)
+            ))
+            continue
+        parts.append(content)
+    return "".join(parts)
+
+
+async def stream_pipeline_response(
+    pipeline: Pipeline,
+    runtime: Dict[str, Tuple[Any, Sequence]],
+    user_message: str,
+    log_info: Dict[str, Any],
+    tenant: Any = None,
+    sse_options: Optional[Dict[str, Any]] = None,
+    deadline: Optional[Deadline] = None,
+    fast: Optional[bool] = None,
+    history: Optional[List[Dict[str, str]]] = None
+):
+    """
+    按 Workflow.config.pipeline 执行多阶段流程
+    
+    输出阶段之前的阶段在依赖满足后立即并发执行（各自 stage started / admitted / completed 事件，
+    completed 带耗时），互不依赖的分支不再串行等待；任一阶段失败时取消其余阶段并发送 error 事件。
+    输出阶段为 model 时以 message 事件流式输出（与单段流程一致），否则一次性输出其结果。
+    
+    日志：各前置阶段的参数、耗时和用量记录在 proprietary_params.stages 中，
+    proprietary_params.duration 为前置阶段的实际耗时，sequential_duration 为各阶段耗时之和；
+    前置阶段输出以 JSON 记录在 proprietary_response；输出阶段记录在 general_params / general_response。
+    
+    deadline 不为空时前置阶段整体按 Deadline.stage1_budget 限时（超时时取消仍在执行的阶段，
+    error 事件的 stage 为其中第一个），输出阶段使用剩余时间。
+    各 model 阶段按自身输入长度路由快速模型，fast 为请求中的 fast 标记。
+    会话历史（history）带给直接处理用户消息（不依赖其他阶段）的 model 阶段。
+    
+    Args:
+        runtime: model 阶段 id -> (提示词, provider 池)
+    """
+    sse_options = sse_options or {}
+    values = {USER_MESSAGE: user_message}
+    stage_params: Dict[str, Dict[str, Any]] = {}
+    log_info["proprietary_params"] = {"stages": stage_params}
+    events: asyncio.Queue = asyncio.Queue()
+    tasks: Dict[str, asyncio.Task] = {}
+    pipeline_start = time.time()
+    # 输出阶段开始前为 None
+    current_stage = None
+    
+    async def run(stage: PipelineStage):
+        params = stage_params[stage.id] = {"type": stage.type}
+        started = time.time()
+        params["started_at"] = round(started - pipeline_start, 3)
+        await events.put(generate_stage_event(stage.id, "started", kind=stage.type))
+        try:
+            content = await run_pipeline_stage(stage, values, runtime, tenant, params, events, fast=fast, history=history)
+        except asyncio.CancelledError:
+            # 超时取消时已标记为 timeout
+            params.setdefault("status", "aborted")
+            raise
+        except Exception as e:
+            params["status"] = "failed"
+            await events.put((stage, None, e))
+            return
+        params["status"] = "completed"
+        params["duration"] = time.time() - started
+        await events.put((stage, content, None))
+    
+    def launch_ready():
+        for stage in pipeline.ready(values):
+            if stage.id not in tasks:
+                tasks[stage.id] = asyncio.ensure_future(run(stage))
+    
+    try:
+        yield generate_sse_event(
+            {"type": "start", "message": "开始生成响应..."},
+            event="start"
+        )
+        
+        launch_ready()
+        stage1_budget = deadline.stage1_budget() if deadline is not None and pipeline.order else None
+        branches_deadline = time.monotonic() + stage1_budget if stage1_budget is not None else None
+        while len(values) - 1 < len(pipeline.order):
+            if branches_deadline is None:
+                item = await events.get()
+            else:
+                try:
+                    item = await asyncio.wait_for(events.get(), max(branches_deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    running = [stage_id for stage_id in pipeline.order if stage_id in tasks and not tasks[stage_id].done()]
+                    error = DeadlineExceeded(running[0] if running else "pipeline", stage1_budget)
+                    logger.warning(f"pipeline 前置阶段超时，取消执行中的阶段: {running}")
+                    for stage_id in running:
+                        stage_params[stage_id]["status"] = "timeout"
+                    log_info["proprietary_params"]["budget"] = round(stage1_budget, 3)
+                    finalize_chat_log(log_info, status="timeout", reason=str(error), stage="proprietary")
+                    yield generate_sse_event(
+                        {"type": "error", "stage": error.stage, "code": 504, "running": running, "message": str(error)},
+                        event="error"
+                    )
+                    return
+            if isinstance(item, str):
+                yield item
+                continue
+            stage, content, error = item
+            if error is not None:
+                logger.error(f"pipeline 阶段 {stage.id} 失败: {str(error)}")
+                reason = f"阶段 {stage.id} 失败: {str(error)}"
+                finalize_chat_log(log_info, status="failed", reason=reason, stage="proprietary")
+                data = {"type": "error", "stage": stage.id, "message": reason}
+                if isinstance(error, (AdmissionRejected, CircuitOpenError)):
+                    data.update(code=429 if isinstance(error, AdmissionRejected) else 503, retry_after=error.retry_after)
+                yield generate_sse_event(data, event="error")
+                return
+            values[stage.id] = content
+            yield generate_stage_event(
+                stage.id, "completed",
+                duration=round(stage_params[stage.id]["duration"], 3),
+                content_length=len(content)
+            )
+            launch_ready()
+        
+        # 前置阶段全部完成：记录耗时、用量和各阶段输出
+        proprietary_params = log_info["proprietary_params"]
+        proprietary_params["duration"] = time.time() - pipeline_start
+        proprietary_params["sequential_duration"] = sum(p.get("duration", 0.0) for p in stage_params.values())
+        proprietary_params["usage"] = merge_usage([p["usage"] for p in stage_params.values() if p.get("usage")])
+        if pipeline.order:
+            log_info["proprietary_response"] = json.dumps(
+                {stage_id: values[stage_id] for stage_id in pipeline.order}, ensure_ascii=False
+            )
+            logger.info(
+                f"pipeline 前置阶段完成: 耗时 {proprietary_params['duration']:.3f}s, "
+                f"串行耗时 {proprietary_params['sequential_duration']:.3f}s"
+            )
+        
+        # 输出阶段
+        output = pipeline.output_stage
+        current_stage = output.id
+        log_info["general_params"]["started_at"] = round(time.time() - pipeline_start, 3)
+        yield generate_stage_event(output.id, "started", kind=output.type)
+        if output.type == STAGE_MODEL:
+            prompt, providers = runtime[output.id]
+            output_input = render_template(output.template, values)
+            async for event in stream_chat_response(
+                messages=build_messages(prompt, output_input, None if output.inputs else history),
+                providers=providers,
+                log_info=log_info,
+                emit_start=False,
+                tenant=tenant,
+                stage_label=output.id,
+                deadline=deadline,
+                route=ModelRoute(len(output_input), requested=fast),
+                **sse_options
+            ):
+                yield event
+        else:
+            full_content = run_transform(output, values)
+            if full_content:
+                yield encode_content(full_content)
+            log_info["general_response"] = full_content
+            done_data = {"type": "done", "message": "响应生成完成"}
+            if sse_options.get("include_full_content", True):
+                done_data["full_content"] = full_content
+            yield generate_sse_event(done_data, event="done")
+            finalize_chat_log(log_info)
+    except (asyncio.CancelledError, GeneratorExit):
+        # 输出阶段中断时由 stream_chat_response 记录，这里不会重复提交
+        logger.info(f"客户端已断开，中止 pipeline（{current_stage or '前置阶段'}）")
+        if current_stage is None:
+            finalize_chat_log(log_info, status="aborted", reason="client_disconnected", stage="proprietary")
+        raise
+    finally:
+        pending = [task for task in tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def with_heartbeat(events: AsyncIterator[str], interval: float = SSE_HEARTBEAT_INTERVAL):
+    """
+    为 SSE 事件流加上心跳：超过 interval 秒没有新事件时发送注释行（客户端会忽略），
+    保证长时间的非流式阶段（如专有模型调用）期间连接不会被代理判定为空闲
+    """
+    iterator = events.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield SSE_HEARTBEAT
+                continue
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+            yield event
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration, Exception):
+                pass
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+# ==================== 多轮会话 ====================
+
+async def load_chat_session(request: ChatRequest, tenant: Any = None) -> Optional[Dict[str, Any]]:
+    """读取请求所属的会话和最近的历史，未提供 session_id 时返回 None，会话不存在或已过期时返回 404"""
+    if not request.session_id:
+        return None
+    session = await chat_sessions.get(request.session_id, tenant=tenant)
+    if session is None:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    return session
+
+
+async def record_session_turn(
+    events: AsyncIterator[str],
+    session_id: str,
+    user_message: str,
+    log_info: Dict[str, Any]
 ):
     """
-    流式聊天接口 - 自动从数据库获取配置
+    转发事件流，在 done 事件发出前把本轮（用户消息原文和最终回复）追加到会话
+    
+    客户端收到 done 后立即发送下一轮时，历史中已经包含本轮
+    """
+    done_prefix = event_prefix("done")
+    try:
+        async for event in events:
+            if event.startswith(done_prefix):
+                stage = "proprietary" if log_info.get("workflow_type") == "proprietary" else "general"
+                reply = log_info.get(f"{stage}_response") or ""
+                try:
+                    await chat_sessions.append(session_id, user_message, reply)
+                except Exception as e:
+                    logger.error(f"保存会话轮次失败: session={session_id}, 错误: {str(e)}")
+            yield event
+    finally:
+        await events.aclose()
+
+
+def prepare_chat_generation(
+    request: ChatRequest,
+    tenant: Any = None,
+    sse_overrides: Optional[Dict[str, Any]] = None,
+    timeout: Optional[str] = None,
+    session: Optional[Dict[str, Any]] = None
+) -> Tuple[Any, Dict[str, Any], Callable[[], AsyncIterator[str]]]:
+    """
+    按 workflow 配置准备一次聊天生成（/stream 与 /batch 共用），配置缺失时抛出 HTTPException
     
     流程：
     1. 获取 workflow 配置（如果提供 workflowId 则使用对应的 workflow，否则使用第一条）
     2. 获取所有 prompts 提示词
-    3. 获取所有 llm_providers 模型配置
-    4. 根据 workflow_type 决定调用方式：
+    3. 获取所有 llm_providers 模型配置（同一 category 的多条配置组成 provider 池，
+       按延迟 EWMA 和进行中请求数选择，首个 token 前遇到连接错误或 5xx 时换下一个）
+    4. Workflow.config 中配置了 pipeline 时按阶段图执行（见 app.utils.pipeline），
+       否则根据 workflow_type 决定调用方式：
        - proprietary: 直接调用专有模型（流式）
        - proprietary->general: 先调用专有模型（非流式），再用结果调用通用模型（流式）
+    
+    Args:
+        tenant: 准入控制的公平排队单位（ApiKey id）
+        sse_overrides: 覆盖 Workflow.config 中的 SSE 输出选项
+        timeout: 请求头 X-Request-Timeout 的值（秒），优先于 Workflow.config 中的 deadline.timeout
+        session: 请求所属的会话（见 load_chat_session）：未指定 workflowId 时使用会话的 workflow，
+            历史按 Workflow.config.session 裁剪后带给处理用户消息的模型调用，生成完成时追加本轮
+    
+    Returns:
+        (workflow, sse_options, create_events)，create_events() 开始生成并返回 SSE 事件流
     """
+    user_message = request.user_message
+    workflow_id = request.workflowId or (session["workflow_id"] if session else None)
+    writing_style = request.writing_style
+    
+    logger.info(f"收到用户消息: {user_message[:100]}...")
+    logger.info(f"workflowId: {workflow_id}")
+    logger.info(f"writing_style: {writing_style}")
+    
+    # 如果传递了 writing_style 参数，在后端完成拼接
+    writing_style_info = None
+    style_suffix = ""
+    if writing_style:
+        features = WRITING_STYLES_MAP.get(writing_style)
+        if features:
+            # 拼接文风信息到 user_message
+            style_suffix = f",| {writing_style} | 核心特点：{features}"
+            user_message = f"{user_message}{style_suffix}"
+            writing_style_info = {
+                "writing_style": writing_style,
+                "features": features
+            }
+            logger.info(f"已拼接文风信息: {writing_style_info}")
+        else:
+            logger.warning(f"未找到 writing_style={writing_style} 的核心特点配置")
+    else:
+        # 兼容旧的解析方式（从 user_message 中解析）
+        writing_style_info = parse_writing_style(user_message)
+        if writing_style_info:
+            logger.info(f"从消息中解析到文风信息: {writing_style_info}")
+    
+    # 初始化日志信息
+    start_time = time.time()
+    log_info = {
+        "input_params": request.model_dump(),
+        "start_time": start_time,
+        "proprietary_params": None,
+        "proprietary_response": None,
+        "general_params": None,
+        "general_response": None,
+        "duration": 0.0,
+        "writing_style_info": writing_style_info
+    }
+    
+    # 第一步：从配置快照获取 workflow 参数（不访问数据库）
+    snapshot = get_config_snapshot()
+    workflow = snapshot.get_workflow(workflow_id)
+    if workflow_id and workflow and workflow.backend_id == workflow_id:
+        logger.info(f"使用指定的 workflow: {workflow.name} (backend_id={workflow_id})")
+    elif not workflow_id:
+        logger.info(f"未提供 workflowId，使用默认第一条 workflow")
+    
+    if not workflow:
+        raise HTTPException(status_code=404, detail="未找到 workflow 配置")
+    
+    workflow_type = workflow.workflow_type
+    logger.info(f"Workflow 类型: {workflow_type}")
+    logger.info(f"Workflow 名称: {workflow.name}")
+    logger.info(f"配置快照版本: {snapshot.version}")
+    
+    # 第二步：获取 prompts 提示词数据（快照中已按 model_type 建好索引）
+    prompts_dict = snapshot.prompts
+    if not prompts_dict:
+        raise HTTPException(status_code=404, detail="未找到 prompts 配置")
+    
+    # 第三步：获取 llm_providers 模型参数配置（快照中已按 category 建好 provider 池）
+    providers_dict = snapshot.providers
+    if not providers_dict:
+        raise HTTPException(status_code=404, detail="未找到 llm_providers 配置")
+    
+    # SSE 输出选项（增量合并、done 事件是否附带完整内容）
+    sse_options = get_sse_options(workflow.config, request.include_full_content)
+    if sse_overrides:
+        sse_options.update(sse_overrides)
+    
+    # 整体截止时间（请求头或 Workflow.config.deadline），各阶段按剩余时间分配预算
+    deadline = get_deadline(workflow.config, timeout)
+    if deadline is not None:
+        logger.info(f"请求截止时间: {deadline.timeout:g} 秒")
+    
+    # 会话历史：从最近一轮往前按 token 预算选取
+    history = None
+    if session is not None:
+        session_config = get_session_config(workflow.config)
+        history, history_info = trim_history(
+            session["history"], session_config["history_tokens"], session_config["history_turns"]
+        )
+        log_info["session"] = {"id": session["id"], "turn": session["turns"] + 1, **history_info}
+        logger.info(
+            f"会话 {session['id']} 第 {session['turns'] + 1} 轮: 带上 {history_info['turns']} 轮历史"
+            f"（约 {history_info['tokens']} tokens），裁掉 {history_info['trimmed']} 轮"
+        )
+    
+    # 第四步：Workflow.config 中配置了 pipeline 时按阶段图执行，否则根据 workflow_type 处理
     try:
-        user_message = request.user_message
-        workflow_id = request.workflowId
-        writing_style = request.writing_style
-        
-        logger.info(f"收到用户消息: {user_message[:100]}...")
-        logger.info(f"workflowId: {workflow_id}")
-        logger.info(f"writing_style: {writing_style}")
-        
-        # 如果传递了 writing_style 参数，在后端完成拼接
-        writing_style_info = None
-        if writing_style:
-            features = WRITING_STYLES_MAP.get(writing_style)
-            if features:
-                # 拼接文风信息到 user_message
-                user_message = f"{user_message},| {writing_style} | 核心特点：{features}"
-                writing_style_info = {
-                    "writing_style": writing_style,
-                    "features": features
-                }
-                logger.info(f"已拼接文风信息: {writing_style_info}")
+        pipeline = parse_pipeline(workflow.config)
+    except PipelineError as e:
+        raise HTTPException(status_code=400, detail=f"Workflow.config.pipeline 配置无效: {str(e)}")
+    
+    if pipeline is not None:
+        logger.info(f"执行 pipeline 流程: 前置阶段 {list(pipeline.order)}, 输出阶段 {pipeline.output}")
+        
+        # model 阶段的提示词和 provider 池
+        runtime = {}
+        for stage_id in pipeline.order + (pipeline.output,):
+            stage = pipeline.stages[stage_id]
+            if stage.type != STAGE_MODEL:
+                continue
+            if stage.prompt:
+                prompt = prompts_dict.get(stage.prompt)
+                if not prompt:
+                    raise HTTPException(status_code=404, detail=f"未找到 model_type={stage.prompt} 的提示词")
             else:
-                logger.warning(f"未找到 writing_style={writing_style} 的核心特点配置")
-        else:
-            # 兼容旧的解析方式（从 user_message 中解析）
-            writing_style_info = parse_writing_style(user_message)
-            if writing_style_info:
-                logger.info(f"从消息中解析到文风信息: {writing_style_info}")
-        
-        # 初始化日志信息
-        start_time = time.time()
-        log_info = {
-            "input_params": request.model_dump(),
-            "start_time": start_time,
-            "proprietary_params": None,
-            "proprietary_response": None,
-            "general_params": None,
-            "general_response": None,
-            "duration": 0.0,
-            "writing_style_info": writing_style_info
+                prompt = PromptConfig(
+                    id=0, title=stage.id, system_prompt=stage.system_prompt,
+                    user_prompt=stage.user_prompt, model_type=stage.id
+                )
+            providers = snapshot.get_provider_pool(stage.category)
+            if not providers:
+                raise HTTPException(status_code=404, detail=f"未找到 category={stage.category} 的模型配置")
+            runtime[stage_id] = (prompt, providers)
+        
+        # 输出阶段参数（model 阶段实际使用的 provider 在获得准入后更新到日志）
+        log_info["workflow_type"] = "pipeline"
+        output = pipeline.output_stage
+        general_params = {"stage": output.id, "type": output.type}
+        if output.type == STAGE_MODEL:
+            output_provider = runtime[output.id][1][0]
+            general_params.update({
+                "model": output_provider.default_model_name,
+                "generation": output_provider.get_generation_params(output_provider.default_model_name),
+                "temperature": get_provider_temperature(output_provider),
+                "api_base": output_provider.api_base
+            })
+        if writing_style_info:
+            general_params["writing_style"] = writing_style_info.get("writing_style", "")
+            general_params["writing_features"] = writing_style_info.get("features", "")
+        log_info["general_params"] = general_params
+        
+        def create_events():
+            # 入口阶段（不依赖其他阶段的 model 阶段）的上游都不可用时直接拒绝
+            entry = pipeline.ready({USER_MESSAGE}) + ([output] if not output.inputs else [])
+            for stage in entry:
+                if stage.id in runtime:
+                    check_admission(runtime[stage.id][1])
+            return stream_pipeline_response(
+                pipeline=pipeline,
+                runtime=runtime,
+                user_message=user_message,
+                log_info=log_info,
+                tenant=tenant,
+                sse_options=sse_options,
+                deadline=deadline,
+                fast=request.fast,
+                history=history
+            )
+    
+    elif workflow_type == "proprietary":
+        # 纯专有模型流程
+        logger.info("执行专有模型流程（流式）")
+        
+        # 获取专有模型的提示词
+        proprietary_prompt = prompts_dict.get("proprietary")
+        if not proprietary_prompt:
+            raise HTTPException(status_code=404, detail="未找到 model_type=proprietary 的提示词")
+        
+        # 获取专有模型的 provider 池（首选 provider 在前）
+        proprietary_providers = snapshot.get_provider_pool("professional")
+        if not proprietary_providers:
+            raise HTTPException(status_code=404, detail="未找到 category=professional 的模型配置")
+        proprietary_provider = proprietary_providers[0]
+        
+        # 提取参数（实际使用的 provider 和模型在获得准入后更新到日志）
+        route = ModelRoute(len(user_message), requested=request.fast)
+        model_name, model_route = select_model(proprietary_provider, route)
+        temperature = get_provider_temperature(proprietary_provider)
+        
+        logger.info(
+            f"专有模型配置 - model: {model_name} ({model_route}), temperature: {temperature}, "
+            f"provider 数: {len(proprietary_providers)}"
+        )
+        
+        # 记录专有模型参数
+        log_info["workflow_type"] = "proprietary"
+        proprietary_params = {
+            "model": model_name,
+            "model_route": model_route,
+            "generation": proprietary_provider.get_generation_params(model_name),
+            "temperature": temperature,
+            "api_base": proprietary_provider.api_base
         }
+        # 添加文风信息
+        if writing_style_info:
+            proprietary_params["writing_style"] = writing_style_info.get("writing_style", "")
+            proprietary_params["writing_features"] = writing_style_info.get("features", "")
+        log_info["proprietary_params"] = proprietary_params
         
-        # 第一步：获取 workflow 参数
-        if workflow_id:
-            # 如果提供了 workflowId，通过 backend_id 查找对应的 workflow
-            workflow = db.query(Workflow).filter(Workflow.backend_id == workflow_id).first()
-            if not workflow:
-                logger.warning(f"未找到 backend_id={workflow_id} 的 workflow，使用默认第一条")
-                workflow = db.query(Workflow).first()
-            else:
-                logger.info(f"使用指定的 workflow: {workflow.name} (backend_id={workflow_id})")
-        else:
-            # 如果没有提供 workflowId，使用第一条数据
-            workflow = db.query(Workflow).first()
-            logger.info(f"未提供 workflowId，使用默认第一条 workflow")
+        # 构建消息
+        messages = build_messages(proprietary_prompt, user_message, history)
         
-        if not workflow:
-            raise HTTPException(status_code=404, detail="未找到 workflow 配置")
+        def create_events():
+            check_admission(proprietary_providers)
+            return stream_chat_response(
+                messages=messages,
+                providers=proprietary_providers,
+                log_info=log_info,
+                tenant=tenant,
+                deadline=deadline,
+                route=route,
+                **sse_options
+            )
         
-        workflow_type = workflow.workflow_type
-        logger.info(f"Workflow 类型: {workflow_type}")
-        logger.info(f"Workflow 名称: {workflow.name}")
+    elif workflow_type == "proprietary->general":
+        # 专有模型 -> 通用模型流程
+        logger.info("执行专有模型->通用模型流程")
         
-        # 第二步：获取 prompts 提示词数据
-        prompts = db.query(Prompt).all()
-        if not prompts:
-            raise HTTPException(status_code=404, detail="未找到 prompts 配置")
+        # 获取专有模型的提示词和配置
+        proprietary_prompt = prompts_dict.get("proprietary")
+        if not proprietary_prompt:
+            raise HTTPException(status_code=404, detail="未找到 model_type=proprietary 的提示词")
         
-        prompts_dict = {p.model_type: p for p in prompts}
-        logger.info(f"加载了 {len(prompts)} 个 prompts: {list(prompts_dict.keys())}")
+        proprietary_providers = snapshot.get_provider_pool("professional")
+        if not proprietary_providers:
+            raise HTTPException(status_code=404, detail="未找到 category=professional 的模型配置")
+        proprietary_provider = proprietary_providers[0]
         
-        # 第三步：获取 llm_providers 模型参数配置
-        providers = db.query(LLMProvider).all()
-        if not providers:
-            raise HTTPException(status_code=404, detail="未找到 llm_providers 配置")
+        # 获取通用模型的提示词和配置
+        general_prompt = prompts_dict.get("general")
+        if not general_prompt:
+            raise HTTPException(status_code=404, detail="未找到 model_type=general 的提示词")
         
-        providers_dict = {p.category: p for p in providers}
-        logger.info(f"加载了 {len(providers)} 个 providers: {list(providers_dict.keys())}")
+        general_providers = snapshot.get_provider_pool("general")
+        if not general_providers:
+            raise HTTPException(status_code=404, detail="未找到 category=general 的模型配置")
+        general_provider = general_providers[0]
         
-        # 第四步：根据 workflow_type 处理
-        if workflow_type == "proprietary":
-            # 纯专有模型流程
-            logger.info("执行专有模型流程（流式）")
-            
-            # 获取专有模型的提示词
-            proprietary_prompt = prompts_dict.get("proprietary")
-            if not proprietary_prompt:
-                raise HTTPException(status_code=404, detail="未找到 model_type=proprietary 的提示词")
-            
-            # 获取专有模型的配置
-            proprietary_provider = providers_dict.get("professional")
-            if not proprietary_provider:
-                raise HTTPException(status_code=404, detail="未找到 category=professional 的模型配置")
-            
-            # 提取参数
-            system_prompt = proprietary_prompt.system_prompt or ""
-            user_prompt_template = proprietary_prompt.user_prompt or "{user_message}"
-            user_content = user_prompt_template.replace("{user_message}", user_message)
-            
-            api_base = proprietary_provider.api_base
-            # 解密 API 密钥
-            api_key_value = decrypt_api_key(proprietary_provider.api_key) if proprietary_provider.api_key else ""
-            model_name = proprietary_provider.default_model_name
-            
-            # 获取 temperature
-            temperature = 0.7
-            if proprietary_provider.custom_config and isinstance(proprietary_provider.custom_config, dict):
-                temp_value = proprietary_provider.custom_config.get("temperature")
-                if temp_value:
-                    try:
-                        temperature = float(temp_value)
-                    except (ValueError, TypeError):
-                        pass
-            
-            logger.info(f"专有模型配置 - model: {model_name}, temperature: {temperature}")
-            
-            # 记录专有模型参数
-            log_info["workflow_type"] = "proprietary"
-            proprietary_params = {
-                "model": model_name,
-                "temperature": temperature,
-                "api_base": api_base
-            }
-            # 添加文风信息
-            if writing_style_info:
-                proprietary_params["writing_style"] = writing_style_info.get("writing_style", "")
-                proprietary_params["writing_features"] = writing_style_info.get("features", "")
-            log_info["proprietary_params"] = proprietary_params
-            
-            # 构建消息
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            messages.append({"role": "user", "content": user_content})
-            
-            # 返回流式响应
-            return StreamingResponse(
-                stream_chat_response(
-                    messages=messages,
-                    api_base=api_base,
-                    api_key=api_key_value,
-                    model=model_name,
-                    temperature=temperature,
-                    log_info=log_info
-                ),
-                media_type="text/event-stream",
-                headers={
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Headers": "*",
-                    "Access-Control-Allow-Methods": "*",
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "X-Accel-Buffering": "no"
-                }
+        # 专有模型参数
+        proprietary_messages = build_messages(proprietary_prompt, user_message, history)
+        proprietary_temperature = get_provider_temperature(proprietary_provider)
+        stage1_route = ModelRoute(len(user_message), requested=request.fast)
+        proprietary_model, proprietary_route = select_model(proprietary_provider, stage1_route)
+        logger.info(f"专有模型 - model: {proprietary_model} ({proprietary_route}), temp: {proprietary_temperature}")
+        
+        # 长文本分块（按 workflow 配置启用）：对原始消息切块，文风信息拼接到每一块
+        chunked = build_chunked_messages(
+            proprietary_prompt,
+            request.user_message if style_suffix else user_message,
+            style_suffix,
+            get_chunk_config(workflow.config),
+            history
+        )
+        if chunked:
+            logger.info(f"长文本分块: {len(chunked['messages'])} 块, 并发数 {chunked['concurrency']}")
+        
+        # 记录专有模型参数
+        log_info["workflow_type"] = "proprietary->general"
+        log_info["proprietary_params"] = {
+            "model": proprietary_model,
+            "model_route": proprietary_route,
+            "generation": proprietary_provider.get_generation_params(proprietary_model),
+            "temperature": proprietary_temperature,
+            "api_base": proprietary_provider.api_base
+        }
+        
+        # 通用模型参数
+        general_temperature = get_provider_temperature(general_provider)
+        logger.info(f"通用模型 - model: {general_provider.default_model_name}, temp: {general_temperature}")
+        
+        # 记录通用模型参数
+        general_params = {
+            "model": general_provider.default_model_name,
+            "generation": general_provider.get_generation_params(general_provider.default_model_name),
+            "temperature": general_temperature,
+            "api_base": general_provider.api_base
+        }
+        # 添加文风信息
+        if writing_style_info:
+            general_params["writing_style"] = writing_style_info.get("writing_style", "")
+            general_params["writing_features"] = writing_style_info.get("features", "")
+        log_info["general_params"] = general_params
+        
+        # 两步调用都在响应流内进行
+        def create_events():
+            check_admission(proprietary_providers)
+            return stream_two_stage_response(
+                proprietary_messages=proprietary_messages,
+                proprietary_providers=proprietary_providers,
+                general_prompt=general_prompt,
+                general_providers=general_providers,
+                log_info=log_info,
+                cache_config=get_stage1_cache_config(workflow.config),
+                relay_stage1=is_stage1_relay_enabled(workflow.config, request.stream_stage1),
+                tenant=tenant,
+                sse_options=sse_options,
+                hedge_config=get_hedge_config(workflow.config),
+                chunked=chunked,
+                deadline=deadline,
+                stage1_route=stage1_route,
+                fast=request.fast
             )
-            
-        elif workflow_type == "proprietary->general":
-            # 专有模型 -> 通用模型流程
-            logger.info("执行专有模型->通用模型流程")
-            
-            # 获取专有模型的提示词和配置
-            proprietary_prompt = prompts_dict.get("proprietary")
-            if not proprietary_prompt:
-                raise HTTPException(status_code=404, detail="未找到 model_type=proprietary 的提示词")
-            
-            proprietary_provider = providers_dict.get("professional")
-            if not proprietary_provider:
-                raise HTTPException(status_code=404, detail="未找到 category=professional 的模型配置")
-            
-            # 获取通用模型的提示词和配置
-            general_prompt = prompts_dict.get("general")
-            if not general_prompt:
-                raise HTTPException(status_code=404, detail="未找到 model_type=general 的提示词")
-            
-            general_provider = providers_dict.get("general")
-            if not general_provider:
-                raise HTTPException(status_code=404, detail="未找到 category=general 的模型配置")
-            
-            # 第一步：调用专有模型（非流式）
-            logger.info("步骤1: 调用专有模型（非流式）")
-            
-            proprietary_system = proprietary_prompt.system_prompt or ""
-            proprietary_user_template = proprietary_prompt.user_prompt or "{user_message}"
-            proprietary_user_content = proprietary_user_template.replace("{user_message}", user_message)
-            
-            proprietary_messages = []
-            if proprietary_system:
-                proprietary_messages.append({"role": "system", "content": proprietary_system})
-            proprietary_messages.append({"role": "user", "content": proprietary_user_content})
-            
-            # 专有模型参数
-            proprietary_temperature = 0.7
-            if proprietary_provider.custom_config and isinstance(proprietary_provider.custom_config, dict):
-                temp_value = proprietary_provider.custom_config.get("temperature")
-                if temp_value:
-                    try:
-                        proprietary_temperature = float(temp_value)
-                    except (ValueError, TypeError):
-                        pass
-            
-            logger.info(f"专有模型 - model: {proprietary_provider.default_model_name}, temp: {proprietary_temperature}")
-            
-            # 记录专有模型参数
-            log_info["workflow_type"] = "proprietary->general"
-            log_info["proprietary_params"] = {
-                "model": proprietary_provider.default_model_name,
-                "temperature": proprietary_temperature,
-                "api_base": proprietary_provider.api_base
-            }
-            
-            # 调用专有模型（非流式）
-            try:
-                # 解密专有模型的 API 密钥
-                proprietary_api_key = decrypt_api_key(proprietary_provider.api_key) if proprietary_provider.api_key else ""
-                
-                proprietary_result = call_llm_non_stream(
-                    messages=proprietary_messages,
-                    api_base=proprietary_provider.api_base,
-                    api_key=proprietary_api_key,
-                    model=proprietary_provider.default_model_name,
-                    temperature=proprietary_temperature
+    else:
+        raise HTTPException(status_code=400, detail=f"不支持的 workflow_type: {workflow_type}")
+    
+    if session is not None:
+        create_turn_events = create_events
+        
+        def create_events():
+            return record_session_turn(create_turn_events(), session["id"], request.user_message, log_info)
+    
+    return workflow, sse_options, create_events
+
+
+@router.post("/stream")
+async def stream_chat(
+    request: ChatRequest = Body(..., description="聊天请求"),
+    api_key: ApiKey = Depends(verify_api_key_dependency),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    request_timeout: Optional[str] = Header(None, alias=TIMEOUT_HEADER)
+):
+    """
+    流式聊天接口 - 从内存配置快照获取配置，流程见 prepare_chat_generation
+    
+    两种流程都会立即打开 SSE 响应：先发送 start 事件，两段式流程额外发送 stage 进度事件，
+    空闲期间发送心跳注释；请求 stream_stage1=true（或 Workflow.config 中 stage1_relay=true）
+    时专有模型的 token 以 stage1 事件转发。
+    
+    断线续传：每个事件带有 "id: <generation>:<seq>"，响应头 X-Generation-Id 为本次生成的 id。
+    断线后用相同请求重新连接并携带 Last-Event-ID 头，从断点继续接收同一次生成的事件
+    （生成未结束时需要 Workflow.config.sse.resume_grace 或 SSE_RESUME_GRACE 大于 0，否则断开即取消）；
+    生成已过期、断点超出缓冲区或请求体与原请求不同时重新生成（新的 generation id）。
+    
+    截止时间：请求头 X-Request-Timeout（秒）或 Workflow.config.deadline 限定整体耗时，
+    超时的阶段被取消，客户端收到 {"type": "error", "stage": ..., "code": 504} 事件。
+    
+    多轮会话：先通过 POST /api/chat/sessions 创建会话，之后每轮携带 session_id 且只发送新的消息，
+    服务端带上按 token 预算裁剪的历史，生成完成时保存本轮。
+    """
+    try:
+        # 第零步：断线续传，不重新调用上游（请求体需与原请求一致）
+        fingerprint = make_flight_key(**request.model_dump())
+        generation_id, last_seq = parse_last_event_id(last_event_id)
+        if generation_id:
+            resumable = sse_streams.resume(generation_id, last_seq, tenant=api_key.id, fingerprint=fingerprint)
+            if resumable is not None:
+                return StreamingResponse(
+                    with_heartbeat(resumable.subscribe(last_seq)),
+                    media_type="text/event-stream",
+                    headers={**SSE_HEADERS, "X-Generation-Id": resumable.id}
                 )
-                logger.info(f"专有模型返回内容长度: {len(proprietary_result)}")
-                log_info["proprietary_response"] = proprietary_result
-            except Exception as e:
-                logger.error(f"专有模型调用失败: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"专有模型调用失败: {str(e)}")
-            
-            # 第二步：调用通用模型（流式）
-            logger.info("步骤2: 调用通用模型（流式）")
-            
-            general_system = general_prompt.system_prompt or ""
-            general_user_template = general_prompt.user_prompt or "{user_message}"
-            # 将专有模型的结果作为通用模型的 user_message
-            general_user_content = general_user_template.replace("{user_message}", proprietary_result)
-            
-            general_messages = []
-            if general_system:
-                general_messages.append({"role": "system", "content": general_system})
-            general_messages.append({"role": "user", "content": general_user_content})
-            
-            # 通用模型参数
-            general_temperature = 0.7
-            if general_provider.custom_config and isinstance(general_provider.custom_config, dict):
-                temp_value = general_provider.custom_config.get("temperature")
-                if temp_value:
-                    try:
-                        general_temperature = float(temp_value)
-                    except (ValueError, TypeError):
-                        pass
-            
-            logger.info(f"通用模型 - model: {general_provider.default_model_name}, temp: {general_temperature}")
-            
-            # 记录通用模型参数
-            general_params = {
-                "model": general_provider.default_model_name,
-                "temperature": general_temperature,
-                "api_base": general_provider.api_base
-            }
-            # 添加文风信息
-            if writing_style_info:
-                general_params["writing_style"] = writing_style_info.get("writing_style", "")
-                general_params["writing_features"] = writing_style_info.get("features", "")
-            log_info["general_params"] = general_params
-            
-            # 解密通用模型的 API 密钥
-            general_api_key = decrypt_api_key(general_provider.api_key) if general_provider.api_key else ""
-            
-            # 返回流式响应
-            return StreamingResponse(
-                stream_chat_response(
-                    messages=general_messages,
-                    api_base=general_provider.api_base,
-                    api_key=general_api_key,
-                    model=general_provider.default_model_name,
-                    temperature=general_temperature,
-                    log_info=log_info
-                ),
-                media_type="text/event-stream",
-                headers={
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Headers": "*",
-                    "Access-Control-Allow-Methods": "*",
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "X-Accel-Buffering": "no"
-                }
+            logger.info(f"无法续传生成 {generation_id}（断点 {last_seq}），重新生成")
+        
+        # 准入控制按 ApiKey 公平排队
+        session = await load_chat_session(request, tenant=api_key.id)
+        workflow, sse_options, create_events = prepare_chat_generation(
+            request, tenant=api_key.id, timeout=request_timeout, session=session
+        )
+        
+        # 第五步：相同请求合并（按 workflow 配置启用），合并窗口内的相同请求共享一次上游生成；
+        # 请求的超时时间不同则不合并，避免跟随者继承领头请求更长（或更短）的截止时间
+        coalesce_config = get_coalesce_config(workflow.config)
+        if coalesce_config:
+            flight_key = make_flight_key(
+                workflow_id=workflow.id,
+                user_message=request.user_message,
+                writing_style=request.writing_style,
+                session_id=request.session_id,
+                stream_stage1=request.stream_stage1,
+                fast=request.fast,
+                sse_options=sse_options,
+                timeout=float(request_timeout) if request_timeout not in (None, "") else None
             )
+            flight, is_leader = chat_flights.join_or_start(flight_key, create_events, coalesce_config["window"])
+            if is_leader:
+                logger.info(f"发起新的生成: key={flight_key[:12]}")
+            events = flight.subscribe()
         else:
-            raise HTTPException(status_code=400, detail=f"不支持的 workflow_type: {workflow_type}")
+            events = create_events()
+        
+        # 生成在后台执行并为事件编号，客户端断开时取消（配置了 resume_grace 时保留一段时间等待续传）
+        resumable = sse_streams.start(
+            events, tenant=api_key.id, fingerprint=fingerprint, grace=get_resume_grace(workflow.config)
+        )
+        
+        # 立即返回流式响应
+        return StreamingResponse(
+            with_heartbeat(resumable.subscribe()),
+            media_type="text/event-stream",
+            headers={**SSE_HEADERS, "X-Generation-Id": resumable.id}
+        )
         
     except HTTPException:
         raise
@@ -623,6 +2086,123 @@ async def stream_chat(
         raise HTTPException(status_code=500, detail=f"流式聊天失败: {str(e)}")
 
 
+async def run_batch_item(index: int, item: ChatRequest, tenant: Any = None) -> Dict[str, Any]:
+    """执行批量请求中的一条，返回该条结果（失败时返回错误信息，不抛出异常）"""
+    start_time = time.time()
+    try:
+        session = await load_chat_session(item, tenant=tenant)
+        _, _, create_events = prepare_chat_generation(
+            item, tenant=tenant, sse_overrides=CHAT_BATCH_SSE_OPTIONS, session=session
+        )
+        events = create_events()
+    except HTTPException as e:
+        return {
+            "index": index, "success": False, "code": e.status_code, "error": e.detail,
+            "duration": round(time.time() - start_time, 3)
+        }
+    except Exception as e:
+        logger.error(f"批量请求第 {index} 条准备失败: {str(e)}", exc_info=True)
+        return {
+            "index": index, "success": False, "code": 500, "error": str(e),
+            "duration": round(time.time() - start_time, 3)
+        }
+    
+    parts = []
+    content = None
+    error = None
+    try:
+        async for event in events:
+            _, _, payload = event.partition("data: ")
+            data = json.loads(payload)
+            event_type = data.get("type")
+            if event_type == "content":
+                parts.append(data["content"])
+            elif event_type == "done":
+                content = data.get("full_content")
+            elif event_type == "error":
+                error = data
+    except Exception as e:
+        logger.error(f"批量请求第 {index} 条生成失败: {str(e)}", exc_info=True)
+        error = {"message": str(e)}
+    finally:
+        await events.aclose()
+    
+    duration = round(time.time() - start_time, 3)
+    if error is not None:
+        result = {"index": index, "success": False, "code": error.get("code", 502), "error": error.get("message")}
+        if error.get("retry_after") is not None:
+            result["retry_after"] = error["retry_after"]
+        result["duration"] = duration
+        return result
+    return {
+        "index": index,
+        "success": True,
+        "content": content if content is not None else "".join(parts),
+        "duration": duration
+    }
+
+
+async def iter_batch_results(items: List[ChatRequest], concurrency: int, tenant: Any = None):
+    """
+    以固定数量的 worker 执行批量请求，按完成顺序逐行输出 NDJSON 结果
+
+    客户端断开时取消所有 worker，进行中的生成按中止记录日志
+    """
+    results: asyncio.Queue = asyncio.Queue()
+    pending = iter(enumerate(items))
+    
+    async def worker():
+        # 所有 worker 共享同一个迭代器，逐条领取（事件循环内单线程，无需加锁）
+        for index, item in pending:
+            await results.put(await run_batch_item(index, item, tenant))
+    
+    workers = [asyncio.ensure_future(worker()) for _ in range(min(concurrency, len(items)))]
+    succeeded = 0
+    try:
+        for _ in range(len(items)):
+            result = await results.get()
+            if result["success"]:
+                succeeded += 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        logger.info(f"批量请求完成: 共 {len(items)} 条, 成功 {succeeded} 条, 失败 {len(items) - succeeded} 条")
+    finally:
+        for task in workers:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+@router.post("/batch")
+async def batch_chat(
+    request: ChatBatchRequest = Body(..., description="批量聊天请求"),
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    批量聊天接口 - 每条请求按 /stream 相同的 workflow 流程生成，限制同时进行的生成数
+    
+    响应为 NDJSON（application/x-ndjson），每条请求完成后输出一行，顺序为完成顺序：
+    - 成功: {"index": 0, "success": true, "content": "...", "duration": 1.23}
+    - 失败: {"index": 1, "success": false, "code": 502, "error": "...", "duration": 0.5}
+    单条失败（配置缺失、上游出错、准入被拒绝等）不影响其他条目。
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items 不能为空")
+    if len(request.items) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"单次最多提交 {CHAT_BATCH_MAX_ITEMS} 条，当前 {len(request.items)} 条"
+        )
+    concurrency = request.concurrency or CHAT_BATCH_DEFAULT_CONCURRENCY
+    concurrency = min(max(concurrency, 1), CHAT_BATCH_MAX_CONCURRENCY)
+    logger.info(f"收到批量请求: {len(request.items)} 条, 并发数: {concurrency}")
+    
+    return StreamingResponse(
+        iter_batch_results(request.items, concurrency, tenant=api_key.id),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/data/list")
 async def get_chat_data(
     prompt_skip: int = Query(0, ge=0, description="Prompt 跳过的记录数"),
@@ -666,6 +2246,141 @@ async def get_chat_data(
         raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
 
+@router.get("/log-shipper/stats")
+async def get_log_shipper_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取聊天日志发送器的统计信息
+    包括队列深度、发送/落盘/补发/丢弃条数和批量发送耗时
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": chat_log_shipper.get_stats()
+    }
+
+
+@router.get("/cache/stats")
+async def get_cache_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取专有模型结果缓存的统计信息
+    包括条目数、内存占用、命中/未命中次数和淘汰次数
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": stage1_cache.get_stats()
+    }
+
+
+@router.get("/coalesce/stats")
+async def get_coalesce_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取相同请求合并的统计信息
+    包括进行中的生成数、订阅者数、发起/合并次数和合并率
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": chat_flights.get_stats()
+    }
+
+
+@router.get("/resume/stats")
+async def get_resume_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取可续传 SSE 生成的统计信息
+    包括进行中/已结束保留的生成数、无人连接等待续传的生成数、缓冲事件数和续传命中/未命中次数
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": sse_streams.get_stats()
+    }
+
+
+@router.get("/admission/stats")
+async def get_admission_stats_api(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取各上游（api_base）的准入控制统计信息
+    包括并发占用、排队数、排队租户数、平均/最大排队时间、拒绝和超时次数
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": get_admission_stats()
+    }
+
+
+@router.get("/providers/stats")
+async def get_provider_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取 provider 池的路由统计信息
+    包括进行中请求数、首 token / 完整响应延迟 EWMA、请求数、失败次数和最近错误
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": provider_router.get_stats()
+    }
+
+
+@router.get("/hedge/stats")
+async def get_hedge_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取专有模型（第一步）对冲请求的统计信息
+    包括请求数、对冲次数和比例、对冲请求胜出次数和比例、最近调用延迟分位数
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": stage1_hedger.get_stats()
+    }
+
+
+@router.get("/fast-model/stats")
+async def get_fast_model_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取快速模型路由的对比报告（按 provider 和调用方式）
+    包括快速模型与默认模型各自的请求数、平均/中位延迟、中位 TTFT、快速模型占比和估计节省的时间
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": fast_model_stats.get_report()
+    }
+
+
+@router.get("/circuit/stats")
+async def get_circuit_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取各上游（api_base）的熔断器状态
+    包括状态（closed / open / half_open）、连续失败次数、距离下次探测的秒数、成功/失败/拒绝/打开次数
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": get_breaker_stats()
+    }
+
+
 @router.get("/logs")
 async def get_logs(
     lines: int = Query(50, ge=1, le=1000, description="返回的日志行数"),
@@ -678,7 +2393,8 @@ async def get_logs(
     """
     try:
         # 调用代理服务获取日志
-        response = requests.get(
+        client = get_http_client()
+        response = await client.get(
             PROXY_LOGS_URL,
             headers={
                 "Authorization": f"Bearer {PROXY_API_KEY}",
@@ -708,7 +2424,7 @@ async def get_logs(
             }
         }
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"请求代理服务日志失败: {str(e)}")
         raise HTTPException(
             status_code=502,
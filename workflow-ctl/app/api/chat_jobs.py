@@ -0,0 +1,157 @@
+from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi.responses import StreamingResponse
+from typing import Any, Dict
+import logging
+import os
+
+from app.models.apikey import ApiKey
+from app.middleware.auth import verify_api_key_dependency
+from app.api.chat import (
+    ChatRequest, SSE_HEADERS, generate_sse_event, load_chat_session, prepare_chat_generation, with_heartbeat
+)
+from app.storage.chat_jobs import chat_jobs
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# 异步任务的 SSE 输出选项：事件会写入数据库用于回放，增量按字符数/时间合并以减少事件数
+CHAT_JOB_SSE_OPTIONS = {
+    "frame_chars": int(os.getenv("CHAT_JOB_FRAME_CHARS", 256)),
+    "frame_delay": float(os.getenv("CHAT_JOB_FRAME_MS", 250)) / 1000,
+    "include_full_content": True,
+}
+
+
+async def create_job_events(request_data: Dict[str, Any], tenant: Any = None):
+    """
+    异步任务的执行入口：按 /stream 相同的 workflow 流程生成
+
+    开始前的检查失败时以 error 事件结束：上游暂时不可用（429/503）的事件带 retry_after，
+    由任务执行器等待后重试；配置缺失（404）、请求无效（400）等错误直接结束任务
+    """
+    try:
+        request = ChatRequest(**request_data)
+        session = await load_chat_session(request, tenant=tenant)
+        _, _, create_events = prepare_chat_generation(
+            request, tenant=tenant, sse_overrides=CHAT_JOB_SSE_OPTIONS, session=session
+        )
+        events = create_events()
+    except HTTPException as e:
+        data = {"type": "error", "code": e.status_code, "message": e.detail}
+        retry_after = (e.headers or {}).get("Retry-After")
+        if retry_after is not None:
+            data["retry_after"] = int(retry_after)
+        yield generate_sse_event(data, event="error")
+        return
+
+    try:
+        async for event in events:
+            yield event
+    finally:
+        await events.aclose()
+
+
+async def get_owned_job(job_id: str, api_key: ApiKey) -> Dict[str, Any]:
+    """获取任务，不存在或不属于当前 API Key 时返回 404"""
+    job = await chat_jobs.get(job_id)
+    if job is None or job["tenant"] != api_key.id:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+# ==================== 异步任务接口 ====================
+
+@router.post("")
+async def submit_chat_job(
+    request: ChatRequest = Body(..., description="聊天请求"),
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    提交异步聊天任务 - 立即返回任务 id，生成由后台 worker 执行
+
+    结果获取方式：
+    - 轮询 GET /api/chat/jobs/{id}，status 为 completed 时 result 为完整内容
+    - 接入 GET /api/chat/jobs/{id}/events，从第一个事件开始回放 SSE 事件流，任务结束后关闭
+    """
+    try:
+        job = await chat_jobs.submit(request.model_dump(), tenant=api_key.id)
+    except Exception as e:
+        logger.error(f"提交异步任务失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"提交任务失败: {str(e)}")
+    return {
+        "success": True,
+        "message": "提交成功",
+        "data": {"id": job["id"], "status": job["status"]}
+    }
+
+
+@router.get("/stats")
+async def get_chat_job_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取本 worker 进程的异步任务执行统计
+    包括执行中/排队数，以及完成、失败、取消、重新排队、等待重试、租约回收和清理的任务数
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": chat_jobs.get_stats()
+    }
+
+
+@router.get("/{job_id}")
+async def get_chat_job(
+    job_id: str,
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    查询异步任务状态
+    status: queued / running / completed / failed / cancelled
+    """
+    job = await get_owned_job(job_id, api_key)
+    job.pop("tenant", None)
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": job
+    }
+
+
+@router.get("/{job_id}/events")
+async def stream_chat_job_events(
+    job_id: str,
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    接入异步任务的 SSE 事件流 - 从第一个事件开始回放，之后跟随执行进度，任务结束后关闭
+
+    断开连接不影响任务执行，可随时重新接入；任务重新执行时先收到
+    stage 事件 {"stage": "job", "status": "restarted"}，此时应丢弃之前累计的内容。
+    上游暂时不可用时收到 stage 事件 {"stage": "job", "status": "waiting", "retry_after": N}，
+    之后任务自动重试
+    """
+    await get_owned_job(job_id, api_key)
+    return StreamingResponse(
+        with_heartbeat(chat_jobs.subscribe(job_id)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+@router.delete("/{job_id}")
+async def cancel_chat_job(
+    job_id: str,
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """取消排队中或执行中的异步任务，已结束的任务返回 409"""
+    await get_owned_job(job_id, api_key)
+    if not await chat_jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail="任务已结束，无法取消")
+    return {
+        "success": True,
+        "message": "取消成功",
+        "data": {"id": job_id, "status": "cancelled"}
+    }
@@ -0,0 +1,92 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Body
+from typing import Optional
+from pydantic import BaseModel
+import logging
+
+from app.models.apikey import ApiKey
+from app.middleware.auth import verify_api_key_dependency
+from app.storage.chat_sessions import CHAT_SESSION_MAX_HISTORY_TURNS, chat_sessions
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+class ChatSessionCreate(BaseModel):
+    """创建会话请求模型"""
+    workflowId: Optional[str] = None  # 会话默认使用的 workflow（每轮请求中的 workflowId 优先）
+
+
+# ==================== 会话接口 ====================
+
+@router.post("")
+async def create_chat_session(
+    request: ChatSessionCreate = Body(ChatSessionCreate(), description="创建会话请求"),
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    创建多轮会话 - 返回会话 id
+
+    之后调用 /api/chat/stream（或 /batch、/jobs）时携带 session_id，user_message 只需包含新的一轮；
+    空闲超过 CHAT_SESSION_IDLE_TTL 秒的会话会被删除
+    """
+    try:
+        session = await chat_sessions.create(tenant=api_key.id, workflow_id=request.workflowId)
+    except Exception as e:
+        logger.error(f"创建会话失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"创建会话失败: {str(e)}")
+    session.pop("tenant", None)
+    return {
+        "success": True,
+        "message": "创建成功",
+        "data": session
+    }
+
+
+@router.get("/stats")
+async def get_chat_session_stats(
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """
+    获取本 worker 进程的会话统计
+    包括创建、删除、保存的轮数和清理的过期会话数，以及空闲时间上限和默认历史预算
+    """
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": chat_sessions.get_stats()
+    }
+
+
+@router.get("/{session_id}")
+async def get_chat_session(
+    session_id: str,
+    limit: int = Query(20, ge=1, le=CHAT_SESSION_MAX_HISTORY_TURNS, description="返回最近的轮数"),
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """查询会话信息和最近 limit 轮的历史（按时间顺序）"""
+    session = await chat_sessions.get(session_id, tenant=api_key.id, limit=limit)
+    if session is None:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    session.pop("tenant", None)
+    return {
+        "success": True,
+        "message": "查询成功",
+        "data": session
+    }
+
+
+@router.delete("/{session_id}")
+async def delete_chat_session(
+    session_id: str,
+    api_key: ApiKey = Depends(verify_api_key_dependency)
+):
+    """删除会话及其全部历史"""
+    if not await chat_sessions.delete(session_id, tenant=api_key.id):
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return {
+        "success": True,
+        "message": "删除成功",
+        "data": {"id": session_id}
+    }
@@ -8,6 +8,7 @@ from app.models.apikey import ApiKey
 from app.schemas.llm_provider import LLMProviderSync, LLMProvider as LLMProviderSchema
 from app.schemas.common import Response
 from app.middleware.auth import verify_api_key_dependency
+from app.storage.config_snapshot import notify_config_changed
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -60,6 +61,7 @@ def sync_llm_provider(
         
         db.commit()
         db.refresh(existing)
+        notify_config_changed(db)
         
         logger.info(f"LLM Provider 更新成功: id={existing.id}, external_id={provider.external_id}")
         logger.info(f"更新前: {old_data}")
@@ -94,6 +96,7 @@ def sync_llm_provider(
         db.add(db_provider)
         db.commit()
         db.refresh(db_provider)
+        notify_config_changed(db)
         
         logger.info(f"LLM Provider 创建成功: id={db_provider.id}, external_id={provider.external_id}")
         
@@ -125,6 +128,7 @@ def delete_llm_provider_by_external_id(
     
     db.delete(db_provider)
     db.commit()
+    notify_config_changed(db)
     
     logger.info(f"LLM Provider 删除成功: external_id={external_id}")
     
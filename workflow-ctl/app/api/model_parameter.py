@@ -8,6 +8,7 @@ from app.models.apikey import ApiKey
 from app.schemas.model_parameter import ModelParameterSync, ModelParameter as ModelParameterSchema
 from app.schemas.common import Response
 from app.middleware.auth import verify_api_key_dependency
+from app.storage.config_snapshot import notify_config_changed
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -53,6 +54,7 @@ def sync_model_parameter(
         existing.validation = model_parameter.validation
         db.commit()
         db.refresh(existing)
+        notify_config_changed(db)
         
         logger.info(f"模型参数配置更新成功: id={existing.id}, external_id={model_parameter.external_id}")
         logger.info(f"更新前: {old_data}")
@@ -80,6 +82,7 @@ def sync_model_parameter(
         db.add(db_model_parameter)
         db.commit()
         db.refresh(db_model_parameter)
+        notify_config_changed(db)
         
         logger.info(f"模型参数配置创建成功: id={db_model_parameter.id}, external_id={model_parameter.external_id}")
         
@@ -111,6 +114,7 @@ def delete_model_parameter_by_external_id(
     
     db.delete(db_model_parameter)
     db.commit()
+    notify_config_changed(db)
     
     logger.info(f"模型参数配置删除成功: external_id={external_id}")
     
@@ -8,6 +8,7 @@ from app.models.apikey import ApiKey
 from app.schemas.prompt import PromptSync, Prompt as PromptSchema
 from app.schemas.common import Response
 from app.middleware.auth import verify_api_key_dependency
+from app.storage.config_snapshot import notify_config_changed
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -58,6 +59,7 @@ def sync_prompt(
                 existing.model_type = prompt.model_type
                 db.commit()
                 db.refresh(existing)
+                notify_config_changed(db)
                 
                 logger.info(f"Prompt 配置更新成功: id={existing.id}, external_id={prompt.external_id}")
                 logger.info(f"更新前: {old_data}")
@@ -87,6 +89,7 @@ def sync_prompt(
                 db.add(db_prompt)
                 db.commit()
                 db.refresh(db_prompt)
+                notify_config_changed(db)
                 
                 logger.info(f"Prompt 配置创建成功: id={db_prompt.id}, external_id={prompt.external_id}")
                 
@@ -133,6 +136,7 @@ def delete_prompt_by_external_id(
     
     db.delete(db_prompt)
     db.commit()
+    notify_config_changed(db)
     
     logger.info(f"Prompt 配置删除成功: external_id={external_id}")
     
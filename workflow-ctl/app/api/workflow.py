@@ -8,6 +8,7 @@ from app.models.apikey import ApiKey
 from app.schemas.workflow import WorkflowSync, Workflow as WorkflowSchema
 from app.schemas.common import Response
 from app.middleware.auth import verify_api_key_dependency
+from app.storage.config_snapshot import notify_config_changed
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -55,6 +56,7 @@ def sync_workflow(
                 existing.status = workflow.status  # 更新状态
                 db.commit()
                 db.refresh(existing)
+                notify_config_changed(db)
                 
                 logger.info(f"流程配置更新成功: id={existing.id}, external_id={workflow.external_id}")
                 logger.info(f"更新前: {old_data}")
@@ -88,6 +90,7 @@ def sync_workflow(
                 db.add(db_workflow)
                 db.commit()
                 db.refresh(db_workflow)
+                notify_config_changed(db)
                 
                 logger.info(f"流程配置创建成功: id={db_workflow.id}, external_id={workflow.external_id}, backend_id={db_workflow.backend_id}")
                 
@@ -136,6 +139,7 @@ def delete_workflow_by_external_id(
     
     db.delete(db_workflow)
     db.commit()
+    notify_config_changed(db)
     
     logger.info(f"流程配置删除成功: external_id={external_id}")
     
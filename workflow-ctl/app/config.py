@@ -2,6 +2,7 @@
 统一配置文件
 存放所有外部服务的 URL 和 API Key
 """
+import os
 
 # ==================== 外部服务配置 ====================
 
@@ -18,7 +19,8 @@ PROXY_LOGS_URL = f"{PROXY_BASE_URL}/v1/logs"
 PROXY_STATS_URL = f"{PROXY_BASE_URL}/v1/stats"
 FORBIDDEN_WORDS_URL = f"{PROXY_BASE_URL}/v1/forbidden-words"
 
+# ==================== Backend 服务配置 ====================
 
-
-
-
+# Backend 服务地址（聊天日志回传等）
+BACKEND_BASE_URL = os.getenv("BACKEND_BASE_URL", "http://localhost:8888")
+CHAT_LOG_BATCH_URL = f"{BACKEND_BASE_URL}/api/chat-logs/batch"
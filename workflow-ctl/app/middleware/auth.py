@@ -1,8 +1,30 @@
 from fastapi import HTTPException, Request, status, Depends, Header
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from app.database.database import get_db
+from app.database.database import get_db, SessionLocal
 from app.models.apikey import ApiKey
-from typing import Optional
+from app.storage.change_stamp import ChangeStamp
+from collections import OrderedDict
+from typing import Optional, Tuple
+import os
+import threading
+import time
+
+# ==================== API Key 验证缓存 ====================
+# 已验证 API Key 的缓存有效期（秒）
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 30))
+# 未知/无效 API Key 的负缓存有效期（秒）
+AUTH_CACHE_NEGATIVE_TTL = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", 5))
+# 缓存最大条目数（含负缓存），超过后淘汰最久未使用的条目
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", 10000))
+# 检查其他 worker 失效通知的最小间隔（秒）
+AUTH_CACHE_CHECK_INTERVAL = float(os.getenv("AUTH_CACHE_CHECK_INTERVAL", 1.0))
+
+_MISS = object()
+_auth_cache: "OrderedDict[str, Tuple[float, Optional[ApiKey]]]" = OrderedDict()
+_auth_cache_lock = threading.Lock()
+# 任一 worker 的 /api/apikeys/sync 修改 Key 后更新戳文件，其他 worker 据此清空缓存
+_auth_stamp = ChangeStamp(".apikey_cache_stamp", AUTH_CACHE_CHECK_INTERVAL)
 
 def verify_api_key(request: Request, db: Session) -> bool:
     """
@@ -41,7 +63,7 @@ def verify_api_key(request: Request, db: Session) -> bool:
     return True
 
 
-def get_api_key_from_header(
+async def get_api_key_from_header(
     authorization: Optional[str] = Header(None, alias="Authorization")
 ) -> str:
     """
@@ -63,21 +85,84 @@ def get_api_key_from_header(
         return authorization.strip()
 
 
-def verify_api_key_dependency(
-    api_key: str = Depends(get_api_key_from_header),
-    db: Session = Depends(get_db)
+def _get_cached_api_key(api_key: str):
+    """读取缓存，未命中或已过期时返回 _MISS，负缓存命中时返回 None"""
+    if _auth_stamp.poll():
+        clear_api_key_cache()
+    with _auth_cache_lock:
+        entry = _auth_cache.get(api_key)
+        if entry is None:
+            return _MISS
+        expires_at, db_key = entry
+        if expires_at <= time.monotonic():
+            _auth_cache.pop(api_key, None)
+            return _MISS
+        _auth_cache.move_to_end(api_key)
+        return db_key
+
+
+def _set_cached_api_key(api_key: str, db_key: Optional[ApiKey]):
+    """写入缓存，db_key 为 None 表示负缓存"""
+    ttl = AUTH_CACHE_TTL if db_key is not None else AUTH_CACHE_NEGATIVE_TTL
+    if ttl <= 0 or AUTH_CACHE_MAX_SIZE <= 0:
+        return
+    with _auth_cache_lock:
+        _auth_cache[api_key] = (time.monotonic() + ttl, db_key)
+        _auth_cache.move_to_end(api_key)
+        while len(_auth_cache) > AUTH_CACHE_MAX_SIZE:
+            _auth_cache.popitem(last=False)
+
+
+def clear_api_key_cache():
+    """清空本进程的 API Key 验证缓存"""
+    with _auth_cache_lock:
+        _auth_cache.clear()
+
+
+def invalidate_api_key_cache(*api_keys: Optional[str]):
+    """
+    API Key 变更后立即失效对应缓存，并通知其他 worker 清空缓存
+    由 /api/apikeys/sync 和 /api/apikeys/sync/{external_id} 在提交后调用
+    """
+    with _auth_cache_lock:
+        for api_key in api_keys:
+            if api_key:
+                _auth_cache.pop(api_key, None)
+    _auth_stamp.touch()
+
+
+def _query_active_api_key(api_key: str) -> Optional[ApiKey]:
+    """查询数据库中状态为 active 的 API Key，返回脱离会话的对象以便缓存"""
+    db = SessionLocal()
+    try:
+        db_key = db.query(ApiKey).filter(
+            ApiKey.key == api_key,
+            ApiKey.status == "active"
+        ).first()
+        if db_key is not None:
+            db.expunge(db_key)
+        return db_key
+    finally:
+        db.close()
+
+
+async def verify_api_key_dependency(
+    api_key: str = Depends(get_api_key_from_header)
 ) -> ApiKey:
     """
     FastAPI 依赖函数：验证 API Key
     在所有需要认证的路由上使用：Depends(verify_api_key_dependency)
     
+    验证结果在进程内缓存（有效 Key 缓存 AUTH_CACHE_TTL 秒，无效 Key 负缓存
+    AUTH_CACHE_NEGATIVE_TTL 秒），命中时只需一次字典查找，不访问数据库
+    
     返回验证通过的 ApiKey 对象，如果验证失败则抛出 HTTPException
     """
-    # 查询数据库中是否存在该 API Key 且状态为 active
-    db_key = db.query(ApiKey).filter(
-        ApiKey.key == api_key,
-        ApiKey.status == "active"
-    ).first()
+    db_key = _get_cached_api_key(api_key)
+    if db_key is _MISS:
+        # 查询数据库中是否存在该 API Key 且状态为 active
+        db_key = await run_in_threadpool(_query_active_api_key, api_key)
+        _set_cached_api_key(api_key, db_key)
     
     if not db_key:
         raise HTTPException(
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, String, DateTime, Text, Integer, JSON, ForeignKey
+from sqlalchemy.dialects.mysql import LONGTEXT
+from sqlalchemy.sql import func
+from app.database.database import Base
+
+# 事件流和生成结果可能超过 MySQL TEXT 的 64KB 上限
+LongText = Text().with_variant(LONGTEXT(), "mysql")
+
+
+class ChatJob(Base):
+    """异步聊天任务存储模型"""
+    __tablename__ = "chat_jobs"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    tenant = Column(Integer, nullable=True, index=True)  # 提交任务的 ApiKey id
+    request = Column(JSON, nullable=False)  # ChatRequest 内容
+    status = Column(String(20), default="queued", nullable=False, index=True)  # queued, running, completed, failed, cancelled
+    result = Column(LongText, nullable=True)  # 生成的完整内容
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)  # 被 worker 领取执行的次数
+    worker = Column(String(100), nullable=True)  # 执行中的 worker（主机名:进程号）
+    heartbeat_at = Column(DateTime, nullable=True)  # 执行中的 worker 最近一次续约时间
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True, index=True)
+
+
+class ChatJobEvent(Base):
+    """异步任务已发出的 SSE 事件（只追加）：每次写入进度时把新增的事件拼接为一段，按 seq 顺序回放"""
+    __tablename__ = "chat_job_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(32), ForeignKey("chat_jobs.id", ondelete="CASCADE"), nullable=False, index=True)
+    seq = Column(Integer, nullable=False)  # 在该任务中的段序号，从 1 开始
+    data = Column(LongText, nullable=False)
@@ -0,0 +1,28 @@
+from sqlalchemy import Column, String, DateTime, Integer, ForeignKey
+from sqlalchemy.sql import func
+from app.database.database import Base
+from app.models.chat_job import LongText
+
+
+class ChatSession(Base):
+    """多轮会话存储模型"""
+    __tablename__ = "chat_sessions"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    tenant = Column(Integer, nullable=True, index=True)  # 创建会话的 ApiKey id
+    workflow_id = Column(String(100), nullable=True)  # 会话默认使用的 workflow backend_id
+    turns = Column(Integer, default=0, nullable=False)  # 已完成的轮数
+    created_at = Column(DateTime, default=func.now())
+    last_active_at = Column(DateTime, default=func.now(), index=True)  # 最近一轮完成时间，用于淘汰空闲会话
+
+
+class ChatSessionTurn(Base):
+    """会话中已完成的一轮（只追加）：用户消息原文和最终回复，不含提示词模板和中间阶段的输出"""
+    __tablename__ = "chat_session_turns"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String(32), ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_message = Column(LongText, nullable=False)
+    reply = Column(LongText, nullable=False)
+    tokens = Column(Integer, default=0, nullable=False)  # 本轮两条消息的估算 token 数，裁剪历史时不必重新计算
+    created_at = Column(DateTime, default=func.now())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Union
 from datetime import datetime
 
 class ModelConfiguration(BaseModel):
@@ -7,6 +7,10 @@ class ModelConfiguration(BaseModel):
     name: str
     max_input_tokens: int
     supports_function_calling: bool
+    # 生成参数（可选），加载配置快照时编译进上游请求体，见 app.utils.generation_params
+    max_tokens: Optional[int] = None
+    top_p: Optional[float] = None
+    stop: Optional[Union[str, List[str]]] = None
 
 class LLMProviderBase(BaseModel):
     name: str
@@ -0,0 +1,54 @@
+"""
+跨 worker 变更通知
+uvicorn 多 worker 部署时各进程的内存缓存相互独立，
+写入方在 data 目录下更新戳文件，其他进程按固定间隔 stat 该文件即可发现变更，
+热路径上不需要访问数据库。
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+from app.database.database import data_dir
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeStamp:
+    """基于戳文件修改时间的变更通知"""
+
+    def __init__(self, filename: str, check_interval: float = 1.0):
+        self.path = data_dir / filename
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._last_check = time.monotonic()
+        self._seen = self.read()
+
+    def read(self) -> Optional[int]:
+        """读取戳文件的修改时间（纳秒），文件不存在时返回 None"""
+        try:
+            return self.path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def touch(self):
+        """更新戳文件，通知其他 worker（本进程不会因此收到变更通知）"""
+        try:
+            self.path.write_text(str(time.time_ns()))
+        except OSError as e:
+            logger.warning(f"更新戳文件失败: {self.path}, 错误: {str(e)}")
+        with self._lock:
+            self._seen = self.read()
+
+    def poll(self) -> bool:
+        """距上次检查超过 check_interval 时读取戳文件，被其他进程更新过则返回 True"""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        with self._lock:
+            self._last_check = now
+            current = self.read()
+            if current != self._seen:
+                self._seen = current
+                return True
+        return False
@@ -0,0 +1,675 @@
+"""
+异步聊天任务（job）
+长时间的生成不再占用一个 HTTP 连接：提交后立即返回任务 id，由 worker 池在后台执行，
+结果通过轮询获取，或随时接入 SSE 事件流从头回放。
+
+- 任务持久化在 chat_jobs 表，worker 进程重启后任务不丢失；已发出的 SSE 事件只追加写入
+  chat_job_events 表（每次写入进度时新增的事件拼接为一段，带序号），不重写已保存的部分
+- 每个 worker 进程启动 CHAT_JOB_WORKERS 个执行协程；领取任务通过
+  UPDATE ... WHERE status='queued' 原子完成，多个进程之间不会重复执行
+- 执行中的任务每 CHAT_JOB_FLUSH_INTERVAL 秒把新事件写入数据库并续约（heartbeat_at）；
+  超过 CHAT_JOB_LEASE_SECONDS 未续约的任务视为 worker 已退出，重新排队，
+  执行次数达到 CHAT_JOB_MAX_ATTEMPTS 后标记为失败
+- 上游暂时不可用（error 事件 code 为 429/503，且尚未输出内容）时不以失败结束：
+  先发送 stage 事件 {"stage": "job", "status": "waiting", "retry_after": N}，等待 retry_after 秒
+  （至少 CHAT_JOB_RETRY_DELAY 秒）后在本进程重试，等待期间照常续约；每次重试计入执行次数，
+  达到 CHAT_JOB_MAX_ATTEMPTS 后标记为失败
+- 重新执行时事件流只追加不覆盖：先发送 stage 事件 {"stage": "job", "status": "restarted"}，
+  客户端收到后应丢弃之前累计的内容
+- 进程正常退出时把执行中的任务放回队列，由其他进程（或重启后的进程）立即接手；
+  被中断的这次生成在聊天日志中记为 requeued / worker_shutdown，而不是客户端断开
+- 完成、失败或取消的任务保留 CHAT_JOB_RETENTION 秒后删除
+- 事件订阅：任务在本进程执行时直接跟随内存中的事件，否则从数据库回放并轮询新增部分
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.database.database import SessionLocal
+from app.models.chat_job import ChatJob, ChatJobEvent
+from app.utils.sse import encode_event
+
+logger = logging.getLogger(__name__)
+
+CHAT_JOB_WORKERS = int(os.getenv("CHAT_JOB_WORKERS", 4))
+CHAT_JOB_POLL_INTERVAL = float(os.getenv("CHAT_JOB_POLL_INTERVAL", 2.0))
+CHAT_JOB_FLUSH_INTERVAL = float(os.getenv("CHAT_JOB_FLUSH_INTERVAL", 1.0))
+CHAT_JOB_LEASE_SECONDS = float(os.getenv("CHAT_JOB_LEASE_SECONDS", 60.0))
+CHAT_JOB_MAX_ATTEMPTS = int(os.getenv("CHAT_JOB_MAX_ATTEMPTS", 3))
+# 上游暂时不可用时重试前的最短等待秒数（上游未给出 retry_after 时使用）
+CHAT_JOB_RETRY_DELAY = float(os.getenv("CHAT_JOB_RETRY_DELAY", 1.0))
+CHAT_JOB_RETENTION = float(os.getenv("CHAT_JOB_RETENTION", 86400.0))
+CHAT_JOB_CLEANUP_INTERVAL = float(os.getenv("CHAT_JOB_CLEANUP_INTERVAL", 300.0))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELLED)
+
+# 生成被中断的原因（记录在聊天日志中）
+CANCEL_REASON_SHUTDOWN = "worker_shutdown"
+CANCEL_REASON_CANCELLED = "job_cancelled"
+CANCEL_REASON_TAKEN_OVER = "job_taken_over"
+
+# 上游暂时不可用（等待队列已满 / 熔断中）的 error 事件 code：稍后重试，而不是以失败结束
+RETRYABLE_ERROR_CODES = (429, 503)
+
+# 执行任务的工厂：(request, tenant) -> SSE 事件流
+JobFactory = Callable[[Dict[str, Any], Any], AsyncIterator[str]]
+
+
+def _parse_event(event: str) -> Optional[Dict[str, Any]]:
+    """解析单个 SSE 事件的 data 部分，心跳等非 JSON 内容返回 None"""
+    _, _, payload = event.partition("data: ")
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _format_time(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+class LiveJob:
+    """本进程内正在执行的任务：记录已发出的事件并通知订阅者"""
+
+    def __init__(self, job_id: str, prior_events: str = "", seq: int = 0, attempts: int = 1):
+        self.id = job_id
+        self.attempts = attempts
+        # 之前执行留下的事件作为第一段，保证事件流只追加
+        self.events: List[str] = [prior_events] if prior_events else []
+        self.persisted = len(self.events)
+        # 已写入 chat_job_events 的段数；写入在线程池中进行，由 save_lock 串行化
+        self.seq = seq
+        self.save_lock = threading.Lock()
+        self.status = STATUS_RUNNING
+        self.cancel_reason: Optional[str] = None
+        self.result: Optional[str] = None
+        self.error: Optional[str] = None
+        self.done = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str):
+        self.events.append(event)
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def interrupt(self, reason: str):
+        """取消生成并记下原因"""
+        if self.task is not None and not self.task.done():
+            self.cancel_reason = reason
+            self.task.cancel()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """从第一个事件开始回放，然后跟随执行进度输出新事件"""
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+# 当前上下文中执行的任务：生成代码据此区分任务被取消、放回队列和客户端断开
+current_job: ContextVar[Optional[LiveJob]] = ContextVar("current_job", default=None)
+
+
+class ChatJobManager:
+    """异步聊天任务的提交、执行和查询（每个 worker 进程一个实例）"""
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._factory: Optional[JobFactory] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._live: Dict[str, LiveJob] = {}
+        self._workers: List[asyncio.Task] = []
+        self._poller: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._last_cleanup: Optional[float] = None
+        self._stats = {
+            "submitted": 0,
+            "claimed": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "requeued": 0,
+            "retried": 0,
+            "recovered": 0,
+            "expired": 0,
+            "cleaned": 0,
+        }
+
+    # ==================== 生命周期 ====================
+
+    def start(self, factory: JobFactory):
+        """启动执行协程和轮询任务（需在事件循环中调用）"""
+        if self._poller is not None and not self._poller.done():
+            return
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._factory = factory
+        self._stopping = False
+        self._queue = asyncio.Queue()
+        self._queued = set()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(CHAT_JOB_WORKERS)]
+        self._poller = asyncio.ensure_future(self._poll())
+        logger.info(f"异步任务执行器已启动: worker={self.worker_id}, 并发数={CHAT_JOB_WORKERS}")
+
+    async def stop(self):
+        """停止执行，本进程执行中的任务放回队列"""
+        if self._poller is None:
+            return
+        self._stopping = True
+        tasks = [self._poller] + self._workers
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._poller = None
+        self._workers = []
+        logger.info("异步任务执行器已停止")
+
+    # ==================== 提交与查询 ====================
+
+    async def submit(self, request: Dict[str, Any], tenant: Any = None) -> Dict[str, Any]:
+        """保存任务并放入本进程的执行队列，返回任务信息"""
+        job_id = uuid.uuid4().hex
+        job = await run_in_threadpool(self._insert, job_id, request, tenant)
+        self._stats["submitted"] += 1
+        self._enqueue(job_id)
+        logger.info(f"异步任务已提交: id={job_id}")
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态和结果（不含事件流）"""
+        return await run_in_threadpool(self._load, job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        """
+        取消排队中或执行中的任务，已结束的任务返回 False
+
+        任务在其他进程执行时，由该进程下一次写入事件时发现状态变化后停止
+        """
+        cancelled = await run_in_threadpool(self._mark_cancelled, job_id)
+        live = self._live.get(job_id)
+        if cancelled and live is not None:
+            live.interrupt(CANCEL_REASON_CANCELLED)
+        if cancelled:
+            self._stats["cancelled"] += 1
+            logger.info(f"异步任务已取消: id={job_id}")
+        return cancelled
+
+    async def subscribe(self, job_id: str) -> AsyncIterator[str]:
+        """
+        订阅任务的 SSE 事件流：从第一个事件开始回放，任务结束后关闭
+
+        任务在本进程执行时跟随内存中的事件，否则从数据库回放，
+        并每 CHAT_JOB_FLUSH_INTERVAL 秒读取新增的部分
+        """
+        live = self._live.get(job_id)
+        if live is not None:
+            async for event in live.follow():
+                yield event
+            if live.status != STATUS_QUEUED:
+                return
+            # 进程退出时任务被放回队列：已发出的事件都已写入数据库，改为从数据库跟随
+            seq = live.seq
+        else:
+            seq = 0
+
+        while True:
+            job = await run_in_threadpool(self._load, job_id, seq)
+            if job is None:
+                return
+            if job["events"]:
+                yield job["events"]
+                seq = job["event_seq"]
+            if job["status"] in FINISHED_STATUSES:
+                return
+            await asyncio.sleep(CHAT_JOB_FLUSH_INTERVAL)
+
+    # ==================== 执行 ====================
+
+    def _enqueue(self, job_id: str):
+        if self._queue is None or job_id in self._queued or job_id in self._live:
+            return
+        self._queued.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._execute(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"异步任务执行出错: id={job_id}, {str(e)}", exc_info=True)
+
+    async def _execute(self, job_id: str):
+        claimed = await run_in_threadpool(self._claim, job_id)
+        if claimed is None:
+            # 已被其他进程领取或已取消
+            return
+        request, tenant, prior_events, seq, attempts = claimed
+        self._stats["claimed"] += 1
+        logger.info(f"开始执行异步任务: id={job_id}, 第 {attempts} 次执行")
+
+        live = LiveJob(job_id, prior_events, seq, attempts)
+        if prior_events:
+            live.publish(encode_event(
+                {"type": "stage", "stage": "job", "status": "restarted", "attempt": attempts},
+                event="stage"
+            ))
+        self._live[job_id] = live
+        live.task = asyncio.ensure_future(self._generate(live, request, tenant))
+        flusher = asyncio.ensure_future(self._flush_loop(live))
+        try:
+            # 用 wait 而不是直接 await：取消任务（live.task.cancel）不应中断执行协程本身
+            await asyncio.wait({live.task})
+        finally:
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+            if not live.task.done():
+                # 进程退出
+                live.interrupt(CANCEL_REASON_SHUTDOWN)
+                await asyncio.wait({live.task})
+            if live.task.cancelled():
+                live.status = STATUS_QUEUED if self._stopping else STATUS_CANCELLED
+            try:
+                await run_in_threadpool(self._save_final, live)
+            finally:
+                self._live.pop(job_id, None)
+                live.finish()
+
+        if live.status == STATUS_COMPLETED:
+            self._stats["completed"] += 1
+        elif live.status == STATUS_FAILED:
+            self._stats["failed"] += 1
+        elif live.status == STATUS_QUEUED:
+            self._stats["requeued"] += 1
+        logger.info(f"异步任务结束: id={job_id}, 状态={live.status}")
+
+    async def _generate(self, live: LiveJob, request: Dict[str, Any], tenant: Any):
+        """执行生成；上游暂时不可用时等待后重试，直到执行次数达到 CHAT_JOB_MAX_ATTEMPTS"""
+        current_job.set(live)
+        while True:
+            retry = await self._generate_once(live, request, tenant)
+            if retry is None:
+                return
+            if live.attempts >= CHAT_JOB_MAX_ATTEMPTS:
+                live.publish(encode_event(retry, event="error"))
+                live.status = STATUS_FAILED
+                live.error = f"上游持续不可用，已执行 {live.attempts} 次: {retry.get('message')}"
+                return
+
+            delay = max(float(retry.get("retry_after") or 0), CHAT_JOB_RETRY_DELAY)
+            await run_in_threadpool(self._record_retry, live)
+            live.attempts += 1
+            self._stats["retried"] += 1
+            logger.warning(
+                f"异步任务上游暂时不可用，{delay:g} 秒后第 {live.attempts} 次执行: id={live.id}, {retry.get('message')}"
+            )
+            live.publish(encode_event({
+                "type": "stage", "stage": "job", "status": "waiting", "code": retry.get("code"),
+                "retry_after": delay, "attempt": live.attempts, "message": retry.get("message"),
+            }, event="stage"))
+            await asyncio.sleep(delay)
+
+    async def _generate_once(self, live: LiveJob, request: Dict[str, Any], tenant: Any) -> Optional[Dict[str, Any]]:
+        """
+        执行一次生成，按 done / error 事件确定任务结果
+
+        Returns:
+            尚未输出内容时上游暂时不可用（429/503）的 error 事件数据（不发送给订阅者），由调用方等待后重试；
+            其余情况返回 None
+        """
+        parts = []
+        full_content = None
+        error = None
+        try:
+            events = self._factory(request, tenant)
+            try:
+                async for event in events:
+                    data = _parse_event(event)
+                    if data is None:
+                        live.publish(event)
+                        continue
+                    event_type = data.get("type")
+                    if event_type == "error" and data.get("code") in RETRYABLE_ERROR_CODES and not parts:
+                        return data
+                    live.publish(event)
+                    if event_type == "content":
+                        parts.append(data.get("content", ""))
+                    elif event_type == "done":
+                        full_content = data.get("full_content")
+                    elif event_type == "error":
+                        error = data.get("message") or "生成失败"
+            finally:
+                aclose = getattr(events, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"异步任务生成失败: id={live.id}, {str(e)}", exc_info=True)
+            error = str(e)
+            live.publish(encode_event({"type": "error", "message": error}, event="error"))
+
+        if error is not None:
+            live.status = STATUS_FAILED
+            live.error = error
+        else:
+            live.status = STATUS_COMPLETED
+            live.result = full_content if full_content is not None else "".join(parts)
+        return None
+
+    async def _flush_loop(self, live: LiveJob):
+        """定时写入新事件并续约；发现任务已被取消（或被其他进程接手）时停止生成"""
+        while True:
+            await asyncio.sleep(CHAT_JOB_FLUSH_INTERVAL)
+            try:
+                owned = await run_in_threadpool(self._save_progress, live)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"写入异步任务进度失败: id={live.id}, {str(e)}")
+                continue
+            if not owned:
+                logger.info(f"异步任务已在其他地方取消或接手，停止执行: id={live.id}")
+                live.interrupt(CANCEL_REASON_TAKEN_OVER)
+                return
+
+    async def _poll(self):
+        while True:
+            try:
+                await self._poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"异步任务轮询出错: {str(e)}", exc_info=True)
+            await asyncio.sleep(CHAT_JOB_POLL_INTERVAL)
+
+    async def _poll_once(self):
+        """回收过期租约、领取未执行的任务、清理过期任务"""
+        recovered, expired = await run_in_threadpool(self._recover_expired)
+        self._stats["recovered"] += recovered
+        self._stats["expired"] += expired
+
+        capacity = CHAT_JOB_WORKERS - len(self._live) - self._queue.qsize()
+        if capacity > 0:
+            for job_id in await run_in_threadpool(self._list_queued, capacity):
+                self._enqueue(job_id)
+
+        now = asyncio.get_running_loop().time()
+        if self._last_cleanup is None or now - self._last_cleanup >= CHAT_JOB_CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            cleaned = await run_in_threadpool(self._cleanup)
+            if cleaned:
+                self._stats["cleaned"] += cleaned
+                logger.info(f"已清理 {cleaned} 个过期的异步任务")
+
+    # ==================== 数据库操作（在线程池中执行） ====================
+
+    def _insert(self, job_id: str, request: Dict[str, Any], tenant: Any) -> Dict[str, Any]:
+        db = SessionLocal()
+        try:
+            job = ChatJob(id=job_id, tenant=tenant, request=request, status=STATUS_QUEUED, created_at=datetime.now())
+            db.add(job)
+            db.commit()
+            return self._to_dict(job)
+        finally:
+            db.close()
+
+    def _load(self, job_id: str, after_seq: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """读取任务，after_seq 不为空时附带该段之后的事件（"events"）和最后一段的序号（"event_seq"）"""
+        db = SessionLocal()
+        try:
+            job = db.query(ChatJob).filter(ChatJob.id == job_id).first()
+            if job is None:
+                return None
+            data = self._to_dict(job)
+            if after_seq is not None:
+                data["events"], data["event_seq"] = self._read_events(db, job_id, after_seq)
+            return data
+        finally:
+            db.close()
+
+    @staticmethod
+    def _read_events(db, job_id: str, after_seq: int = 0) -> Tuple[str, int]:
+        rows = db.query(ChatJobEvent.seq, ChatJobEvent.data).filter(
+            ChatJobEvent.job_id == job_id,
+            ChatJobEvent.seq > after_seq
+        ).order_by(ChatJobEvent.seq).all()
+        return "".join(row.data for row in rows), rows[-1].seq if rows else after_seq
+
+    def _claim(self, job_id: str) -> Optional[Tuple[Dict[str, Any], Any, str, int, int]]:
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            updated = db.query(ChatJob).filter(
+                ChatJob.id == job_id,
+                ChatJob.status == STATUS_QUEUED
+            ).update({
+                ChatJob.status: STATUS_RUNNING,
+                ChatJob.worker: self.worker_id,
+                ChatJob.started_at: now,
+                ChatJob.heartbeat_at: now,
+                ChatJob.attempts: ChatJob.attempts + 1,
+            }, synchronize_session=False)
+            db.commit()
+            if not updated:
+                return None
+            job = db.query(ChatJob).filter(ChatJob.id == job_id).first()
+            events, seq = self._read_events(db, job_id)
+            return job.request, job.tenant, events, seq, job.attempts
+        finally:
+            db.close()
+
+    def _owned(self, db, job_id: str):
+        return db.query(ChatJob).filter(
+            ChatJob.id == job_id,
+            ChatJob.worker == self.worker_id,
+            ChatJob.status == STATUS_RUNNING
+        )
+
+    @staticmethod
+    def _append_events(db, live: LiveJob, count: int) -> bool:
+        """把 live.persisted 到 count 之间的新事件作为一段追加写入（调用方提交后更新 live）"""
+        if count <= live.persisted:
+            return False
+        db.add(ChatJobEvent(job_id=live.id, seq=live.seq + 1, data="".join(live.events[live.persisted:count])))
+        return True
+
+    @staticmethod
+    def _mark_persisted(live: LiveJob, count: int, appended: bool):
+        if appended:
+            live.seq += 1
+        live.persisted = count
+
+    def _save_progress(self, live: LiveJob) -> bool:
+        """追加新事件并续约，任务不再由本进程执行时返回 False"""
+        with live.save_lock:
+            count = len(live.events)
+            appended = False
+            db = SessionLocal()
+            try:
+                updated = self._owned(db, live.id).update(
+                    {ChatJob.heartbeat_at: datetime.now()}, synchronize_session=False
+                )
+                if updated:
+                    appended = self._append_events(db, live, count)
+                db.commit()
+            finally:
+                db.close()
+            if updated:
+                self._mark_persisted(live, count, appended)
+            return bool(updated)
+
+    def _record_retry(self, live: LiveJob):
+        """等待重试前把执行次数加一并续约（任务已不由本进程执行时由 _flush_loop 停止生成）"""
+        db = SessionLocal()
+        try:
+            self._owned(db, live.id).update({
+                ChatJob.attempts: ChatJob.attempts + 1,
+                ChatJob.heartbeat_at: datetime.now(),
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _save_final(self, live: LiveJob):
+        with live.save_lock:
+            count = len(live.events)
+            appended = False
+            db = SessionLocal()
+            try:
+                if live.status == STATUS_CANCELLED:
+                    # 取消接口已修改状态，这里只补齐事件流
+                    owned = db.query(ChatJob.id).filter(
+                        ChatJob.id == live.id,
+                        ChatJob.worker == self.worker_id,
+                        ChatJob.status == STATUS_CANCELLED
+                    ).first() is not None
+                else:
+                    if live.status == STATUS_QUEUED:
+                        values = {ChatJob.status: STATUS_QUEUED, ChatJob.worker: None, ChatJob.heartbeat_at: None}
+                    else:
+                        values = {
+                            ChatJob.status: live.status,
+                            ChatJob.result: live.result,
+                            ChatJob.error: live.error,
+                            ChatJob.finished_at: datetime.now(),
+                        }
+                    owned = bool(self._owned(db, live.id).update(values, synchronize_session=False))
+                if owned:
+                    appended = self._append_events(db, live, count)
+                db.commit()
+            finally:
+                db.close()
+            if owned:
+                self._mark_persisted(live, count, appended)
+
+    def _mark_cancelled(self, job_id: str) -> bool:
+        db = SessionLocal()
+        try:
+            updated = db.query(ChatJob).filter(
+                ChatJob.id == job_id,
+                ChatJob.status.in_([STATUS_QUEUED, STATUS_RUNNING])
+            ).update({
+                ChatJob.status: STATUS_CANCELLED,
+                ChatJob.finished_at: datetime.now(),
+            }, synchronize_session=False)
+            db.commit()
+            return bool(updated)
+        finally:
+            db.close()
+
+    def _recover_expired(self) -> Tuple[int, int]:
+        """租约过期的任务重新排队，执行次数达到上限的标记为失败"""
+        deadline = datetime.now() - timedelta(seconds=CHAT_JOB_LEASE_SECONDS)
+        db = SessionLocal()
+        try:
+            stale = db.query(ChatJob).filter(
+                ChatJob.status == STATUS_RUNNING,
+                ChatJob.heartbeat_at < deadline
+            )
+            expired = stale.filter(ChatJob.attempts >= CHAT_JOB_MAX_ATTEMPTS).update({
+                ChatJob.status: STATUS_FAILED,
+                ChatJob.error: f"任务执行中断 {CHAT_JOB_MAX_ATTEMPTS} 次，不再重试",
+                ChatJob.finished_at: datetime.now(),
+            }, synchronize_session=False)
+            recovered = stale.filter(ChatJob.attempts < CHAT_JOB_MAX_ATTEMPTS).update({
+                ChatJob.status: STATUS_QUEUED,
+                ChatJob.worker: None,
+                ChatJob.heartbeat_at: None,
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        if recovered or expired:
+            logger.warning(f"回收租约过期的异步任务: 重新排队 {recovered} 个, 标记失败 {expired} 个")
+        return recovered, expired
+
+    def _list_queued(self, limit: int) -> List[str]:
+        db = SessionLocal()
+        try:
+            rows = db.query(ChatJob.id).filter(
+                ChatJob.status == STATUS_QUEUED
+            ).order_by(ChatJob.created_at).limit(limit).all()
+            return [row.id for row in rows]
+        finally:
+            db.close()
+
+    def _cleanup(self) -> int:
+        deadline = datetime.now() - timedelta(seconds=CHAT_JOB_RETENTION)
+        db = SessionLocal()
+        try:
+            finished = db.query(ChatJob.id).filter(
+                ChatJob.status.in_(FINISHED_STATUSES),
+                ChatJob.finished_at < deadline
+            )
+            db.query(ChatJobEvent).filter(
+                ChatJobEvent.job_id.in_(finished.scalar_subquery())
+            ).delete(synchronize_session=False)
+            deleted = db.query(ChatJob).filter(
+                ChatJob.status.in_(FINISHED_STATUSES),
+                ChatJob.finished_at < deadline
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    @staticmethod
+    def _to_dict(job: ChatJob) -> Dict[str, Any]:
+        return {
+            "id": job.id,
+            "tenant": job.tenant,
+            "status": job.status,
+            "result": job.result,
+            "error": job.error,
+            "attempts": job.attempts or 0,
+            "created_at": _format_time(job.created_at),
+            "started_at": _format_time(job.started_at),
+            "finished_at": _format_time(job.finished_at),
+        }
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats.update({
+            "worker": self.worker_id,
+            "workers": CHAT_JOB_WORKERS,
+            "running": len(self._live),
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "started": self._poller is not None and not self._poller.done(),
+        })
+        return stats
+
+
+chat_jobs = ChatJobManager()
@@ -0,0 +1,409 @@
+"""
+聊天日志异步批量回传
+聊天流结束时只把日志放入内存队列，由后台任务批量发送到 Backend，
+不再在 SSE 生成器内同步等待 HTTP 请求。
+
+- 内存队列有界，队列满时交给落盘任务在线程池中写入本地文件（spool），不在事件循环上同步写文件
+- 每批日志通过 Backend 的 /api/chat-logs/batch 接口一次写入
+- 可重试的失败（连接错误、超时、408/429/502/503/504）追加到 spool 文件，Backend 恢复后自动补发（store-and-forward）
+- 其他失败（如 400/413/422/500）重试也不会成功：批次对半拆分后重新发送，定位到的单条日志写入死信文件
+  （chat_log_deadletter-<pid>.jsonl），不再阻塞后面的日志
+- 每条日志记录已失败的发送次数，超过 CHAT_LOG_SPOOL_MAX_ATTEMPTS 次后同样写入死信文件
+- spool 文件超过上限时丢弃新日志并计数
+- 队列深度、丢弃数、发送耗时等统计通过 get_stats() 暴露
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import CHAT_LOG_BATCH_URL
+from app.database.database import data_dir
+from app.utils.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+CHAT_LOG_QUEUE_SIZE = int(os.getenv("CHAT_LOG_QUEUE_SIZE", 10000))
+CHAT_LOG_BATCH_SIZE = int(os.getenv("CHAT_LOG_BATCH_SIZE", 100))
+CHAT_LOG_FLUSH_INTERVAL = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", 1.0))
+CHAT_LOG_SEND_TIMEOUT = float(os.getenv("CHAT_LOG_SEND_TIMEOUT", 10.0))
+CHAT_LOG_REPLAY_INTERVAL = float(os.getenv("CHAT_LOG_REPLAY_INTERVAL", 30.0))
+CHAT_LOG_SPOOL_MAX_BYTES = int(os.getenv("CHAT_LOG_SPOOL_MAX_BYTES", 100 * 1024 * 1024))
+CHAT_LOG_SPOOL_MAX_ATTEMPTS = int(os.getenv("CHAT_LOG_SPOOL_MAX_ATTEMPTS", 50))
+
+SPOOL_PREFIX = "chat_log_spool"
+DEAD_LETTER_PREFIX = "chat_log_deadletter"
+
+# 记录在 spool 行中的已失败发送次数（发送前移除）
+ATTEMPTS_KEY = "_attempts"
+
+# Backend 暂时不可用时的状态码，其余非 2xx 视为重试也不会成功
+RETRYABLE_STATUS_CODES = {408, 429, 502, 503, 504}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ChatLogShipper:
+    """聊天日志后台发送器（每个 worker 进程一个实例）"""
+
+    def __init__(self):
+        self._spool_lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # 队列满时等待落盘的日志，由单个落盘任务批量写入 spool 文件
+        self._overflow: List[Dict[str, Any]] = []
+        self._overflow_task: Optional[asyncio.Task] = None
+        self._last_replay = 0.0
+        self._stats = {
+            "submitted": 0,
+            "delivered": 0,
+            "spooled": 0,
+            "replayed": 0,
+            "dropped": 0,
+            "rejected": 0,
+            "dead_lettered": 0,
+            "failed_batches": 0,
+            "batches": 0,
+            "last_flush_latency_ms": 0.0,
+            "max_flush_latency_ms": 0.0,
+            "total_flush_latency_ms": 0.0,
+        }
+
+    @property
+    def spool_path(self):
+        """本进程的 spool 文件路径"""
+        return data_dir / f"{SPOOL_PREFIX}-{os.getpid()}.jsonl"
+
+    @property
+    def dead_letter_path(self):
+        """本进程的死信文件路径"""
+        return data_dir / f"{DEAD_LETTER_PREFIX}-{os.getpid()}.jsonl"
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        """启动后台发送任务（需在事件循环中调用）"""
+        if self._task is not None and not self._task.done():
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=CHAT_LOG_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"聊天日志发送器已启动: queue_size={CHAT_LOG_QUEUE_SIZE}, batch_size={CHAT_LOG_BATCH_SIZE}")
+
+    async def stop(self):
+        """停止后台任务，发送队列中剩余的日志，失败的部分落盘"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        remaining = self._drain(self._queue.qsize() if self._queue else 0)
+        if remaining:
+            await self._flush(remaining)
+        if self._overflow_task is not None:
+            await self._overflow_task
+            self._overflow_task = None
+        logger.info("聊天日志发送器已停止")
+
+    # ==================== 提交 ====================
+
+    def submit(self, record: Dict[str, Any]):
+        """提交一条日志（不阻塞），队列满时交给落盘任务写入 spool 文件"""
+        self._stats["submitted"] += 1
+        try:
+            asyncio.get_running_loop()
+            self.start()
+        except RuntimeError:
+            # 不在事件循环中（例如脚本调用），直接落盘等待补发
+            self._spool([record])
+            return
+
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self._spool_overflow(record)
+
+    def _spool_overflow(self, record: Dict[str, Any]):
+        """队列满时把日志交给落盘任务，超过缓冲上限时丢弃"""
+        if len(self._overflow) >= CHAT_LOG_QUEUE_SIZE:
+            self._stats["dropped"] += 1
+            logger.error("聊天日志队列与落盘缓冲均已满，丢弃 1 条聊天日志")
+            return
+        if not self._overflow:
+            logger.warning("聊天日志队列已满，写入本地 spool 文件")
+        self._overflow.append(record)
+        if self._overflow_task is None or self._overflow_task.done():
+            self._overflow_task = asyncio.create_task(self._write_overflow())
+
+    async def _write_overflow(self):
+        """在线程池中把缓冲的日志写入 spool 文件，直到缓冲为空"""
+        while self._overflow:
+            records, self._overflow = self._overflow, []
+            await run_in_threadpool(self._spool, records)
+
+    # ==================== 后台任务 ====================
+
+    async def _run(self):
+        await run_in_threadpool(self._recover_orphan_replays)
+        while True:
+            try:
+                first = await asyncio.wait_for(self._queue.get(), timeout=CHAT_LOG_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                first = None
+
+            try:
+                batch = [first] if first is not None else []
+                batch.extend(self._drain(CHAT_LOG_BATCH_SIZE - len(batch)))
+                if batch:
+                    await self._flush(batch)
+
+                if time.monotonic() - self._last_replay >= CHAT_LOG_REPLAY_INTERVAL:
+                    self._last_replay = time.monotonic()
+                    await self._replay_spool()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"聊天日志发送任务出错: {str(e)}", exc_info=True)
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        items = []
+        while self._queue is not None and len(items) < limit:
+            try:
+                items.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return items
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> bool:
+        """发送一批日志，可重试的部分写入 spool 文件"""
+        start = time.perf_counter()
+        retry = await self._deliver(batch)
+        latency = (time.perf_counter() - start) * 1000
+
+        self._stats["batches"] += 1
+        self._stats["last_flush_latency_ms"] = round(latency, 2)
+        self._stats["max_flush_latency_ms"] = round(max(self._stats["max_flush_latency_ms"], latency), 2)
+        self._stats["total_flush_latency_ms"] += latency
+
+        if retry:
+            self._stats["failed_batches"] += 1
+            await run_in_threadpool(self._spool_failed, retry)
+            return False
+        return True
+
+    async def _deliver(self, batch: List[Dict[str, Any]], counter: str = "delivered") -> List[Dict[str, Any]]:
+        """
+        通过共享连接池把一批日志一次性发送到 Backend 批量写入接口
+
+        不可重试的失败时把批次对半拆分后分别重新发送，单条仍失败时写入死信文件
+
+        Args:
+            counter: 成功送达的条数计入的统计项（delivered / replayed）
+
+        Returns:
+            因可重试的失败未送达、需要稍后补发的日志
+        """
+        client = get_http_client()
+        try:
+            response = await client.post(
+                CHAT_LOG_BATCH_URL,
+                json={"items": [{k: v for k, v in r.items() if k != ATTEMPTS_KEY} for r in batch]},
+                timeout=CHAT_LOG_SEND_TIMEOUT
+            )
+            response.raise_for_status()
+            result = response.json()
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in RETRYABLE_STATUS_CODES:
+                logger.error(f"发送聊天日志失败（稍后补发）: {str(e)}")
+                return batch
+            error = f"HTTP {e.response.status_code}: {e.response.text[:500]}"
+            if len(batch) == 1:
+                await run_in_threadpool(self._dead_letter, batch, error)
+                return []
+            logger.warning(f"发送聊天日志失败（{error}），拆分 {len(batch)} 条日志后重新发送")
+            half = len(batch) // 2
+            return await self._deliver(batch[:half], counter) + await self._deliver(batch[half:], counter)
+        except Exception as e:
+            logger.error(f"发送聊天日志失败（稍后补发）: {str(e)}")
+            return batch
+
+        self._stats[counter] += len(batch)
+        # 校验不通过的记录重试也不会成功，计数后丢弃
+        rejected = result.get("rejected", 0)
+        if rejected:
+            self._stats["rejected"] += rejected
+            logger.warning(f"Backend 拒绝了 {rejected} 条聊天日志: {result.get('errors')}")
+        return []
+
+    # ==================== 本地落盘与补发 ====================
+
+    def _spool(self, records: List[Dict[str, Any]]):
+        """追加写入本进程的 spool 文件，超过上限时丢弃"""
+        if not records:
+            return
+        try:
+            size = self.spool_path.stat().st_size if self.spool_path.exists() else 0
+            lines = [json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records]
+            if size + sum(len(line.encode()) for line in lines) > CHAT_LOG_SPOOL_MAX_BYTES:
+                self._stats["dropped"] += len(records)
+                logger.error(f"spool 文件已超过上限，丢弃 {len(records)} 条聊天日志")
+                return
+            with self._spool_lock:
+                with open(self.spool_path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+            self._stats["spooled"] += len(records)
+        except Exception as e:
+            self._stats["dropped"] += len(records)
+            logger.error(f"写入 spool 文件失败，丢弃 {len(records)} 条聊天日志: {str(e)}")
+
+    def _spool_failed(self, records: List[Dict[str, Any]]):
+        """记录一次失败的发送后写回 spool 文件，失败次数超过上限的写入死信文件"""
+        retry, exhausted = [], []
+        for record in records:
+            record = {**record, ATTEMPTS_KEY: record.get(ATTEMPTS_KEY, 0) + 1}
+            (exhausted if record[ATTEMPTS_KEY] >= CHAT_LOG_SPOOL_MAX_ATTEMPTS else retry).append(record)
+        if exhausted:
+            self._dead_letter(exhausted, f"发送失败 {CHAT_LOG_SPOOL_MAX_ATTEMPTS} 次")
+        if retry:
+            self._spool(retry)
+
+    def _dead_letter(self, records: List[Dict[str, Any]], reason: str):
+        """写入本进程的死信文件（不再补发，需要人工处理），超过上限时丢弃"""
+        self._stats["dead_lettered"] += len(records)
+        logger.error(f"{len(records)} 条聊天日志无法写入 Backend，转入死信文件: {reason}")
+        failed_at = datetime.now().isoformat()
+        try:
+            size = self.dead_letter_path.stat().st_size if self.dead_letter_path.exists() else 0
+            lines = [
+                json.dumps({"failed_at": failed_at, "reason": reason, "record": r}, ensure_ascii=False, default=str) + "\n"
+                for r in records
+            ]
+            if size + sum(len(line.encode()) for line in lines) > CHAT_LOG_SPOOL_MAX_BYTES:
+                self._stats["dropped"] += len(records)
+                logger.error(f"死信文件已超过上限，丢弃 {len(records)} 条聊天日志")
+                return
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+        except Exception as e:
+            self._stats["dropped"] += len(records)
+            logger.error(f"写入死信文件失败，丢弃 {len(records)} 条聊天日志: {str(e)}")
+
+    def _recover_orphan_replays(self):
+        """把已退出进程遗留的补发中文件改名为可认领的 spool 文件"""
+        for path in glob.glob(str(data_dir / f"{SPOOL_PREFIX}-*.replay-*")):
+            if path.endswith(".jsonl"):
+                continue
+            try:
+                pid = int(path.rsplit("-", 1)[1])
+            except ValueError:
+                continue
+            if not _pid_alive(pid):
+                try:
+                    os.rename(path, f"{path}.jsonl")
+                except OSError:
+                    pass
+
+    def _claim_spool_files(self) -> List[str]:
+        """
+        通过原子 rename 认领待补发的 spool 文件：本进程的文件、已退出进程的文件，
+        以及孤儿补发文件。仍在运行的其他 worker 的文件由其自行补发。
+        """
+        claimed = []
+        for path in glob.glob(str(data_dir / f"{SPOOL_PREFIX}-*.jsonl")):
+            name = os.path.basename(path)[len(SPOOL_PREFIX) + 1:-len(".jsonl")]
+            is_orphan = ".replay-" in name
+            if not is_orphan:
+                try:
+                    owner = int(name)
+                except ValueError:
+                    continue
+                if owner != os.getpid() and _pid_alive(owner):
+                    continue
+            target = f"{path[:-len('.jsonl')]}.replay-{os.getpid()}"
+            try:
+                with self._spool_lock:
+                    os.rename(path, target)
+                claimed.append(target)
+            except OSError:
+                continue
+        return claimed
+
+    async def _replay_spool(self):
+        """补发 spool 文件中的日志"""
+        claimed = await run_in_threadpool(self._claim_spool_files)
+        for path in claimed:
+            records = await run_in_threadpool(self._read_spool_file, path)
+            for i in range(0, len(records), CHAT_LOG_BATCH_SIZE):
+                batch = records[i:i + CHAT_LOG_BATCH_SIZE]
+                retry = await self._deliver(batch, counter="replayed")
+                if retry:
+                    # Backend 仍不可用：本批计一次失败，后面未发送的部分原样写回本进程的 spool 文件
+                    await run_in_threadpool(self._spool_failed, retry)
+                    await run_in_threadpool(self._spool, records[i + len(batch):])
+                    break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _read_spool_file(self, path: str) -> List[Dict[str, Any]]:
+        records = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning("spool 文件中存在无法解析的行，已跳过")
+        return records
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回发送器统计信息"""
+        stats = dict(self._stats)
+        total_latency = stats.pop("total_flush_latency_ms")
+        stats["avg_flush_latency_ms"] = round(total_latency / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["queue_depth"] = self._queue.qsize() if self._queue else 0
+        stats["queue_capacity"] = CHAT_LOG_QUEUE_SIZE
+        spool_bytes = 0
+        for path in glob.glob(str(data_dir / f"{SPOOL_PREFIX}-*")):
+            try:
+                spool_bytes += os.path.getsize(path)
+            except OSError:
+                pass
+        stats["spool_bytes"] = spool_bytes
+        dead_letter_bytes = 0
+        for path in glob.glob(str(data_dir / f"{DEAD_LETTER_PREFIX}-*.jsonl")):
+            try:
+                dead_letter_bytes += os.path.getsize(path)
+            except OSError:
+                pass
+        stats["dead_letter_bytes"] = dead_letter_bytes
+        stats["running"] = self._task is not None and not self._task.done()
+        return stats
+
+
+chat_log_shipper = ChatLogShipper()
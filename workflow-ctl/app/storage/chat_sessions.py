@@ -0,0 +1,245 @@
+"""
+服务端多轮会话
+客户端先创建会话拿到 id，之后每一轮只发送新的消息（ChatRequest.session_id），
+之前的对话由服务端保存并在调用上游时作为历史消息带上。
+
+- 每轮在生成完成（done 事件）时追加一行到 chat_session_turns：只保存用户消息原文和最终回复，
+  不含提示词模板和中间阶段的输出，并记下估算的 token 数；失败或中断的轮次不保存
+- 调用上游前按 token 预算从最近一轮往前选取历史（trim_history），超出预算的更早轮次不再发送，
+  预算和最多轮数可在 Workflow.config.session 中配置
+- 超过 CHAT_SESSION_IDLE_TTL 秒没有新一轮的会话视为过期：读取时按不存在处理，
+  并由每隔 CHAT_SESSION_CLEANUP_INTERVAL 秒的清理删除
+- 会话保存在数据库中，多个 worker 进程之间共享
+"""
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.database.database import SessionLocal
+from app.models.chat_session import ChatSession, ChatSessionTurn
+from app.utils.token_usage import ESTIMATE_MESSAGE_OVERHEAD, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CHAT_SESSION_IDLE_TTL = float(os.getenv("CHAT_SESSION_IDLE_TTL", 86400.0))
+CHAT_SESSION_CLEANUP_INTERVAL = float(os.getenv("CHAT_SESSION_CLEANUP_INTERVAL", 300.0))
+# 历史消息的默认 token 预算和轮数，以及每次最多读取的轮数（Workflow.config.session 不能超过该值）
+CHAT_SESSION_HISTORY_TOKENS = int(os.getenv("CHAT_SESSION_HISTORY_TOKENS", 4000))
+CHAT_SESSION_HISTORY_TURNS = int(os.getenv("CHAT_SESSION_HISTORY_TURNS", 20))
+CHAT_SESSION_MAX_HISTORY_TURNS = int(os.getenv("CHAT_SESSION_MAX_HISTORY_TURNS", 100))
+
+
+def _format_time(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def trim_history(
+    turns: List[Dict[str, Any]],
+    max_tokens: int = CHAT_SESSION_HISTORY_TOKENS,
+    max_turns: int = CHAT_SESSION_HISTORY_TURNS
+) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+    """
+    从最近一轮往前选取不超过 max_tokens / max_turns 的历史，按时间顺序展开为 user / assistant 消息
+
+    Args:
+        turns: 按时间顺序排列的轮次（user_message / reply / tokens）
+
+    Returns:
+        (历史消息, {"turns": 选取的轮数, "tokens": 估算 token 数, "trimmed": 被裁掉的轮数})
+    """
+    selected: List[Dict[str, Any]] = []
+    tokens = 0
+    for turn in reversed(turns):
+        if len(selected) >= max_turns or tokens + turn["tokens"] > max_tokens:
+            break
+        selected.append(turn)
+        tokens += turn["tokens"]
+    selected.reverse()
+
+    messages = []
+    for turn in selected:
+        messages.append({"role": "user", "content": turn["user_message"]})
+        messages.append({"role": "assistant", "content": turn["reply"]})
+    return messages, {"turns": len(selected), "tokens": tokens, "trimmed": len(turns) - len(selected)}
+
+
+class ChatSessionStore:
+    """会话的创建、读取、追加和淘汰"""
+
+    def __init__(self):
+        self._last_cleanup: Optional[float] = None
+        self._stats = {
+            "created": 0,
+            "deleted": 0,
+            "turns": 0,
+            "expired": 0,
+        }
+
+    async def create(self, tenant: Any = None, workflow_id: Optional[str] = None) -> Dict[str, Any]:
+        """创建会话，返回会话信息"""
+        await self._maybe_cleanup()
+        session = await run_in_threadpool(self._insert, uuid.uuid4().hex, tenant, workflow_id)
+        self._stats["created"] += 1
+        logger.info(f"会话已创建: id={session['id']}")
+        return session
+
+    async def get(self, session_id: str, tenant: Any = None, limit: int = CHAT_SESSION_MAX_HISTORY_TURNS) -> Optional[Dict[str, Any]]:
+        """
+        读取会话和最近 limit 轮（按时间顺序，放在 "history" 中）
+
+        会话不存在、不属于该租户或已过期时返回 None
+        """
+        return await run_in_threadpool(self._load, session_id, tenant, limit)
+
+    async def append(self, session_id: str, user_message: str, reply: str) -> bool:
+        """追加已完成的一轮，会话已被删除时返回 False"""
+        tokens = estimate_tokens(user_message) + estimate_tokens(reply) + 2 * ESTIMATE_MESSAGE_OVERHEAD
+        appended = await run_in_threadpool(self._insert_turn, session_id, user_message, reply, tokens)
+        if appended:
+            self._stats["turns"] += 1
+        await self._maybe_cleanup()
+        return appended
+
+    async def delete(self, session_id: str, tenant: Any = None) -> bool:
+        """删除会话及其全部轮次，不存在或不属于该租户时返回 False"""
+        deleted = await run_in_threadpool(self._delete, session_id, tenant)
+        if deleted:
+            self._stats["deleted"] += 1
+            logger.info(f"会话已删除: id={session_id}")
+        return deleted
+
+    async def _maybe_cleanup(self):
+        now = time.monotonic()
+        if self._last_cleanup is not None and now - self._last_cleanup < CHAT_SESSION_CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        try:
+            expired = await run_in_threadpool(self._cleanup)
+        except Exception as e:
+            logger.error(f"清理过期会话失败: {str(e)}")
+            return
+        if expired:
+            self._stats["expired"] += expired
+            logger.info(f"已清理 {expired} 个空闲超过 {CHAT_SESSION_IDLE_TTL:g} 秒的会话")
+
+    # ==================== 数据库操作（在线程池中执行） ====================
+
+    def _insert(self, session_id: str, tenant: Any, workflow_id: Optional[str]) -> Dict[str, Any]:
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            session = ChatSession(
+                id=session_id, tenant=tenant, workflow_id=workflow_id, turns=0,
+                created_at=now, last_active_at=now
+            )
+            db.add(session)
+            db.commit()
+            return self._to_dict(session)
+        finally:
+            db.close()
+
+    def _load(self, session_id: str, tenant: Any, limit: int) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+            if session is None or session.tenant != tenant:
+                return None
+            if session.last_active_at < datetime.now() - timedelta(seconds=CHAT_SESSION_IDLE_TTL):
+                return None
+            rows = db.query(ChatSessionTurn).filter(
+                ChatSessionTurn.session_id == session_id
+            ).order_by(ChatSessionTurn.id.desc()).limit(limit).all()
+            data = self._to_dict(session)
+            data["history"] = [
+                {
+                    "user_message": row.user_message,
+                    "reply": row.reply,
+                    "tokens": row.tokens,
+                    "created_at": _format_time(row.created_at),
+                }
+                for row in reversed(rows)
+            ]
+            return data
+        finally:
+            db.close()
+
+    def _insert_turn(self, session_id: str, user_message: str, reply: str, tokens: int) -> bool:
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            updated = db.query(ChatSession).filter(ChatSession.id == session_id).update({
+                ChatSession.turns: ChatSession.turns + 1,
+                ChatSession.last_active_at: now,
+            }, synchronize_session=False)
+            if not updated:
+                db.rollback()
+                return False
+            db.add(ChatSessionTurn(
+                session_id=session_id, user_message=user_message, reply=reply, tokens=tokens, created_at=now
+            ))
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    def _delete(self, session_id: str, tenant: Any) -> bool:
+        db = SessionLocal()
+        try:
+            deleted = db.query(ChatSession).filter(
+                ChatSession.id == session_id,
+                ChatSession.tenant == tenant
+            ).delete(synchronize_session=False)
+            if deleted:
+                db.query(ChatSessionTurn).filter(
+                    ChatSessionTurn.session_id == session_id
+                ).delete(synchronize_session=False)
+            db.commit()
+            return bool(deleted)
+        finally:
+            db.close()
+
+    def _cleanup(self) -> int:
+        deadline = datetime.now() - timedelta(seconds=CHAT_SESSION_IDLE_TTL)
+        db = SessionLocal()
+        try:
+            expired = db.query(ChatSession.id).filter(ChatSession.last_active_at < deadline)
+            db.query(ChatSessionTurn).filter(
+                ChatSessionTurn.session_id.in_(expired.scalar_subquery())
+            ).delete(synchronize_session=False)
+            deleted = db.query(ChatSession).filter(
+                ChatSession.last_active_at < deadline
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    @staticmethod
+    def _to_dict(session: ChatSession) -> Dict[str, Any]:
+        return {
+            "id": session.id,
+            "tenant": session.tenant,
+            "workflow_id": session.workflow_id,
+            "turns": session.turns or 0,
+            "created_at": _format_time(session.created_at),
+            "last_active_at": _format_time(session.last_active_at),
+        }
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats.update({
+            "idle_ttl": CHAT_SESSION_IDLE_TTL,
+            "history_tokens": CHAT_SESSION_HISTORY_TOKENS,
+            "history_turns": CHAT_SESSION_HISTORY_TURNS,
+        })
+        return stats
+
+
+chat_sessions = ChatSessionStore()
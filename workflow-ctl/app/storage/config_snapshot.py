@@ -0,0 +1,285 @@
+"""
+聊天热路径使用的配置快照
+将 workflows / prompts / llm_providers 一次性加载为不可变、预先建好索引的快照，
+聊天请求直接读取快照，不再访问数据库。
+各 provider 每个模型的生成参数（max_tokens / top_p / stop）结合 model_parameters 预先编译好，
+见 app.utils.generation_params。
+
+- backend 调用 /sync 或 /sync/{external_id} 后调用 reload_config_snapshot() 换入新快照
+- 多 worker 部署时，通过 data 目录下的版本戳文件通知其他 worker 重新加载
+- 请求路径上发现快照过期时在线程池中后台重新加载，加载完成前继续使用旧快照，不阻塞事件循环
+"""
+import asyncio
+import copy
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.database.database import SessionLocal
+from app.models.workflow import Workflow
+from app.models.prompt import Prompt
+from app.models.llm_provider import LLMProvider
+from app.models.model_parameter import ModelParameter
+from app.storage.change_stamp import ChangeStamp
+from app.utils.generation_params import collect_parameter_defaults, compile_generation_params
+
+logger = logging.getLogger(__name__)
+
+# 检查版本戳文件的最小间隔（秒）
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv("CONFIG_SNAPSHOT_CHECK_INTERVAL", 1.0))
+# 兜底：快照最长存活时间（秒），超过后强制重新加载
+SNAPSHOT_MAX_AGE = float(os.getenv("CONFIG_SNAPSHOT_MAX_AGE", 300.0))
+
+
+@dataclass(frozen=True)
+class WorkflowConfig:
+    """流程配置快照"""
+    id: int
+    external_id: Optional[int]
+    backend_id: Optional[str]
+    name: str
+    workflow_type: str
+    config: Dict[str, Any]
+    status: Optional[str]
+
+
+@dataclass(frozen=True)
+class PromptConfig:
+    """提示词配置快照"""
+    id: int
+    title: str
+    system_prompt: Optional[str]
+    user_prompt: Optional[str]
+    model_type: str
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    """LLM Provider 配置快照（api_key 保持加密形式）"""
+    id: int
+    external_id: Optional[int]
+    name: str
+    provider: str
+    api_key: Optional[str]
+    api_base: Optional[str]
+    custom_config: Dict[str, Any]
+    default_model_name: str
+    fast_default_model_name: Optional[str]
+    model_configurations: Tuple[Dict[str, Any], ...]
+    category: str
+    is_default_provider: bool
+    # 模型名 -> 编译好的生成参数（默认模型、快速模型和 model_configurations 中出现的模型）
+    generation_params: Mapping[str, Mapping[str, Any]] = field(default_factory=lambda: MappingProxyType({}))
+
+    def get_generation_params(self, model: str) -> Dict[str, Any]:
+        """获取某个模型的生成参数（合并进上游请求体）"""
+        return dict(self.generation_params.get(model, {}))
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """不可变配置快照"""
+    version: int
+    loaded_at: float
+    workflows: Mapping[str, WorkflowConfig]  # backend_id -> workflow
+    default_workflow: Optional[WorkflowConfig]  # id 最小的 workflow
+    prompts: Mapping[str, PromptConfig]  # model_type -> prompt
+    providers: Mapping[str, ProviderConfig]  # category -> 首选 provider（池中第一个）
+    provider_pools: Mapping[str, Tuple[ProviderConfig, ...]]  # category -> 同类全部 provider
+
+    def get_provider_pool(self, category: str) -> Tuple[ProviderConfig, ...]:
+        """获取某个 category 下的全部 provider（默认 provider 在前）"""
+        return self.provider_pools.get(category, ())
+
+    def get_workflow(self, backend_id: Optional[str]) -> Optional[WorkflowConfig]:
+        """按 backend_id 查找 workflow，找不到时返回默认 workflow"""
+        if backend_id:
+            workflow = self.workflows.get(backend_id)
+            if workflow:
+                return workflow
+            logger.warning(f"未找到 backend_id={backend_id} 的 workflow，使用默认第一条")
+        return self.default_workflow
+
+
+_snapshot: Optional[ConfigSnapshot] = None
+_version = 0
+_lock = threading.Lock()
+# 后台重新加载状态：进行中时新的过期通知只记下，完成后再加载一次
+_refresh_lock = threading.Lock()
+_refreshing = False
+_refresh_again = False
+# 版本戳文件：任一 worker 完成同步后更新，其他 worker 据此发现快照已过期
+_stamp = ChangeStamp(".config_snapshot_stamp", SNAPSHOT_CHECK_INTERVAL)
+
+
+def _build_snapshot(db: Session, version: int) -> ConfigSnapshot:
+    workflows = db.query(Workflow).order_by(Workflow.id).all()
+    prompts = db.query(Prompt).order_by(Prompt.id).all()
+    providers = db.query(LLMProvider).order_by(LLMProvider.id).all()
+    parameter_defaults = collect_parameter_defaults(db.query(ModelParameter).order_by(ModelParameter.id).all())
+
+    workflow_configs = [
+        WorkflowConfig(
+            id=w.id,
+            external_id=w.external_id,
+            backend_id=w.backend_id,
+            name=w.name,
+            workflow_type=w.workflow_type,
+            config=copy.deepcopy(w.config) if isinstance(w.config, dict) else {},
+            status=w.status
+        )
+        for w in workflows
+    ]
+    workflows_by_backend_id = {}
+    for w in workflow_configs:
+        # 与原先 .filter(backend_id == x).first() 语义一致：保留最早的一条
+        if w.backend_id and w.backend_id not in workflows_by_backend_id:
+            workflows_by_backend_id[w.backend_id] = w
+
+    # 与原先 {p.model_type: p for p in ...} 语义一致：同类型保留最后一条
+    prompts_by_type = {
+        p.model_type: PromptConfig(
+            id=p.id,
+            title=p.title,
+            system_prompt=p.system_prompt,
+            user_prompt=p.user_prompt,
+            model_type=p.model_type
+        )
+        for p in prompts
+    }
+    provider_configs = []
+    for p in providers:
+        model_configurations = tuple(copy.deepcopy(p.model_configurations or []))
+        models = [p.default_model_name, p.fast_default_model_name] + [
+            item.get("name") for item in model_configurations if isinstance(item, dict)
+        ]
+        generation_params = {
+            model: MappingProxyType(compile_generation_params(
+                model, model_configurations, parameter_defaults.get(p.category)
+            ))
+            for model in dict.fromkeys(m for m in models if m)
+        }
+        provider_configs.append(ProviderConfig(
+            id=p.id,
+            external_id=p.external_id,
+            name=p.name,
+            provider=p.provider,
+            api_key=p.api_key,
+            api_base=p.api_base,
+            custom_config=dict(p.custom_config) if isinstance(p.custom_config, dict) else {},
+            default_model_name=p.default_model_name,
+            fast_default_model_name=p.fast_default_model_name,
+            model_configurations=model_configurations,
+            category=p.category,
+            is_default_provider=bool(p.is_default_provider),
+            generation_params=MappingProxyType(generation_params)
+        ))
+    # 同一 category 的多条 provider 组成池：默认 provider 在前，其余按 id 倒序
+    # （没有默认 provider 时首选与原先 {p.category: p for p in ...} 一致，为最后一条）
+    pools: Dict[str, list] = {}
+    for p in sorted(provider_configs, key=lambda p: (not p.is_default_provider, -p.id)):
+        pools.setdefault(p.category, []).append(p)
+    provider_pools = {category: tuple(pool) for category, pool in pools.items()}
+    providers_by_category = {category: pool[0] for category, pool in provider_pools.items()}
+
+    return ConfigSnapshot(
+        version=version,
+        loaded_at=time.time(),
+        workflows=MappingProxyType(workflows_by_backend_id),
+        default_workflow=workflow_configs[0] if workflow_configs else None,
+        prompts=MappingProxyType(prompts_by_type),
+        providers=MappingProxyType(providers_by_category),
+        provider_pools=MappingProxyType(provider_pools)
+    )
+
+
+def reload_config_snapshot(db: Optional[Session] = None, notify: bool = False) -> ConfigSnapshot:
+    """
+    从数据库重新加载配置快照并原子替换
+
+    Args:
+        db: 数据库会话，为空时自动创建
+        notify: 是否更新版本戳文件，通知其他 worker 重新加载（同步接口写库后传 True）
+    """
+    global _snapshot, _version
+    if notify:
+        _stamp.touch()
+
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        with _lock:
+            snapshot = _build_snapshot(db, _version + 1)
+            _version = snapshot.version
+            _snapshot = snapshot
+    finally:
+        if own_session:
+            db.close()
+
+    logger.info(
+        f"配置快照已加载: version={snapshot.version}, workflows={len(snapshot.workflows)}, "
+        f"prompts={list(snapshot.prompts.keys())}, "
+        f"providers={ {c: len(pool) for c, pool in snapshot.provider_pools.items()} }"
+    )
+    return snapshot
+
+
+def get_config_snapshot() -> ConfigSnapshot:
+    """
+    获取当前配置快照
+
+    其他 worker 已同步或超过最长存活时间时在后台重新加载，本次仍返回当前快照；
+    只有尚未加载过（启动时已在 lifespan 中加载）才同步加载
+    """
+    snapshot = _snapshot
+    if snapshot is None:
+        return reload_config_snapshot()
+    if _stamp.poll() or time.time() - snapshot.loaded_at > SNAPSHOT_MAX_AGE:
+        _schedule_refresh()
+    return snapshot
+
+
+def _schedule_refresh():
+    """在线程池中重新加载快照，已有加载进行中时完成后再加载一次；不在事件循环中时直接加载"""
+    global _refreshing, _refresh_again
+    with _refresh_lock:
+        if _refreshing:
+            _refresh_again = True
+            return
+        _refreshing = True
+        _refresh_again = False
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _refresh()
+        return
+    loop.run_in_executor(None, _refresh)
+
+
+def _refresh():
+    global _refreshing, _refresh_again
+    while True:
+        try:
+            reload_config_snapshot()
+        except Exception as e:
+            logger.error(f"后台刷新配置快照失败，继续使用旧快照: {str(e)}")
+        with _refresh_lock:
+            if not _refresh_again:
+                _refreshing = False
+                return
+            _refresh_again = False
+
+
+def notify_config_changed(db: Optional[Session] = None):
+    """同步接口写库后调用：换入新快照并通知其他 worker，失败时不影响同步结果"""
+    try:
+        reload_config_snapshot(db, notify=True)
+    except Exception as e:
+        logger.error(f"刷新配置快照失败: {str(e)}")
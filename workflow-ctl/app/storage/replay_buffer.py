@@ -0,0 +1,222 @@
+"""
+可续传的 SSE 事件流
+每次生成分配一个 generation id，事件按发出顺序编号，输出时带上 "id: <generation>:<seq>" 行。
+客户端断线后携带 Last-Event-ID 重新连接，可以从断点继续接收同一次生成的事件，
+不会重新调用上游。
+
+- 生成在后台任务中执行，与客户端连接解耦；默认最后一个订阅者断开时立即取消生成（上游随之中止），
+  SSE_RESUME_GRACE（或 Workflow.config.sse.resume_grace）大于 0 时保留该秒数，期间无人重连才取消
+- 开始后 SSE_RESUME_ATTACH_TIMEOUT 秒内没有订阅者接上（响应未开始发送）时同样取消生成
+- 每次生成只保留最近 SSE_RESUME_BUFFER_EVENTS 个事件，断点早于缓冲区时无法续传
+- 生成结束后保留 SSE_RESUME_TTL 秒，供在最后几个事件前断线的客户端取回剩余事件
+- 登记表超过 SSE_RESUME_MAX_STREAMS 时优先淘汰最早结束的生成
+- 每次生成记录请求体指纹，续传请求的 workflow、消息等与原请求不一致时不续传
+- 状态保存在 worker 进程内存中，重连需要落到同一个进程（如 nginx ip_hash），否则重新生成
+- 仅在事件循环线程内使用
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SSE_RESUME_GRACE = float(os.getenv("SSE_RESUME_GRACE", 0.0))
+SSE_RESUME_ATTACH_TIMEOUT = float(os.getenv("SSE_RESUME_ATTACH_TIMEOUT", 10.0))
+SSE_RESUME_TTL = float(os.getenv("SSE_RESUME_TTL", 60.0))
+SSE_RESUME_BUFFER_EVENTS = int(os.getenv("SSE_RESUME_BUFFER_EVENTS", 2048))
+SSE_RESUME_MAX_STREAMS = int(os.getenv("SSE_RESUME_MAX_STREAMS", 1000))
+
+
+def parse_last_event_id(value: Optional[str]) -> Tuple[Optional[str], int]:
+    """
+    解析 Last-Event-ID（格式 "<generation>:<seq>"）
+
+    Returns:
+        (generation_id, seq)，格式不正确时返回 (None, 0)
+    """
+    if not value:
+        return None, 0
+    generation_id, _, seq = value.strip().rpartition(":")
+    try:
+        return (generation_id, int(seq)) if generation_id else (None, 0)
+    except ValueError:
+        return None, 0
+
+
+class ResumableStream:
+    """一次生成：为事件编号、保留最近的事件，并广播给所有订阅者"""
+
+    def __init__(self, source: AsyncIterator[str], tenant: Any = None, fingerprint: Optional[str] = None,
+                 buffer_size: int = SSE_RESUME_BUFFER_EVENTS, grace: Optional[float] = None):
+        self.id = uuid.uuid4().hex
+        self.tenant = tenant
+        self.fingerprint = fingerprint
+        self.grace = SSE_RESUME_GRACE if grace is None else max(grace, 0.0)
+        self.seq = 0
+        self.buffer: Deque[Tuple[int, str]] = deque(maxlen=buffer_size)
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.resumes = 0
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run(source))
+        self._schedule_idle_cancel(max(self.grace, SSE_RESUME_ATTACH_TIMEOUT))
+
+    async def _run(self, source: AsyncIterator[str]):
+        try:
+            async for event in source:
+                self.seq += 1
+                self.buffer.append((self.seq, f"id: {self.id}:{self.seq}\n{event}"))
+                self._notify()
+        except asyncio.CancelledError:
+            logger.info(f"可续传生成已取消（无订阅者）: generation={self.id}")
+            raise
+        except Exception as e:
+            logger.error(f"可续传生成失败: {str(e)}", exc_info=True)
+        finally:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._notify()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def first_seq(self) -> int:
+        return self.buffer[0][0] if self.buffer else self.seq + 1
+
+    def can_resume(self, after_seq: int) -> bool:
+        """断点之后的事件是否都还在缓冲区中"""
+        return 0 <= after_seq <= self.seq and after_seq + 1 >= self.first_seq()
+
+    def subscribe(self, after_seq: int = 0) -> AsyncIterator[str]:
+        """订阅 after_seq 之后的事件（调用方需先用 can_resume 检查），开始迭代后才计为订阅者"""
+        return self._iterate(after_seq)
+
+    async def _iterate(self, last_seq: int) -> AsyncIterator[str]:
+        self.subscribers += 1
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        try:
+            while True:
+                # 编号连续，按偏移定位缓冲区中的下一个事件
+                while last_seq < self.seq:
+                    index = last_seq + 1 - self.first_seq()
+                    if index < 0:
+                        logger.warning(f"订阅者落后超过续传缓冲区，断开连接: generation={self.id}")
+                        return
+                    seq, event = self.buffer[index]
+                    yield event
+                    last_seq = seq
+                if self.done:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self._task.done():
+                if self.grace > 0:
+                    self._schedule_idle_cancel(self.grace)
+                else:
+                    self._task.cancel()
+
+    def _schedule_idle_cancel(self, delay: float):
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+        self._idle_handle = asyncio.get_running_loop().call_later(delay, self._cancel_if_idle)
+
+    def _cancel_if_idle(self):
+        self._idle_handle = None
+        if self.subscribers == 0 and not self._task.done():
+            logger.info(f"续传等待超时，取消生成: generation={self.id}")
+            self._task.cancel()
+
+
+class ResumableStreamRegistry:
+    """按 generation id 登记可续传的生成"""
+
+    def __init__(self):
+        self._streams: "OrderedDict[str, ResumableStream]" = OrderedDict()
+        self.started = 0
+        self.resumed = 0
+        self.missed = 0
+
+    def start(self, source: AsyncIterator[str], tenant: Any = None, fingerprint: Optional[str] = None,
+              grace: Optional[float] = None) -> ResumableStream:
+        """
+        在后台开始一次生成并登记
+
+        Args:
+            fingerprint: 请求体指纹，续传时需要一致
+            grace: 断开后等待重连的秒数，None 时取 SSE_RESUME_GRACE
+        """
+        self._evict()
+        stream = ResumableStream(source, tenant=tenant, fingerprint=fingerprint, grace=grace)
+        self._streams[stream.id] = stream
+        self.started += 1
+        return stream
+
+    def resume(self, generation_id: str, after_seq: int, tenant: Any = None,
+               fingerprint: Optional[str] = None) -> Optional[ResumableStream]:
+        """
+        查找可以从 after_seq 之后续传的生成
+
+        生成不存在（已过期、在其他进程或被淘汰）、不属于同一租户、请求体指纹不一致
+        或断点早于缓冲区时返回 None
+        """
+        self._evict()
+        stream = self._streams.get(generation_id)
+        if stream is None or stream.tenant != tenant or not stream.can_resume(after_seq):
+            self.missed += 1
+            return None
+        if stream.fingerprint != fingerprint:
+            logger.warning(f"续传请求与原请求不一致，不续传: generation={generation_id}")
+            self.missed += 1
+            return None
+        if stream._task.cancelled():
+            self.missed += 1
+            return None
+        self.resumed += 1
+        stream.resumes += 1
+        logger.info(
+            f"续传生成: generation={generation_id}, 断点={after_seq}, 最新={stream.seq}, "
+            f"{'已结束' if stream.done else '进行中'}"
+        )
+        return stream
+
+    def _evict(self):
+        """移除结束超过 SSE_RESUME_TTL 的生成，超过上限时淘汰最早结束的生成"""
+        now = time.monotonic()
+        for generation_id, stream in list(self._streams.items()):
+            if stream.done and now - stream.finished_at >= SSE_RESUME_TTL:
+                del self._streams[generation_id]
+        if len(self._streams) >= SSE_RESUME_MAX_STREAMS:
+            finished = sorted(
+                (s for s in self._streams.values() if s.done),
+                key=lambda s: s.finished_at
+            )
+            for stream in finished[:len(self._streams) - SSE_RESUME_MAX_STREAMS + 1]:
+                del self._streams[stream.id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        streams = list(self._streams.values())
+        return {
+            "active": sum(1 for s in streams if not s.done),
+            "retained": sum(1 for s in streams if s.done),
+            "detached": sum(1 for s in streams if not s.done and s.subscribers == 0),
+            "buffered_events": sum(len(s.buffer) for s in streams),
+            "started": self.started,
+            "resumed": self.resumed,
+            "missed": self.missed,
+        }
+
+
+sse_streams = ResumableStreamRegistry()
@@ -0,0 +1,98 @@
+"""
+模型结果缓存
+用于缓存 proprietary->general 流程中专有模型（第一步）的非流式输出，
+相同输入的重复请求可以直接跳过最耗时的一步。
+
+- LRU 淘汰，条目数和内存占用（按 UTF-8 字节估算）双上限
+- 每条记录单独设置 TTL（由 Workflow.config 决定）
+- 仅在事件循环线程内使用，无需加锁
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+STAGE1_CACHE_MAX_ENTRIES = int(os.getenv("STAGE1_CACHE_MAX_ENTRIES", 1000))
+STAGE1_CACHE_MAX_BYTES = int(os.getenv("STAGE1_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+STAGE1_CACHE_DEFAULT_TTL = float(os.getenv("STAGE1_CACHE_DEFAULT_TTL", 3600))
+
+
+def make_cache_key(messages: List[Dict[str, str]], model: str, temperature: float) -> str:
+    """根据提示词内容、渲染后的用户消息、模型和温度生成缓存键"""
+    payload = json.dumps(
+        {"messages": messages, "model": model, "temperature": temperature},
+        ensure_ascii=False,
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """带 TTL 和内存上限的 LRU 缓存"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期时返回 None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value, size = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: str, ttl: float):
+        """写入缓存，超过条目数或内存上限时按 LRU 淘汰"""
+        size = len(key) + len(value.encode("utf-8"))
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, value, size)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+stage1_cache = ResultCache(STAGE1_CACHE_MAX_ENTRIES, STAGE1_CACHE_MAX_BYTES)
@@ -0,0 +1,143 @@
+"""
+相同请求的合并执行（single-flight）
+多个客户端同时提交相同的聊天请求时，只向上游发起一次生成，
+所有订阅者收到同样的 SSE 事件序列。
+
+- 第一个请求（leader）在后台任务中执行生成，事件按顺序记录下来
+- 合并窗口内到达的相同请求（joiner）先回放已发出的事件，再继续接收新事件
+- 后台任务独立于任何一个客户端连接：leader 断开不影响其他订阅者；
+  所有订阅者都断开后取消生成，释放上游资源
+- 生成结束后立即从登记表移除，之后的相同请求重新生成（结果复用由 result_cache 负责）
+- 仅在事件循环线程内使用，每个 worker 进程独立
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHAT_COALESCE_DEFAULT_WINDOW = float(os.getenv("CHAT_COALESCE_DEFAULT_WINDOW", 30.0))
+
+
+def make_flight_key(**parts: Any) -> str:
+    """根据请求中决定输出内容的字段生成合并键"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """一次进行中的生成：记录已发出的事件并广播给所有订阅者"""
+
+    def __init__(self, key: str, source: AsyncIterator[str]):
+        self.key = key
+        self.started_at = time.monotonic()
+        self.events: List[str] = []
+        self.done = False
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run(source))
+
+    async def _run(self, source: AsyncIterator[str]):
+        try:
+            async for event in source:
+                self._publish(event)
+        except asyncio.CancelledError:
+            logger.info(f"合并请求的生成已取消（无订阅者）: key={self.key[:12]}")
+            raise
+        except Exception as e:
+            logger.error(f"合并请求的生成失败: {str(e)}", exc_info=True)
+        finally:
+            self.done = True
+            self._notify()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _publish(self, event: str):
+        self.events.append(event)
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def subscribe(self) -> AsyncIterator[str]:
+        """
+        订阅事件流：从第一个事件开始回放，然后跟随生成进度输出新事件
+
+        订阅者在调用时即计数，避免 leader 在 joiner 开始读取前断开导致生成被取消
+        """
+        self.subscribers += 1
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        index = 0
+        try:
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.done:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self._task.done():
+                self._task.cancel()
+
+
+class SingleFlightGroup:
+    """按合并键登记进行中的生成"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.leaders = 0
+        self.joiners = 0
+
+    def join_or_start(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[str]],
+        window: float
+    ) -> Tuple[Flight, bool]:
+        """
+        加入合并窗口内相同键的进行中生成，或新建一次生成
+
+        Returns:
+            (flight, is_leader)
+        """
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done and time.monotonic() - flight.started_at <= window:
+            self.joiners += 1
+            logger.info(
+                f"合并相同请求: key={key[:12]}, 已发出事件={len(flight.events)}, "
+                f"订阅者={flight.subscribers + 1}"
+            )
+            return flight, False
+
+        flight = Flight(key, factory())
+        self._flights[key] = flight
+        self.leaders += 1
+        flight._task.add_done_callback(lambda _: self._remove(flight))
+        return flight, True
+
+    def _remove(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.joiners
+        return {
+            "active": len(self._flights),
+            "subscribers": sum(f.subscribers for f in self._flights.values()),
+            "leaders": self.leaders,
+            "joiners": self.joiners,
+            "coalesce_rate": round(self.joiners / total, 4) if total else 0.0,
+        }
+
+
+chat_flights = SingleFlightGroup()
@@ -0,0 +1,223 @@
+"""
+上游 LLM 准入控制
+按 api_base 限制同时进行的生成数，超出部分进入有界等待队列。
+
+- 每个上游一个 AdmissionController，并发上限、队列长度、排队超时
+  可在 provider 的 custom_config 中配置（max_concurrency / max_queue / queue_timeout），
+  否则使用环境变量默认值；限制按 worker 进程计算
+- 等待队列按租户（ApiKey）分组，空出名额时在租户间轮转分配，
+  单个租户的突发请求不会饿死其他租户
+- 队列已满时立即拒绝（调用方返回 429 + Retry-After），排队超时同样拒绝
+- 仅在事件循环线程内使用，无需加锁
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", 32))
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", 128))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", 30.0))
+
+# 平均占用时长的平滑系数（用于估算 Retry-After）
+HOLD_TIME_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """准入被拒绝（队列已满或排队超时）"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """单个上游的并发限制与公平等待队列"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._queues: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self._avg_hold = 0.0
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+        }
+
+    def configure(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        """更新限制（配置快照刷新后调用），上限调大时立即放行等待中的请求"""
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._grant()
+
+    def retry_after(self) -> int:
+        """按平均占用时长和排队长度估算建议的重试等待秒数"""
+        if self._avg_hold <= 0:
+            return 1
+        return max(1, math.ceil(self._avg_hold * (self.waiting + 1) / max(self.max_concurrency, 1)))
+
+    def check(self):
+        """不排队的快速检查：队列已满时抛出 AdmissionRejected"""
+        if self.active >= self.max_concurrency and self.waiting >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise AdmissionRejected(f"上游 {self.name} 繁忙，等待队列已满", self.retry_after())
+
+    async def acquire(self, tenant: Hashable = None) -> float:
+        """获取一个并发名额，返回排队等待时间（秒）"""
+        if self.active < self.max_concurrency and self.waiting == 0:
+            self.active += 1
+            self._stats["admitted"] += 1
+            return 0.0
+
+        self.check()
+
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(tenant, deque()).append(future)
+        self.waiting += 1
+        self._stats["queued"] += 1
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配到名额但请求被取消，归还名额
+                self.release()
+            else:
+                self._discard(tenant, future)
+            raise
+
+        if not future.done():
+            self._discard(tenant, future)
+            self._stats["timeouts"] += 1
+            raise AdmissionRejected(
+                f"上游 {self.name} 繁忙，排队超过 {self.queue_timeout:g} 秒",
+                self.retry_after()
+            )
+
+        wait = time.monotonic() - start
+        self._stats["admitted"] += 1
+        self._stats["total_wait"] += wait
+        self._stats["max_wait"] = max(self._stats["max_wait"], wait)
+        return wait
+
+    def release(self, hold_time: Optional[float] = None):
+        """归还名额，并按租户轮转放行下一个等待的请求"""
+        self.active -= 1
+        if hold_time is not None:
+            self._avg_hold += HOLD_TIME_EWMA_ALPHA * (hold_time - self._avg_hold)
+        self._grant()
+
+    @asynccontextmanager
+    async def slot(self, tenant: Hashable = None) -> AsyncIterator[float]:
+        """占用一个名额直到退出上下文，产出排队等待时间"""
+        wait = await self.acquire(tenant)
+        start = time.monotonic()
+        try:
+            yield wait
+        finally:
+            self.release(time.monotonic() - start)
+
+    def _grant(self):
+        while self.active < self.max_concurrency and self._queues:
+            tenant, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                # 该租户还有请求在排队：移到队尾，下一个名额给其他租户
+                self._queues.move_to_end(tenant)
+            else:
+                del self._queues[tenant]
+            self.waiting -= 1
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    def _discard(self, tenant: Hashable, future: asyncio.Future):
+        queue = self._queues.get(tenant)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            return
+        self.waiting -= 1
+        if not queue:
+            del self._queues[tenant]
+        future.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        total_wait = stats.pop("total_wait")
+        stats["avg_wait"] = round(total_wait / stats["queued"], 4) if stats["queued"] else 0.0
+        stats["max_wait"] = round(stats["max_wait"], 4)
+        stats.update({
+            "active": self.active,
+            "waiting": self.waiting,
+            "waiting_tenants": len(self._queues),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "avg_hold_time": round(self._avg_hold, 4),
+        })
+        return stats
+
+
+@asynccontextmanager
+async def admission_slot(controller: Optional[AdmissionController], tenant: Hashable = None) -> AsyncIterator[float]:
+    """在 controller 上占用名额；controller 为空时不做限制，排队时间为 0"""
+    if controller is None:
+        yield 0.0
+        return
+    async with controller.slot(tenant) as wait:
+        yield wait
+
+
+_controllers: Dict[str, AdmissionController] = {}
+
+
+def _get_limit(custom_config: Optional[Dict[str, Any]], key: str, default, cast):
+    if isinstance(custom_config, dict) and custom_config.get(key) not in (None, ""):
+        try:
+            return cast(custom_config[key])
+        except (ValueError, TypeError):
+            logger.warning(f"custom_config.{key} 配置无效: {custom_config[key]}，使用默认值 {default}")
+    return default
+
+
+def get_admission(provider) -> AdmissionController:
+    """获取 provider 所在上游（api_base）的准入控制器，限制随 provider 配置更新"""
+    key = provider.api_base or provider.name
+    custom_config = provider.custom_config
+    max_concurrency = _get_limit(custom_config, "max_concurrency", UPSTREAM_MAX_CONCURRENCY, int)
+    max_queue = _get_limit(custom_config, "max_queue", UPSTREAM_MAX_QUEUE, int)
+    queue_timeout = _get_limit(custom_config, "queue_timeout", UPSTREAM_QUEUE_TIMEOUT, float)
+
+    controller = _controllers.get(key)
+    if controller is None:
+        controller = AdmissionController(key, max_concurrency, max_queue, queue_timeout)
+        _controllers[key] = controller
+    elif (controller.max_concurrency, controller.max_queue, controller.queue_timeout) != (
+        max_concurrency, max_queue, queue_timeout
+    ):
+        controller.configure(max_concurrency, max_queue, queue_timeout)
+    return controller
+
+
+def get_admission_stats() -> Dict[str, Dict[str, Any]]:
+    """所有上游的准入统计"""
+    return {name: controller.get_stats() for name, controller in _controllers.items()}
@@ -0,0 +1,66 @@
+"""
+长文本分块
+按段落边界把长文本切成不超过 max_chars 的块，供专有模型（第一步）分块并发调用：
+
+- 以空行或换行分段，相邻段落尽量合并进同一块
+- 单个段落超过 max_chars 时按句末标点切分，仍然过长的句子按字符数硬切
+- 各块保持原文顺序，块内段落之间保留原有的换行
+"""
+import re
+from typing import List
+
+# 句末标点（中英文），切分后标点留在前一句末尾
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;…])|(?<=\.\s)")
+_PARAGRAPH_BREAK = re.compile(r"(\n\s*\n|\n)")
+
+
+def _split_long(paragraph: str, max_chars: int) -> List[str]:
+    """把超长段落切成不超过 max_chars 的片段"""
+    pieces: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(paragraph):
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if len(current) + len(sentence) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_paragraphs(text: str, max_chars: int) -> List[str]:
+    """
+    按段落边界把 text 切成不超过 max_chars 的块
+
+    text 不超过 max_chars 时原样返回单个块
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+
+    # 保留分隔符，合并时恢复原文中的换行
+    tokens = _PARAGRAPH_BREAK.split(text)
+    chunks: List[str] = []
+    current = ""
+    for i in range(0, len(tokens), 2):
+        paragraph = tokens[i]
+        separator = tokens[i + 1] if i + 1 < len(tokens) else ""
+        if not paragraph.strip():
+            continue
+        pieces = _split_long(paragraph, max_chars) if len(paragraph) > max_chars else [paragraph]
+        for piece in pieces:
+            if current and len(current) + len(piece) > max_chars:
+                chunks.append(current.strip())
+                current = ""
+            current += piece
+        current += separator
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks
@@ -0,0 +1,189 @@
+"""
+上游熔断与重试策略
+按 api_base 维护熔断器，配合 iter_provider_call 在首个字节前重试。
+
+- 关闭（closed）：正常放行，连续失败达到阈值后打开
+- 打开（open）：冷却期内直接快速失败，不再请求上游
+- 半开（half_open）：冷却期结束后放行少量探测请求，成功则关闭，失败则重新打开
+- 只有连接/传输错误和 5xx 计入失败；4xx（含 429）说明上游仍然存活，不计入
+- 阈值、冷却时间、探测数和重试次数可在 provider 的 custom_config 中配置
+  （breaker_threshold / breaker_cooldown / breaker_probes / max_retries），否则使用环境变量默认值
+- 状态按 worker 进程保存，仅在事件循环线程内使用
+"""
+import logging
+import math
+import os
+import random
+import time
+from typing import Any, Dict, Optional
+
+from app.utils.admission import _get_limit
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30.0))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", 1))
+
+# 首个字节前的重试次数与退避（秒）：第 n 次重试前等待 uniform(0, min(max, base * 2^n))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", 2))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", 0.2))
+UPSTREAM_RETRY_BACKOFF_MAX = float(os.getenv("UPSTREAM_RETRY_BACKOFF_MAX", 2.0))
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开（或半开且探测名额已占满），请求被快速拒绝"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_backoff(attempt: int) -> float:
+    """第 attempt 次重试前的等待时间（full jitter）"""
+    return random.uniform(0, min(UPSTREAM_RETRY_BACKOFF_MAX, UPSTREAM_RETRY_BACKOFF * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """单个上游的熔断器"""
+
+    def __init__(self, name: str, threshold: int, cooldown: float, probes: int):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probes = probes
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = 0
+        self.last_error: Optional[str] = None
+        self._stats = {
+            "successes": 0,
+            "failures": 0,
+            "rejected": 0,
+            "opened": 0,
+            "probes": 0,
+        }
+
+    def configure(self, threshold: int, cooldown: float, probes: int):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probes = probes
+
+    def retry_after(self) -> int:
+        """距离下一次允许探测的秒数"""
+        if self.state != STATE_OPEN or self.opened_at is None:
+            return 1
+        return max(1, math.ceil(self.opened_at + self.cooldown - time.monotonic()))
+
+    def available(self) -> bool:
+        """不改变状态的检查：当前是否会放行请求"""
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return self.probing < self.probes
+
+    def acquire(self) -> bool:
+        """
+        请求上游前调用，被拒绝时抛出 CircuitOpenError
+
+        Returns:
+            是否为半开状态下的探测请求（探测请求结束时需调用 on_success / on_failure / on_cancel）
+        """
+        if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = STATE_HALF_OPEN
+            self.probing = 0
+            logger.info(f"熔断器半开，开始探测上游: {self.name}")
+        if self.state == STATE_CLOSED:
+            return False
+        if self.state == STATE_HALF_OPEN and self.probing < self.probes:
+            self.probing += 1
+            self._stats["probes"] += 1
+            return True
+        self._stats["rejected"] += 1
+        raise CircuitOpenError(f"上游 {self.name} 熔断中，暂停请求", self.retry_after())
+
+    def on_success(self, probe: bool = False):
+        self._stats["successes"] += 1
+        self.consecutive_failures = 0
+        if probe:
+            self.probing = max(self.probing - 1, 0)
+        if self.state != STATE_CLOSED:
+            logger.info(f"熔断器关闭，上游已恢复: {self.name}")
+            self.state = STATE_CLOSED
+            self.opened_at = None
+
+    def on_failure(self, error: str, probe: bool = False):
+        self._stats["failures"] += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        if probe:
+            self.probing = max(self.probing - 1, 0)
+        if self.state == STATE_HALF_OPEN or (
+            self.state == STATE_CLOSED and self.consecutive_failures >= self.threshold
+        ):
+            self._open()
+
+    def on_cancel(self, probe: bool = False):
+        """请求在得出结果前被取消：只归还探测名额"""
+        if probe:
+            self.probing = max(self.probing - 1, 0)
+
+    def _open(self):
+        self.state = STATE_OPEN
+        self.opened_at = time.monotonic()
+        self.probing = 0
+        self._stats["opened"] += 1
+        logger.warning(
+            f"熔断器打开: {self.name}, 连续失败 {self.consecutive_failures} 次, "
+            f"{self.cooldown:g} 秒后探测, 最近错误: {self.last_error}"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats.update({
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after": self.retry_after() if self.state == STATE_OPEN else 0,
+            "probing": self.probing,
+            "threshold": self.threshold,
+            "cooldown": self.cooldown,
+            "probes_allowed": self.probes,
+            "last_error": self.last_error,
+        })
+        return stats
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(provider) -> CircuitBreaker:
+    """获取 provider 所在上游（api_base）的熔断器，阈值随 provider 配置更新"""
+    key = provider.api_base or provider.name
+    custom_config = provider.custom_config
+    threshold = _get_limit(custom_config, "breaker_threshold", CIRCUIT_FAILURE_THRESHOLD, int)
+    cooldown = _get_limit(custom_config, "breaker_cooldown", CIRCUIT_OPEN_SECONDS, float)
+    probes = _get_limit(custom_config, "breaker_probes", CIRCUIT_HALF_OPEN_PROBES, int)
+
+    breaker = _breakers.get(key)
+    if breaker is None:
+        breaker = _breakers[key] = CircuitBreaker(key, threshold, cooldown, probes)
+    elif (breaker.threshold, breaker.cooldown, breaker.probes) != (threshold, cooldown, probes):
+        breaker.configure(threshold, cooldown, probes)
+    return breaker
+
+
+def get_max_retries(provider) -> int:
+    """provider 在首个字节前的最大重试次数"""
+    return max(_get_limit(provider.custom_config, "max_retries", UPSTREAM_MAX_RETRIES, int), 0)
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """所有上游的熔断器状态"""
+    return {name: breaker.get_stats() for name, breaker in _breakers.items()}
+
@@ -6,9 +6,13 @@ from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
+from collections import OrderedDict
+from functools import lru_cache
 import base64
+import binascii
 import os
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -16,12 +20,23 @@ logger = logging.getLogger(__name__)
 # 注意：必须与 Backend 使用相同的密钥
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", "xinhua-tool-default-encryption-key-change-in-production")
 SALT = b"xinhua-tool-salt"  # 盐值，必须与 Backend 一致
+# 解密结果缓存的最大条目数（按密文缓存明文，避免每次请求重复解密）
+DECRYPT_CACHE_SIZE = int(os.getenv("DECRYPT_CACHE_SIZE", 256))
 
 
+# Fernet token 结构：版本(1) + 时间戳(8) + IV(16) + 密文(16 的整数倍) + HMAC(32)
+_FERNET_VERSION = 0x80
+_FERNET_OVERHEAD = 1 + 8 + 16 + 32
+
+_decrypt_cache: "OrderedDict[str, str]" = OrderedDict()
+_decrypt_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
 def _get_fernet() -> Fernet:
-    """获取 Fernet 实例"""
+    """获取 Fernet 实例（派生密钥每个进程只计算一次）"""
     # 使用 PBKDF2 从密钥生成固定长度的密钥
-    kdf = PBKDF2(
+    kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
         length=32,
         salt=SALT,
@@ -54,6 +69,32 @@ def encrypt_api_key(api_key: str) -> str:
         raise
 
 
+def _get_cached_plaintext(encrypted_key: str):
+    """从解密缓存中读取明文（命中时移到队尾，实现 LRU）"""
+    with _decrypt_cache_lock:
+        plaintext = _decrypt_cache.get(encrypted_key)
+        if plaintext is not None:
+            _decrypt_cache.move_to_end(encrypted_key)
+        return plaintext
+
+
+def _set_cached_plaintext(encrypted_key: str, plaintext: str):
+    """写入解密缓存，超过上限时淘汰最久未使用的条目"""
+    if DECRYPT_CACHE_SIZE <= 0:
+        return
+    with _decrypt_cache_lock:
+        _decrypt_cache[encrypted_key] = plaintext
+        _decrypt_cache.move_to_end(encrypted_key)
+        while len(_decrypt_cache) > DECRYPT_CACHE_SIZE:
+            _decrypt_cache.popitem(last=False)
+
+
+def clear_decrypt_cache():
+    """清空解密缓存"""
+    with _decrypt_cache_lock:
+        _decrypt_cache.clear()
+
+
 def decrypt_api_key(encrypted_key: str) -> str:
     """
     解密 API 密钥
@@ -67,15 +108,21 @@ def decrypt_api_key(encrypted_key: str) -> str:
     if not encrypted_key:
         return ""
     
+    cached = _get_cached_plaintext(encrypted_key)
+    if cached is not None:
+        return cached
+    
     try:
         fernet = _get_fernet()
-        decrypted = fernet.decrypt(encrypted_key.encode())
-        return decrypted.decode()
+        decrypted = fernet.decrypt(encrypted_key.encode()).decode()
     except Exception as e:
         logger.error(f"解密 API 密钥失败: {str(e)}")
-        # 如果解密失败，可能是未加密的密钥，直接返回原值
+        # 如果解密失败，可能是未加密的密钥，直接返回原值（不写入缓存，避免把密文当作明文长期复用）
         logger.warning("密钥解密失败，可能是未加密的密钥，返回原值")
         return encrypted_key
+    
+    _set_cached_plaintext(encrypted_key, decrypted)
+    return decrypted
 
 
 def mask_api_key(api_key: str, show_prefix: int = 3, show_suffix: int = 12) -> str:
@@ -102,6 +149,19 @@ def mask_api_key(api_key: str, show_prefix: int = 3, show_suffix: int = 12) -> s
     return f"{prefix}****{suffix}"
 
 
+def _looks_like_fernet_token(value: str) -> bool:
+    """按 Fernet token 的结构判断字符串是否可能是密文"""
+    try:
+        raw = base64.urlsafe_b64decode(value.encode())
+    except (binascii.Error, ValueError):
+        return False
+    return (
+        len(raw) >= _FERNET_OVERHEAD + 16
+        and raw[0] == _FERNET_VERSION
+        and (len(raw) - _FERNET_OVERHEAD) % 16 == 0
+    )
+
+
 def is_encrypted(value: str) -> bool:
     """
     判断字符串是否已加密
@@ -115,7 +175,17 @@ def is_encrypted(value: str) -> bool:
     if not value:
         return False
     
-    # 尝试解密，如果成功说明已加密
+    # 先按 Fernet token 结构快速判断，明显不是 token 的值无需任何密码学运算
+    if not _looks_like_fernet_token(value):
+        return False
+    
+    # 已成功解密过的密文直接命中缓存
+    with _decrypt_cache_lock:
+        cached = _decrypt_cache.get(value)
+    if cached is not None:
+        return True
+    
+    # 使用已缓存的 Fernet 实例校验 HMAC（不会重新派生密钥）
     try:
         fernet = _get_fernet()
         fernet.decrypt(value.encode())
@@ -0,0 +1,94 @@
+"""
+聊天请求的整体截止时间与分阶段时间预算
+
+- 截止时间来自请求头 X-Request-Timeout（秒）或 Workflow.config 中的 deadline.timeout，
+  都未设置时使用 CHAT_DEFAULT_TIMEOUT（0 表示不限制），且不超过 CHAT_MAX_TIMEOUT
+- 两段式流程中第一步的预算为剩余时间的 stage1_share，同时至少给第二步留出 stage2_min 秒；
+  第二步的预算为第一步结束后剩余的全部时间
+- iter_with_deadline 为上游调用加上时间限制：超时时取消正在等待的调用（关闭上游连接），
+  并抛出 DeadlineExceeded，由调用方发送带阶段名的 error 事件
+"""
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Optional, TypeVar
+
+CHAT_DEFAULT_TIMEOUT = float(os.getenv("CHAT_DEFAULT_TIMEOUT", 0))
+CHAT_MAX_TIMEOUT = float(os.getenv("CHAT_MAX_TIMEOUT", 600.0))
+CHAT_STAGE1_BUDGET_SHARE = float(os.getenv("CHAT_STAGE1_BUDGET_SHARE", 0.6))
+CHAT_STAGE2_MIN_BUDGET = float(os.getenv("CHAT_STAGE2_MIN_BUDGET", 10.0))
+
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """某个阶段用完了时间预算"""
+
+    def __init__(self, stage: str, budget: float):
+        super().__init__(f"阶段 {stage} 超出时间预算（{budget:.1f} 秒）")
+        self.stage = stage
+        self.budget = budget
+
+
+class Deadline:
+    """一次请求的截止时间（基于 time.monotonic）"""
+
+    def __init__(self, timeout: float, stage1_share: float = CHAT_STAGE1_BUDGET_SHARE,
+                 stage2_min: float = CHAT_STAGE2_MIN_BUDGET):
+        self.timeout = timeout
+        self.stage1_share = stage1_share
+        self.stage2_min = stage2_min
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def stage1_budget(self) -> float:
+        """第一步（或 pipeline 前置阶段）的预算"""
+        remaining = self.remaining()
+        budget = remaining * self.stage1_share
+        if remaining - budget < self.stage2_min:
+            # 剩余时间不足时优先保证第二步的最低预算，但第一步至少保留按比例的一半
+            budget = max(remaining - self.stage2_min, budget / 2)
+        return budget
+
+
+async def iter_with_deadline(
+    iterator: AsyncIterator[T],
+    budget: float,
+    stage: str
+) -> AsyncIterator[T]:
+    """
+    在 budget 秒内逐个产出 iterator 的元素
+
+    超时时取消正在等待的 __anext__（异常传入上游调用，释放准入名额并关闭连接），
+    然后抛出 DeadlineExceeded
+    """
+    expires_at = time.monotonic() + budget
+    it = iterator.__aiter__()
+    try:
+        while True:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(stage, budget)
+            try:
+                item = await asyncio.wait_for(it.__anext__(), remaining)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(stage, budget) from None
+            yield item
+    finally:
+        aclose = getattr(it, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def resolve_timeout(requested: Optional[float], configured: Optional[float] = None) -> Optional[float]:
+    """按请求头、Workflow 配置、默认值的顺序确定整体超时（秒），不限制时返回 None"""
+    for timeout in (requested, configured, CHAT_DEFAULT_TIMEOUT):
+        if timeout is not None and timeout > 0:
+            return min(timeout, CHAT_MAX_TIMEOUT)
+    return None
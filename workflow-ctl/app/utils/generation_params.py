@@ -0,0 +1,138 @@
+"""
+上游请求的生成参数（max_tokens / top_p / stop）
+在加载配置快照时按 provider 和模型预先编译好，调用上游时直接合并进请求体，限制单次生成的最长时间和占用。
+
+参数来源（优先级从高到低）：
+1. provider.model_configurations 中 name 与模型名相同的条目：{"name": "...", "max_tokens": 2048, "top_p": 0.9, "stop": ["###"]}
+   （max_tokens 也可写为 max_output_tokens）
+2. model_parameters 表中 name 为参数名的记录：model_type=proprietary 作用于 professional 类 provider，
+   general 作用于 general 类 provider；default_value 为默认值，validation 中的 min / max 用于限定上述两处的取值
+3. UPSTREAM_DEFAULT_MAX_TOKENS（0 表示不限制）
+
+取值无效的参数会被忽略并记录警告。
+"""
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_DEFAULT_MAX_TOKENS = int(os.getenv("UPSTREAM_DEFAULT_MAX_TOKENS", 0))
+
+GENERATION_PARAM_NAMES = ("max_tokens", "top_p", "stop")
+
+# model_parameters.model_type -> llm_providers.category
+MODEL_TYPE_CATEGORIES = {"proprietary": "professional", "general": "general"}
+
+# model_configurations 中的别名
+_ALIASES = {"max_output_tokens": "max_tokens"}
+
+
+def _cast(name: str, value: Any) -> Any:
+    """把参数值转换为上游接口需要的类型，无效时抛出 ValueError"""
+    if name == "max_tokens":
+        if isinstance(value, bool):
+            raise ValueError(value)
+        value = int(value)
+        if value <= 0:
+            raise ValueError(value)
+        return value
+    if name == "top_p":
+        value = float(value)
+        if not 0 < value <= 1:
+            raise ValueError(value)
+        return value
+    if isinstance(value, str):
+        return [value] if value else []
+    if isinstance(value, (list, tuple)) and all(isinstance(item, str) for item in value):
+        return list(value)
+    raise ValueError(value)
+
+
+def _limit(validation: Dict[str, Any], key: str, value_type: type) -> Optional[Any]:
+    """取出 validation 中的 min / max 并转换为参数值的类型（可写为字符串），缺失或无效时返回 None"""
+    limit = validation.get(key)
+    if limit is None or isinstance(limit, bool):
+        return None
+    try:
+        return value_type(float(limit))
+    except (TypeError, ValueError, OverflowError):
+        logger.warning(f"忽略无效的参数取值范围 {key}={limit!r}")
+        return None
+
+
+def _clamp(value: Any, validation: Optional[Dict[str, Any]]) -> Any:
+    """按 validation 中的 min / max 限定数值参数"""
+    if not isinstance(validation, dict) or isinstance(value, list):
+        return value
+    upper = _limit(validation, "max", type(value))
+    if upper is not None and value > upper:
+        value = upper
+    lower = _limit(validation, "min", type(value))
+    if lower is not None and value < lower:
+        value = lower
+    return value
+
+
+def collect_parameter_defaults(model_parameters: Iterable) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    从 model_parameters 记录中取出生成参数的默认值和取值范围
+
+    Returns:
+        category -> 参数名 -> {"default": 默认值或 None, "validation": validation}
+    """
+    defaults: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for p in model_parameters:
+        category = MODEL_TYPE_CATEGORIES.get(p.model_type)
+        if category is None or p.name not in GENERATION_PARAM_NAMES:
+            continue
+        default = None
+        if p.default_value not in (None, ""):
+            try:
+                default = _cast(p.name, p.default_value)
+            except (TypeError, ValueError):
+                logger.warning(f"模型参数 {p.name}（{p.model_type}）的默认值无效: {p.default_value!r}")
+        defaults.setdefault(category, {})[p.name] = {"default": default, "validation": p.validation}
+    return defaults
+
+
+def compile_generation_params(
+    model: str,
+    model_configurations: Iterable[Dict[str, Any]],
+    parameter_defaults: Optional[Dict[str, Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    """
+    编译某个模型的生成参数
+
+    Args:
+        model: 模型名
+        model_configurations: provider 的 model_configurations
+        parameter_defaults: 该 provider 所属 category 的参数默认值（collect_parameter_defaults 的一项）
+    """
+    parameter_defaults = parameter_defaults or {}
+    compiled: Dict[str, Any] = {}
+    for name, spec in parameter_defaults.items():
+        if spec["default"] is not None:
+            compiled[name] = spec["default"]
+
+    for item in model_configurations:
+        if not isinstance(item, dict) or item.get("name") != model:
+            continue
+        for key, value in item.items():
+            name = _ALIASES.get(key, key)
+            if name not in GENERATION_PARAM_NAMES or value is None:
+                continue
+            try:
+                compiled[name] = _cast(name, value)
+            except (TypeError, ValueError):
+                logger.warning(f"模型 {model} 的 model_configurations.{key} 无效: {value!r}")
+
+    for name, value in list(compiled.items()):
+        validation = parameter_defaults.get(name, {}).get("validation")
+        compiled[name] = _clamp(value, validation)
+
+    if "max_tokens" not in compiled and UPSTREAM_DEFAULT_MAX_TOKENS > 0:
+        compiled["max_tokens"] = UPSTREAM_DEFAULT_MAX_TOKENS
+    if compiled.get("stop") == []:
+        del compiled["stop"]
+    return compiled
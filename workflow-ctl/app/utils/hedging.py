@@ -0,0 +1,93 @@
+"""
+非流式调用的对冲请求（hedged request）统计
+第一个请求超过对冲延迟仍未返回时，再发一个相同请求到另一个副本/provider，先返回的结果胜出。
+
+- 对冲延迟可固定配置，也可取最近成功调用延迟的分位数（默认 p95）；
+  样本不足 HEDGE_MIN_SAMPLES 时使用 HEDGE_DEFAULT_DELAY
+- 对冲比例超过 HEDGE_MAX_RATE 时不再对冲，避免上游整体变慢时请求量翻倍
+- 统计保存在 worker 进程内存中，仅在事件循环线程内使用
+"""
+import math
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+HEDGE_DEFAULT_QUANTILE = float(os.getenv("HEDGE_DEFAULT_QUANTILE", 0.95))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", 5.0))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 0.05))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", 0.1))
+HEDGE_WINDOW_SIZE = int(os.getenv("HEDGE_WINDOW_SIZE", 200))
+
+
+class HedgeTracker:
+    """记录调用延迟样本和对冲/胜出次数"""
+
+    def __init__(self, name: str, window_size: int = HEDGE_WINDOW_SIZE):
+        self.name = name
+        self._latencies: Deque[float] = deque(maxlen=window_size)
+        self.requests = 0
+        self.hedged = 0
+        self.skipped = 0
+        self.primary_wins = 0
+        self.hedge_wins = 0
+
+    def observe(self, latency: float):
+        """记录一次成功调用的延迟（从该次请求发出算起）"""
+        self._latencies.append(latency)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """最近延迟样本的分位数，样本不足时返回 None"""
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(max(math.ceil(q * len(ordered)) - 1, 0), len(ordered) - 1)
+        return ordered[index]
+
+    def hedge_delay(self, fixed_delay: Optional[float] = None, quantile: float = HEDGE_DEFAULT_QUANTILE) -> float:
+        """对冲延迟：优先使用固定配置，否则取观测到的分位数"""
+        if fixed_delay is not None:
+            return max(fixed_delay, 0.0)
+        observed = self.quantile(quantile)
+        if observed is None:
+            return HEDGE_DEFAULT_DELAY
+        return max(observed, HEDGE_MIN_DELAY)
+
+    def allow_hedge(self) -> bool:
+        """对冲比例未超过 HEDGE_MAX_RATE 时允许再发一个请求"""
+        if self.requests and (self.hedged + 1) / (self.requests + 1) > HEDGE_MAX_RATE:
+            self.skipped += 1
+            return False
+        return True
+
+    def record(self, hedged: bool, hedge_won: bool):
+        """记录一次完成的调用"""
+        self.requests += 1
+        if hedged:
+            self.hedged += 1
+        if hedge_won:
+            self.hedge_wins += 1
+        else:
+            self.primary_wins += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        def rounded(value):
+            return round(value, 4) if value is not None else None
+
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "skipped": self.skipped,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0.0,
+            "primary_wins": self.primary_wins,
+            "hedge_wins": self.hedge_wins,
+            "hedge_win_rate": round(self.hedge_wins / self.hedged, 4) if self.hedged else 0.0,
+            "samples": len(self._latencies),
+            "p50": rounded(self.quantile(0.5)),
+            "p95": rounded(self.quantile(0.95)),
+            "p99": rounded(self.quantile(0.99)),
+        }
+
+
+# 专有模型（第一步）非流式调用
+stage1_hedger = HedgeTracker("proprietary")
@@ -0,0 +1,48 @@
+"""
+共享异步 HTTP 客户端模块
+所有上游 LLM 调用复用同一个 httpx.AsyncClient 连接池，
+避免每个请求重新建立 TCP 连接，也不再占用线程池线程
+"""
+import os
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 连接池配置：并发流的上限由连接数（socket）决定，而不是线程数
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 1000))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", 200))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 30.0))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 10.0))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的异步 HTTP 客户端（首次调用时创建）"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(None, connect=UPSTREAM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY
+            )
+        )
+        logger.info(
+            f"上游 HTTP 连接池已初始化: max_connections={UPSTREAM_MAX_CONNECTIONS}, "
+            f"max_keepalive={UPSTREAM_MAX_KEEPALIVE}"
+        )
+    return _client
+
+
+async def close_http_client():
+    """关闭共享的异步 HTTP 客户端（应用关闭时调用）"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("上游 HTTP 连接池已关闭")
+    _client = None
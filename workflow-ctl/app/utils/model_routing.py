@@ -0,0 +1,142 @@
+"""
+快速模型路由
+LLMProvider.fast_default_model_name 配置了快速模型时，把开销小的请求发给快速模型，其余使用 default_model_name：
+
+- 请求中 fast=true 时使用快速模型；fast=false 时始终使用默认模型
+- 本阶段输入不超过 custom_config.fast_input_chars 个字符（单段流程、第一步、pipeline 的 model 阶段）
+- 第二步的输入（第一步结果）不超过 custom_config.fast_stage1_chars 个字符
+阈值未配置时取 FAST_MODEL_INPUT_CHARS / FAST_MODEL_STAGE1_CHARS，0 表示不按长度路由。
+
+每次调用实际使用的模型和路由原因写入日志参数（model / model_route）；
+fast_model_stats 按 provider 和调用方式分别统计快速模型与默认模型的最近调用延迟，生成对比报告。
+统计保存在 worker 进程内存中，仅在事件循环线程内使用。
+"""
+import os
+import statistics
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.utils.admission import _get_limit
+
+FAST_MODEL_INPUT_CHARS = int(os.getenv("FAST_MODEL_INPUT_CHARS", 0))
+FAST_MODEL_STAGE1_CHARS = int(os.getenv("FAST_MODEL_STAGE1_CHARS", 0))
+FAST_MODEL_WINDOW_SIZE = int(os.getenv("FAST_MODEL_WINDOW_SIZE", 500))
+
+# custom_config 中的阈值键
+THRESHOLD_INPUT = "fast_input_chars"
+THRESHOLD_STAGE1 = "fast_stage1_chars"
+
+# 路由原因
+ROUTE_DEFAULT = "default"
+ROUTE_REQUESTED = "requested"
+ROUTE_SHORT_INPUT = "short_input"
+ROUTE_SHORT_STAGE1 = "short_stage1"
+
+_THRESHOLD_DEFAULTS = {THRESHOLD_INPUT: FAST_MODEL_INPUT_CHARS, THRESHOLD_STAGE1: FAST_MODEL_STAGE1_CHARS}
+_THRESHOLD_ROUTES = {THRESHOLD_INPUT: ROUTE_SHORT_INPUT, THRESHOLD_STAGE1: ROUTE_SHORT_STAGE1}
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """一次模型调用的路由依据，具体模型由 select 按各 provider 的配置决定"""
+    chars: int  # 本阶段输入的字符数
+    threshold: str = THRESHOLD_INPUT  # 与 chars 比较的 custom_config 阈值
+    requested: Optional[bool] = None  # 请求中的 fast 标记
+
+    def select(self, provider) -> Tuple[str, str]:
+        """返回 (模型名, 路由原因)"""
+        fast_model = provider.fast_default_model_name
+        if not fast_model or self.requested is False:
+            return provider.default_model_name, ROUTE_DEFAULT
+        if self.requested:
+            return fast_model, ROUTE_REQUESTED
+        limit = _get_limit(provider.custom_config, self.threshold, _THRESHOLD_DEFAULTS[self.threshold], int)
+        if limit > 0 and self.chars <= limit:
+            return fast_model, _THRESHOLD_ROUTES[self.threshold]
+        return provider.default_model_name, ROUTE_DEFAULT
+
+
+def select_model(provider, route: Optional[ModelRoute] = None) -> Tuple[str, str]:
+    """按 route 为 provider 选择模型，未指定 route 时使用默认模型"""
+    if route is None:
+        return provider.default_model_name, ROUTE_DEFAULT
+    return route.select(provider)
+
+
+class ModelLatency:
+    """单个模型最近成功调用的延迟样本"""
+
+    def __init__(self, window_size: int = FAST_MODEL_WINDOW_SIZE):
+        self.model: Optional[str] = None
+        self.requests = 0
+        self._durations: Deque[float] = deque(maxlen=window_size)
+        self._ttfts: Deque[float] = deque(maxlen=window_size)
+
+    def observe(self, model: str, duration: float, ttft: Optional[float]):
+        self.model = model
+        self.requests += 1
+        self._durations.append(duration)
+        if ttft is not None:
+            self._ttfts.append(ttft)
+
+    def mean(self) -> Optional[float]:
+        return statistics.fmean(self._durations) if self._durations else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        def rounded(samples):
+            return round(statistics.median(samples), 4) if samples else None
+
+        mean = self.mean()
+        return {
+            "model": self.model,
+            "requests": self.requests,
+            "samples": len(self._durations),
+            "avg_duration": round(mean, 4) if mean is not None else None,
+            "p50_duration": rounded(self._durations),
+            "p50_ttft": rounded(self._ttfts),
+        }
+
+
+class FastModelStats:
+    """按 provider 和调用方式（stream / complete）对比快速模型与默认模型的延迟"""
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Dict[str, ModelLatency]] = {}
+
+    def observe(self, provider, mode: str, model: str, duration: float, ttft: Optional[float] = None):
+        """记录一次成功调用，未配置快速模型的 provider 不参与统计"""
+        if not provider.fast_default_model_name:
+            return
+        entry = self._entries.get((provider.name, mode))
+        if entry is None:
+            entry = self._entries[(provider.name, mode)] = {"default": ModelLatency(), "fast": ModelLatency()}
+        kind = "fast" if model == provider.fast_default_model_name and model != provider.default_model_name else "default"
+        entry[kind].observe(model, duration, ttft)
+
+    def get_report(self) -> Dict[str, Any]:
+        """
+        对比报告：两种模型各自的请求数、平均/中位延迟和中位 TTFT，
+        saved_per_request 为两者平均延迟之差，estimated_saved 为其乘以快速模型请求数
+        （路由到快速模型的请求输入本身较短，该估计偏乐观，仅用于观察趋势）
+        """
+        report = {}
+        for (name, mode), entry in self._entries.items():
+            default, fast = entry["default"], entry["fast"]
+            total = default.requests + fast.requests
+            item = {
+                "default": default.get_stats(),
+                "fast": fast.get_stats(),
+                "fast_share": round(fast.requests / total, 4) if total else 0.0,
+                "saved_per_request": None,
+                "estimated_saved": None,
+            }
+            if default.mean() is not None and fast.mean() is not None:
+                saved = default.mean() - fast.mean()
+                item["saved_per_request"] = round(saved, 4)
+                item["estimated_saved"] = round(saved * fast.requests, 3)
+            report[f"{name}/{mode}"] = item
+        return report
+
+
+fast_model_stats = FastModelStats()
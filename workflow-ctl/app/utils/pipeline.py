@@ -0,0 +1,210 @@
+"""
+配置驱动的多阶段流程（pipeline）
+在 Workflow.config 中用 "pipeline" 描述一组阶段及其依赖，替代固定的 workflow_type 分支：
+
+    {"pipeline": {
+        "stages": [
+            {"id": "draft_a", "type": "model", "category": "professional", "prompt": "proprietary"},
+            {"id": "draft_b", "type": "model", "category": "professional",
+             "system_prompt": "...", "user_prompt": "换一个角度改写：{user_message}"},
+            {"id": "merged", "type": "merge", "inputs": ["draft_a", "draft_b"], "separator": "\\n\\n---\\n\\n"},
+            {"id": "clean", "type": "filter", "input": "merged", "max_chars": 6000},
+            {"id": "final", "type": "model", "category": "general", "prompt": "general",
+             "input": "请综合以下稿件：\\n{clean}"}
+        ],
+        "output": "final"
+    }}
+
+阶段类型：
+- model: 调用 category 对应的 provider 池；提示词取 prompts 中 model_type=prompt 的配置，
+  或直接给出 system_prompt / user_prompt。input 模板渲染后作为提示词中的 {user_message}
+- template: 按 template 模板渲染文本
+- merge: 按 inputs 顺序用 separator 拼接各阶段输出
+- filter: 对 input 阶段的输出执行 replace（按顺序替换）、strip、max_chars（截断）
+
+模板中的 {user_message} 为用户消息，{阶段 id} 为该阶段的输出；依赖关系由 inputs 或模板中的引用推出。
+输出阶段（output，默认最后一个阶段）以流式返回，其余阶段在依赖满足后并发执行。
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+STAGE_MODEL = "model"
+STAGE_TEMPLATE = "template"
+STAGE_MERGE = "merge"
+STAGE_FILTER = "filter"
+STAGE_TYPES = (STAGE_MODEL, STAGE_TEMPLATE, STAGE_MERGE, STAGE_FILTER)
+
+USER_MESSAGE = "user_message"
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+class PipelineError(ValueError):
+    """pipeline 配置无效"""
+
+
+@dataclass(frozen=True)
+class PipelineStage:
+    """单个阶段的配置"""
+    id: str
+    type: str
+    inputs: Tuple[str, ...]  # 依赖的阶段 id
+    template: str = "{user_message}"  # model 阶段的 input / template 阶段的 template
+    category: Optional[str] = None
+    prompt: Optional[str] = None
+    system_prompt: Optional[str] = None
+    user_prompt: Optional[str] = None
+    separator: str = "\n\n"
+    options: Dict[str, Any] = field(default_factory=dict)  # filter 阶段的处理选项
+
+
+@dataclass(frozen=True)
+class Pipeline:
+    """校验并排好序的 pipeline"""
+    stages: Dict[str, PipelineStage]
+    order: Tuple[str, ...]  # 输出阶段依赖的全部阶段（拓扑序，不含输出阶段）
+    output: str
+
+    @property
+    def output_stage(self) -> PipelineStage:
+        return self.stages[self.output]
+
+    def ready(self, done) -> List[PipelineStage]:
+        """依赖都已完成、自身尚未完成的阶段"""
+        return [
+            self.stages[stage_id] for stage_id in self.order
+            if stage_id not in done and all(dep in done for dep in self.stages[stage_id].inputs)
+        ]
+
+
+def render_template(template: str, values: Dict[str, str]) -> str:
+    """替换模板中的 {user_message} / {阶段 id}，其他花括号内容原样保留"""
+    return _PLACEHOLDER.sub(lambda m: values.get(m.group(1), m.group(0)), template)
+
+
+def _references(template: str, stage_ids) -> List[str]:
+    return [name for name in _PLACEHOLDER.findall(template) if name in stage_ids]
+
+
+def _parse_stage(raw: Any, stage_ids) -> PipelineStage:
+    if not isinstance(raw, dict):
+        raise PipelineError(f"阶段配置必须是对象: {raw!r}")
+    stage_id = raw["id"]
+    stage_type = raw.get("type", STAGE_MODEL)
+    if stage_type not in STAGE_TYPES:
+        raise PipelineError(f"阶段 {stage_id} 的类型 {stage_type} 不受支持，可选: {', '.join(STAGE_TYPES)}")
+
+    if stage_type == STAGE_MODEL:
+        if not raw.get("category"):
+            raise PipelineError(f"model 阶段 {stage_id} 缺少 category")
+        if not raw.get("prompt") and not raw.get("user_prompt"):
+            raise PipelineError(f"model 阶段 {stage_id} 需要 prompt 或 user_prompt")
+        template = raw.get("input", "{user_message}")
+        inputs = _references(template, stage_ids)
+    elif stage_type == STAGE_TEMPLATE:
+        template = raw.get("template")
+        if not isinstance(template, str):
+            raise PipelineError(f"template 阶段 {stage_id} 缺少 template")
+        inputs = _references(template, stage_ids)
+    elif stage_type == STAGE_MERGE:
+        template = ""
+        inputs = raw.get("inputs")
+        if not isinstance(inputs, list) or not inputs:
+            raise PipelineError(f"merge 阶段 {stage_id} 缺少 inputs")
+    else:
+        source = raw.get("input")
+        if not source:
+            raise PipelineError(f"filter 阶段 {stage_id} 缺少 input")
+        template = "{" + source + "}"
+        inputs = [source]
+
+    for dep in inputs:
+        if dep not in stage_ids:
+            raise PipelineError(f"阶段 {stage_id} 依赖的阶段 {dep} 不存在")
+
+    options = {}
+    if stage_type == STAGE_FILTER:
+        replace = raw.get("replace") or {}
+        if not isinstance(replace, dict):
+            raise PipelineError(f"filter 阶段 {stage_id} 的 replace 必须是对象")
+        max_chars = raw.get("max_chars")
+        if max_chars is not None and (not isinstance(max_chars, int) or max_chars <= 0):
+            raise PipelineError(f"filter 阶段 {stage_id} 的 max_chars 必须是正整数")
+        options = {"replace": replace, "strip": bool(raw.get("strip", True)), "max_chars": max_chars}
+
+    return PipelineStage(
+        id=stage_id,
+        type=stage_type,
+        inputs=tuple(dict.fromkeys(inputs)),
+        template=template,
+        category=raw.get("category"),
+        prompt=raw.get("prompt"),
+        system_prompt=raw.get("system_prompt"),
+        user_prompt=raw.get("user_prompt"),
+        separator=raw.get("separator", "\n\n"),
+        options=options,
+    )
+
+
+def parse_pipeline(workflow_config: Optional[Dict[str, Any]]) -> Optional[Pipeline]:
+    """
+    从 Workflow.config 中读取 pipeline 配置，未配置时返回 None
+
+    Raises:
+        PipelineError: 配置无效（阶段 id 缺失或重复、依赖不存在、存在环等）
+    """
+    config = workflow_config.get("pipeline") if isinstance(workflow_config, dict) else None
+    if config is None:
+        return None
+    raw_stages = config.get("stages") if isinstance(config, dict) else None
+    if not isinstance(raw_stages, list) or not raw_stages:
+        raise PipelineError("pipeline.stages 必须是非空数组")
+
+    stage_ids = []
+    for raw in raw_stages:
+        stage_id = raw.get("id") if isinstance(raw, dict) else None
+        if not isinstance(stage_id, str) or not re.fullmatch(r"\w+", stage_id):
+            raise PipelineError(f"阶段 id 必须是由字母、数字或下划线组成的字符串: {stage_id!r}")
+        if stage_id == USER_MESSAGE or stage_id in stage_ids:
+            raise PipelineError(f"阶段 id 重复或为保留名: {stage_id}")
+        stage_ids.append(stage_id)
+
+    stages = {stage.id: stage for stage in (_parse_stage(raw, stage_ids) for raw in raw_stages)}
+    output = config.get("output") or stage_ids[-1]
+    if output not in stages:
+        raise PipelineError(f"输出阶段 {output} 不存在")
+
+    # 从输出阶段反向做深度优先遍历，得到拓扑序并检查环
+    order: List[str] = []
+    visiting = set()
+
+    def visit(stage_id: str):
+        if stage_id in order:
+            return
+        if stage_id in visiting:
+            raise PipelineError(f"pipeline 存在循环依赖: {stage_id}")
+        visiting.add(stage_id)
+        for dep in stages[stage_id].inputs:
+            visit(dep)
+        visiting.discard(stage_id)
+        order.append(stage_id)
+
+    visit(output)
+    order.remove(output)
+    return Pipeline(stages=stages, order=tuple(order), output=output)
+
+
+def run_transform(stage: PipelineStage, values: Dict[str, str]) -> str:
+    """执行非模型阶段（template / merge / filter）"""
+    if stage.type == STAGE_MERGE:
+        return stage.separator.join(values[dep] for dep in stage.inputs)
+    text = render_template(stage.template, values)
+    if stage.type == STAGE_FILTER:
+        for old, new in stage.options["replace"].items():
+            text = text.replace(old, str(new))
+        if stage.options["strip"]:
+            text = text.strip()
+        if stage.options["max_chars"]:
+            text = text[:stage.options["max_chars"]]
+    return text
@@ -0,0 +1,128 @@
+"""
+同类 provider 的负载均衡
+同一 category 下的多条 LLMProvider 组成一个池，每次调用按以下规则排序候选：
+
+- 得分 = 延迟 EWMA × (进行中请求数 + 1)，得分越低越优先
+- 流式调用的延迟取首 token 时间（TTFT），非流式调用取完整响应时间，两者分开统计
+- is_default_provider 为偏好：非默认 provider 的得分乘以 PROVIDER_NON_DEFAULT_PENALTY
+- 尚无样本的 provider 使用池内已知最小延迟，保证新加入的后端能分到流量
+- 上游故障（连接/传输错误、超时、5xx）时把延迟样本记为 PROVIDER_FAILURE_PENALTY 秒，让其排到后面；
+  4xx 等请求本身的问题不代表 provider 不可用，只记录错误，不影响延迟统计
+
+统计按 provider id 记录在 worker 进程内存中，仅在事件循环线程内使用。
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+PROVIDER_EWMA_ALPHA = float(os.getenv("PROVIDER_EWMA_ALPHA", 0.3))
+PROVIDER_NON_DEFAULT_PENALTY = float(os.getenv("PROVIDER_NON_DEFAULT_PENALTY", 1.5))
+PROVIDER_FAILURE_PENALTY = float(os.getenv("PROVIDER_FAILURE_PENALTY", 30.0))
+# 没有任何样本时假设的延迟（秒）
+PROVIDER_INITIAL_LATENCY = float(os.getenv("PROVIDER_INITIAL_LATENCY", 1.0))
+
+MODE_STREAM = "stream"
+MODE_COMPLETE = "complete"
+
+
+class ProviderStats:
+    """单个 provider 的路由统计"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.outstanding = 0
+        self.ewma: Dict[str, Optional[float]] = {MODE_STREAM: None, MODE_COMPLETE: None}
+        self.requests = 0
+        self.failures = 0
+        self.rejections = 0
+        self.last_error: Optional[str] = None
+        self.last_failure_at: Optional[float] = None
+
+    def observe(self, mode: str, latency: float):
+        current = self.ewma[mode]
+        self.ewma[mode] = latency if current is None else current + PROVIDER_EWMA_ALPHA * (latency - current)
+
+
+class ProviderRouter:
+    """按延迟和负载为同类 provider 排序"""
+
+    def __init__(self):
+        self._stats: Dict[int, ProviderStats] = {}
+
+    def _get(self, provider) -> ProviderStats:
+        stats = self._stats.get(provider.id)
+        if stats is None:
+            stats = self._stats[provider.id] = ProviderStats(provider.name)
+        return stats
+
+    def rank(self, providers: Sequence, mode: str = MODE_STREAM) -> List:
+        """返回按优先级排序的候选 provider"""
+        if len(providers) <= 1:
+            return list(providers)
+        known = [
+            s.ewma[mode] for s in (self._stats.get(p.id) for p in providers)
+            if s is not None and s.ewma[mode] is not None
+        ]
+        baseline = min(known) if known else PROVIDER_INITIAL_LATENCY
+
+        def score(indexed):
+            index, provider = indexed
+            stats = self._stats.get(provider.id)
+            latency = stats.ewma[mode] if stats is not None and stats.ewma[mode] is not None else baseline
+            outstanding = stats.outstanding if stats is not None else 0
+            value = latency * (outstanding + 1)
+            if not provider.is_default_provider:
+                value *= PROVIDER_NON_DEFAULT_PENALTY
+            # 得分相同时保持配置顺序
+            return value, index
+
+        return [p for _, p in sorted(enumerate(providers), key=score)]
+
+    def begin(self, provider) -> float:
+        """开始一次调用，返回开始时间"""
+        stats = self._get(provider)
+        stats.outstanding += 1
+        stats.requests += 1
+        return time.monotonic()
+
+    def first_byte(self, provider, mode: str, started_at: float):
+        """记录首 token（流式）或完整响应（非流式）的延迟样本"""
+        self._get(provider).observe(mode, time.monotonic() - started_at)
+
+    def fail(self, provider, mode: str, error: str):
+        """记录一次上游故障：延迟样本记为惩罚值"""
+        stats = self._get(provider)
+        stats.failures += 1
+        stats.last_error = error
+        stats.last_failure_at = time.time()
+        stats.observe(mode, PROVIDER_FAILURE_PENALTY)
+
+    def reject(self, provider, error: str):
+        """记录一次被上游拒绝的调用（如 4xx）：只记录错误，不记延迟样本"""
+        stats = self._get(provider)
+        stats.rejections += 1
+        stats.last_error = error
+
+    def end(self, provider):
+        """结束一次调用（无论成功与否）"""
+        stats = self._get(provider)
+        stats.outstanding = max(stats.outstanding - 1, 0)
+
+    def get_stats(self) -> Dict[int, Dict[str, Any]]:
+        return {
+            provider_id: {
+                "name": s.name,
+                "outstanding": s.outstanding,
+                "ewma_ttft": round(s.ewma[MODE_STREAM], 4) if s.ewma[MODE_STREAM] is not None else None,
+                "ewma_latency": round(s.ewma[MODE_COMPLETE], 4) if s.ewma[MODE_COMPLETE] is not None else None,
+                "requests": s.requests,
+                "failures": s.failures,
+                "rejections": s.rejections,
+                "last_error": s.last_error,
+                "last_failure_at": s.last_failure_at,
+            }
+            for provider_id, s in self._stats.items()
+        }
+
+
+provider_router = ProviderRouter()
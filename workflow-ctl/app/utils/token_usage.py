@@ -0,0 +1,104 @@
+"""
+上游调用的 token 用量与吞吐计量
+每次上游调用一个 GenerationMeter，记录首 token 时间（TTFT）、生成速率和 token 数。
+
+- 优先使用上游返回的 usage（流式调用通过 stream_options.include_usage 在最后一块返回）
+- 上游没有返回 usage 时按文本本地估算：CJK 字符约 1 token/字，其他字符约 4 字符/token
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+# 本地估算：非 CJK 字符每个 token 的平均字符数
+ESTIMATE_CHARS_PER_TOKEN = 4.0
+# 每条消息的格式开销（role、分隔符等）
+ESTIMATE_MESSAGE_OVERHEAD = 4
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF      # CJK 统一表意文字
+        or 0x3400 <= code <= 0x4DBF   # 扩展 A
+        or 0x3000 <= code <= 0x303F   # CJK 标点
+        or 0xFF00 <= code <= 0xFFEF   # 全角字符
+    )
+
+
+def _count_chars(text: str):
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk, len(text) - cjk
+
+
+def _estimate(cjk: int, other: int) -> int:
+    if not cjk and not other:
+        return 0
+    return max(1, cjk + round(other / ESTIMATE_CHARS_PER_TOKEN))
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """估算一段文本的 token 数"""
+    if not text:
+        return 0
+    return _estimate(*_count_chars(text))
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """估算 chat 消息列表的 prompt token 数"""
+    return sum(estimate_tokens(m.get("content")) + ESTIMATE_MESSAGE_OVERHEAD for m in messages)
+
+
+class GenerationMeter:
+    """单次上游调用的计量"""
+
+    def __init__(self, messages: List[Dict[str, str]], stream: bool = True):
+        self.messages = messages
+        self.stream = stream
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.usage: Dict[str, Any] = {}
+        self._cjk = 0
+        self._other = 0
+
+    def add(self, content: str):
+        """记录一段输出内容"""
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        cjk, other = _count_chars(content)
+        self._cjk += cjk
+        self._other += other
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.monotonic()
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        汇总 token 数、TTFT（秒）和生成速率（completion tokens / 秒）
+
+        流式调用的生成速率按首 token 之后的时间计算（解码速率），
+        非流式调用按整次调用时间计算
+        """
+        self.finish()
+        estimated = not (self.usage.get("prompt_tokens") is not None and self.usage.get("completion_tokens") is not None)
+        if estimated:
+            prompt_tokens = estimate_message_tokens(self.messages)
+            completion_tokens = _estimate(self._cjk, self._other)
+        else:
+            prompt_tokens = int(self.usage["prompt_tokens"])
+            completion_tokens = int(self.usage["completion_tokens"])
+
+        ttft = self.first_token_at - self.started_at if self.first_token_at is not None else None
+        generation_time = self.finished_at - self.started_at
+        if self.stream and self.first_token_at is not None and self.finished_at > self.first_token_at:
+            generation_time = self.finished_at - self.first_token_at
+        tokens_per_second = completion_tokens / generation_time if generation_time > 0 else None
+
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "ttft": round(ttft, 4) if ttft is not None else None,
+            "tokens_per_second": round(tokens_per_second, 2) if tokens_per_second is not None else None,
+            "source": "estimate" if estimated else "upstream",
+        }
@@ -0,0 +1,205 @@
+"""
+并发流容量基准测试
+
+对比两种上游调用模型在单个 worker 内能同时承载的 SSE 流数量：
+- threadpool: 旧实现，requests 同步流式读取，每个流占用一个线程
+  （Starlette 默认线程池上限为 40）
+- async:      新实现，stream_chat_response 异步生成器 + 共享 httpx 连接池
+
+上游为本地模拟的 OpenAI 兼容 SSE 服务，每个流按固定间隔输出 token。
+async 模式下总耗时应接近单个流的耗时，线程数保持不变，
+并发上限只受连接池大小与进程文件描述符上限（socket）约束。
+
+用法:
+    cd workflow-ctl
+    python benchmarks/bench_concurrent_streams.py --streams 40 200 1000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+import requests  # noqa: E402
+
+from app.api.chat import stream_chat_response  # noqa: E402
+from app.storage.config_snapshot import ProviderConfig  # noqa: E402
+from app.utils.http_client import close_http_client  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+STARLETTE_THREADPOOL_LIMIT = 40
+
+
+# ==================== 模拟上游 ====================
+
+def start_fake_upstream(tokens: int, interval: float) -> int:
+    """在后台线程启动模拟的流式上游服务，返回端口号"""
+    ready = threading.Event()
+    holder = {}
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            header = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in header.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            if length:
+                await reader.readexactly(length)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/event-stream\r\n"
+                b"Connection: close\r\n\r\n"
+            )
+            for i in range(tokens):
+                chunk = {"choices": [{"delta": {"content": f"t{i} "}}]}
+                writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await writer.drain()
+                await asyncio.sleep(interval)
+            writer.write(b"data: [DONE]\n\n")
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", 0, backlog=4096))
+        holder["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return holder["port"]
+
+
+# ==================== 采样 ====================
+
+def open_fds() -> int:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+
+class Sampler:
+    """后台采样线程数与文件描述符数的峰值"""
+
+    def __init__(self):
+        self.peak_threads = 0
+        self.peak_fds = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_fds = max(self.peak_fds, open_fds())
+            time.sleep(0.01)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# ==================== 两种模式 ====================
+
+def run_threadpool(api_base: str, streams: int) -> int:
+    """旧模型：同步 requests 流式读取，受线程池大小限制"""
+
+    def one_stream() -> int:
+        response = requests.post(
+            f"{api_base}/chat/completions",
+            json={"model": "bench", "messages": [], "stream": True},
+            stream=True,
+            timeout=None
+        )
+        count = 0
+        for line in response.iter_lines():
+            if line and line != b"data: [DONE]":
+                count += 1
+        return count
+
+    with ThreadPoolExecutor(max_workers=STARLETTE_THREADPOOL_LIMIT) as pool:
+        return sum(pool.map(lambda _: one_stream(), range(streams)))
+
+
+async def run_async(api_base: str, streams: int) -> int:
+    """新模型：异步生成器 + 共享连接池"""
+
+    # 并发上限设为流数，准入控制不参与对比
+    provider = ProviderConfig(
+        id=1, external_id=None, name="bench", provider="vllm", api_key="bench", api_base=api_base,
+        custom_config={"max_concurrency": streams}, default_model_name="bench", fast_default_model_name=None,
+        model_configurations=(), category="general", is_default_provider=True
+    )
+
+    async def one_stream() -> int:
+        count = 0
+        async for event in stream_chat_response(
+            messages=[{"role": "user", "content": "bench"}],
+            providers=[provider]
+        ):
+            if event.startswith("event: message"):
+                count += 1
+        return count
+
+    try:
+        results = await asyncio.gather(*(one_stream() for _ in range(streams)))
+    finally:
+        await close_http_client()
+    return sum(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, nargs="+", default=[40, 200, 1000])
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.05, help="每个 token 的间隔（秒）")
+    parser.add_argument("--skip-threadpool", action="store_true", help="只测试 async 模式")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    port = start_fake_upstream(args.tokens, args.interval)
+    api_base = f"http://127.0.0.1:{port}"
+    single = args.tokens * args.interval
+
+    print(f"单个流理论耗时: {single:.2f}s, RLIMIT_NOFILE={hard}, 线程池上限={STARLETTE_THREADPOOL_LIMIT}")
+    print(f"{'mode':<12}{'streams':>8}{'wall(s)':>10}{'x single':>10}{'tokens':>10}{'threads':>9}{'fds':>8}")
+
+    for streams in args.streams:
+        modes = ["async"] if args.skip_threadpool else ["threadpool", "async"]
+        for mode in modes:
+            with Sampler() as sampler:
+                start = time.perf_counter()
+                if mode == "async":
+                    tokens = asyncio.run(run_async(api_base, streams))
+                else:
+                    tokens = run_threadpool(api_base, streams)
+                wall = time.perf_counter() - start
+            print(
+                f"{mode:<12}{streams:>8}{wall:>10.2f}{wall / single:>10.1f}"
+                f"{tokens:>10}{sampler.peak_threads:>9}{sampler.peak_fds:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+API 密钥加解密单次调用开销基准测试
+
+对比优化前后 encrypt_api_key / decrypt_api_key / is_encrypted 的单次耗时：
+- before: 每次调用都重新执行 100,000 次 PBKDF2-SHA256 派生密钥（旧实现）
+- after:  派生密钥每个进程只计算一次，解密结果按密文缓存，
+          is_encrypted 先按 token 结构判断
+
+用法:
+    cd workflow-ctl
+    python benchmarks/bench_crypto.py --iterations 50
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils import crypto  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+
+def per_call_ms(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    plaintext = "sk-benchmark-0123456789abcdefghijklmnopqrstuvwxyz"
+    token = crypto.encrypt_api_key(plaintext)
+    derive = crypto._get_fernet.__wrapped__  # 未缓存的原始派生函数
+
+    before = {
+        "encrypt_api_key": lambda: derive().encrypt(plaintext.encode()),
+        "decrypt_api_key": lambda: derive().decrypt(token.encode()),
+        "is_encrypted(密文)": lambda: derive().decrypt(token.encode()),
+        "is_encrypted(明文)": lambda: _swallow(lambda: derive().decrypt(plaintext.encode())),
+    }
+    after = {
+        "encrypt_api_key": lambda: crypto.encrypt_api_key(plaintext),
+        "decrypt_api_key": lambda: crypto.decrypt_api_key(token),
+        "is_encrypted(密文)": lambda: crypto.is_encrypted(token),
+        "is_encrypted(明文)": lambda: crypto.is_encrypted(plaintext),
+    }
+
+    print(f"{'call':<22}{'before(ms)':>12}{'after(ms)':>12}{'speedup':>12}")
+    for name in before:
+        b = per_call_ms(before[name], args.iterations)
+        a = per_call_ms(after[name], args.iterations * 100)
+        print(f"{name:<22}{b:>12.3f}{a:>12.4f}{b / a:>11.0f}x")
+
+
+def _swallow(func):
+    try:
+        func()
+    except Exception:
+        pass
+
+
+if __name__ == "__main__":
+    main()
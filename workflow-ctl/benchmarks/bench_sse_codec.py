@@ -0,0 +1,225 @@
+"""
+SSE 编解码基准测试（10k token 输出）
+
+上游为 httpx.MockTransport 模拟的 vLLM 流式响应（不经过网络），
+每个 token 一个 chat.completion.chunk，按 4KB 字节块送达（会切断多字节字符）。
+
+workflow-ctl 的流式输出对比：
+- legacy:        旧实现，aiter_lines 逐行解码 + 每个 token json.dumps 一个 dict + full_content += + done 附带全文
+- codec:         SSEDecoder 字节解析 + 预渲染事件头 + 线性累计，输出与 legacy 逐字节一致
+- codec+frame:   在 codec 基础上按 frame_chars 合并增量
+- codec+frame-full: 再去掉 done 事件中的 full_content
+
+OpenAI 代理（backend/app/api/openai_proxy.py）的 usage 解析对比：
+- legacy:  每个字节块 decode 后 += 到完整文本，结束时整体 split 查找 usage
+- codec:   SSETail 只保留末尾字节，结束时解析并只对含 "usage" 的块做 JSON 解析
+
+用法:
+    cd workflow-ctl
+    python benchmarks/bench_sse_codec.py --tokens 10000 --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+import httpx  # noqa: E402
+
+from app.api import chat  # noqa: E402
+from app.storage.config_snapshot import ProviderConfig  # noqa: E402
+from app.utils import http_client  # noqa: E402
+from app.utils.sse import DONE_PAYLOAD, SSETail  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+CHUNK_BYTES = 4096
+TOKENS = ["新华", "社", "记者", " the", " quick", "，", "经济", "发展", "。", "\n"]
+
+
+# ==================== 模拟上游 ====================
+
+def build_upstream_body(tokens: int) -> bytes:
+    """生成 vLLM 风格的流式响应体"""
+    lines = []
+    for i in range(tokens):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "bench",
+            "choices": [{"index": 0, "delta": {"content": TOKENS[i % len(TOKENS)]}, "finish_reason": None}]
+        }
+        lines.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+    usage = {"prompt_tokens": 100, "completion_tokens": tokens, "total_tokens": 100 + tokens}
+    lines.append(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8")
+
+
+def split_chunks(body: bytes):
+    return [body[i:i + CHUNK_BYTES] for i in range(0, len(body), CHUNK_BYTES)]
+
+
+class ChunkStream(httpx.AsyncByteStream):
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def install_mock_client(chunks):
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, stream=ChunkStream(chunks))
+
+    http_client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+# ==================== workflow-ctl 输出 ====================
+
+async def legacy_stream(messages, api_base, api_key, model, temperature=0.7):
+    """旧实现（改造前的 stream_chat_response 主循环）"""
+    yield chat.generate_sse_event({"type": "start", "message": "开始生成响应..."}, event="start")
+    client = http_client.get_http_client()
+    full_content = ""
+    async with client.stream("POST", f"{api_base}/chat/completions", json={"model": model}) as response:
+        async for line_text in response.aiter_lines():
+            if not line_text.strip() or line_text.strip() == "data: [DONE]":
+                continue
+            if line_text.startswith("data: "):
+                data = json.loads(line_text[6:])
+                if "choices" in data and len(data["choices"]) > 0:
+                    content = data["choices"][0].get("delta", {}).get("content", "")
+                    if content:
+                        full_content += content
+                        event_data = json.dumps({"type": "content", "content": content}, ensure_ascii=False)
+                        yield f"event: message\ndata: {event_data}\n\n"
+    event_data = json.dumps(
+        {"type": "done", "message": "响应生成完成", "full_content": full_content},
+        ensure_ascii=False
+    )
+    yield f"event: done\ndata: {event_data}\n\n"
+
+
+async def consume(events):
+    count = 0
+    size = 0
+    output = []
+    async for event in events:
+        count += 1
+        size += len(event.encode("utf-8"))
+        output.append(event)
+    return count, size, "".join(output)
+
+
+BENCH_PROVIDER = ProviderConfig(
+    id=1, external_id=None, name="bench", provider="vllm", api_key=None, api_base="http://bench",
+    custom_config={}, default_model_name="bench", fast_default_model_name=None,
+    model_configurations=(), category="general", is_default_provider=True
+)
+
+
+def strip_stage_events(output: str) -> str:
+    """去掉 legacy 实现中没有的 stage 进度事件（如 admitted）"""
+    return "".join(e + "\n\n" for e in output.split("\n\n") if e and not e.startswith("event: stage"))
+
+
+def workflow_modes(frame_chars: int):
+    args = dict(messages=[], providers=[BENCH_PROVIDER])
+    return {
+        "legacy": lambda: legacy_stream([], "http://bench", "bench", "bench"),
+        "codec": lambda: chat.stream_chat_response(**args),
+        "codec+frame": lambda: chat.stream_chat_response(**args, frame_chars=frame_chars),
+        "codec+frame-full": lambda: chat.stream_chat_response(
+            **args, frame_chars=frame_chars, include_full_content=False
+        ),
+    }
+
+
+async def bench_workflow(chunks, repeat: int, frame_chars: int):
+    install_mock_client(chunks)
+    results = {}
+    for name, factory in workflow_modes(frame_chars).items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count, size, output = await consume(factory())
+            best = min(best, time.perf_counter() - start)
+        results[name] = (best, count, size, output)
+    await http_client.close_http_client()
+    return results
+
+
+# ==================== OpenAI 代理 usage 解析 ====================
+
+def proxy_legacy(chunks):
+    full_response_content = ""
+    for chunk in chunks:
+        full_response_content += chunk.decode("utf-8", errors="ignore")
+    final_data = {}
+    for line in reversed(full_response_content.strip().split("\n\n")):
+        if line.startswith("data: "):
+            content = line[len("data: "):].strip()
+            if content and content != "[DONE]":
+                final_data = json.loads(content)
+                break
+    return final_data.get("usage")
+
+
+def proxy_codec(chunks):
+    tail = SSETail()
+    for chunk in chunks:
+        tail.feed(chunk)
+    usage = None
+    for payload in tail.events():
+        if '"usage"' in payload and payload != DONE_PAYLOAD:
+            usage = json.loads(payload).get("usage") or usage
+    return usage
+
+
+def bench_proxy(chunks, repeat: int):
+    results = {}
+    for name, fn in (("legacy", proxy_legacy), ("codec", proxy_codec)):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            usage = fn(chunks)
+            best = min(best, time.perf_counter() - start)
+        results[name] = (best, usage)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--frame-chars", type=int, default=64)
+    args = parser.parse_args()
+
+    body = build_upstream_body(args.tokens)
+    chunks = split_chunks(body)
+    print(f"上游响应: {args.tokens} tokens, {len(body) / 1024:.0f} KB, {len(chunks)} 个字节块")
+
+    print("\nworkflow-ctl 流式输出")
+    print(f"{'mode':<18}{'ms':>10}{'us/token':>10}{'events':>9}{'out KB':>9}")
+    results = asyncio.run(bench_workflow(chunks, args.repeat, args.frame_chars))
+    for name, (best, count, size, _) in results.items():
+        print(f"{name:<18}{best * 1000:>10.1f}{best * 1e6 / args.tokens:>10.2f}{count:>9}{size / 1024:>9.0f}")
+    identical = results["legacy"][3] == strip_stage_events(results["codec"][3])
+    print(f"codec 与 legacy 输出逐字节一致（不含 stage 事件）: {identical}")
+
+    print("\nOpenAI 代理 usage 解析")
+    print(f"{'mode':<18}{'ms':>10}  usage")
+    for name, (best, usage) in bench_proxy(chunks, args.repeat).items():
+        print(f"{name:<18}{best * 1000:>10.1f}  {usage}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 import os
 
 from app.database.database import engine, Base, get_db
-from app.api import apikey, workflow, prompt, model_parameter, llm_provider, chat, sensitive_word
+from app.api import apikey, workflow, prompt, model_parameter, llm_provider, chat, chat_jobs, chat_sessions, sensitive_word
 from app.middleware.auth import auth_middleware
+from app.utils.http_client import get_http_client, close_http_client
+from app.storage.config_snapshot import reload_config_snapshot
+from app.storage.chat_log_shipper import chat_log_shipper
+from app.storage.chat_jobs import chat_jobs as chat_job_manager
 import time
 
 # 加载环境变量
@@ -14,7 +19,22 @@ load_dotenv()
 # 创建数据库表
 Base.metadata.create_all(bind=engine)
 
+# 应用生命周期管理
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用启动时创建上游 HTTP 连接池、加载配置快照并启动日志发送器和异步任务执行器，关闭时清理资源"""
+    get_http_client()
+    reload_config_snapshot()
+    chat_log_shipper.start()
+    chat_job_manager.start(chat_jobs.create_job_events)
+    yield
+    # 先停止任务执行器：执行中的任务放回队列，中止日志仍可交给日志发送器
+    await chat_job_manager.stop()
+    await chat_log_shipper.stop()
+    await close_http_client()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Workflow Control API",
     description="工作流控制服务 - 提供 API Key 认证和配置存储",
     version="1.0.0",
@@ -75,6 +95,8 @@ app.include_router(workflow.router, prefix="/api/workflows", tags=["流程配置
 app.include_router(prompt.router, prefix="/api/prompts", tags=["Prompt 配置"])
 app.include_router(model_parameter.router, prefix="/api/model-parameters", tags=["模型参数配置"])
 app.include_router(llm_provider.router, prefix="/api/llm-providers", tags=["LLM Provider 配置"])
+app.include_router(chat_jobs.router, prefix="/api/chat/jobs", tags=["异步聊天任务"])
+app.include_router(chat_sessions.router, prefix="/api/chat/sessions", tags=["多轮会话"])
 app.include_router(chat.router, prefix="/api/chat", tags=["流式聊天"])
 app.include_router(sensitive_word.router, prefix="/api/sensitive-words", tags=["违禁词管理"])
 
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from app.utils.admission import AdmissionController, AdmissionRejected
+
+
+async def test_queued_requests_round_robin_across_tenants():
+    controller = AdmissionController("upstream", max_concurrency=1, max_queue=10, queue_timeout=5)
+    await controller.acquire("a")
+    order = []
+
+    async def request(tenant, name):
+        await controller.acquire(tenant)
+        order.append(name)
+
+    # 租户 a 先排入三个请求，b 和 c 各一个
+    tasks = []
+    for tenant, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("c", "c1")]:
+        tasks.append(asyncio.ensure_future(request(tenant, name)))
+        await asyncio.sleep(0)
+    assert controller.waiting == 5
+
+    for _ in tasks:
+        controller.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+
+async def test_cancelled_waiter_leaves_queue_and_granted_slot_is_returned():
+    controller = AdmissionController("upstream", max_concurrency=1, max_queue=10, queue_timeout=5)
+
+    # 排队中被取消：移出队列
+    await controller.acquire("a")
+    waiter = asyncio.ensure_future(controller.acquire("b"))
+    await asyncio.sleep(0)
+    assert controller.waiting == 1
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert controller.waiting == 0
+    controller.release()
+    assert controller.active == 0
+
+    # 已分配到名额但在恢复执行前被取消：名额归还
+    await controller.acquire("a")
+    waiter = asyncio.ensure_future(controller.acquire("b"))
+    await asyncio.sleep(0)
+    controller.release()
+    assert controller.active == 1
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert controller.active == 0 and controller.waiting == 0
+
+
+async def test_slot_released_when_holder_cancelled():
+    controller = AdmissionController("upstream", max_concurrency=1, max_queue=10, queue_timeout=5)
+
+    async def hold():
+        async with controller.slot("a"):
+            await asyncio.sleep(10)
+
+    holder = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+    assert controller.active == 1
+    holder.cancel()
+    await asyncio.gather(holder, return_exceptions=True)
+    assert controller.active == 0
+
+
+async def test_rejects_when_queue_full_or_wait_times_out():
+    controller = AdmissionController("upstream", max_concurrency=1, max_queue=1, queue_timeout=0.05)
+    await controller.acquire("a")
+    waiter = asyncio.ensure_future(controller.acquire("b"))
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected):
+        await controller.acquire("c")
+    with pytest.raises(AdmissionRejected):
+        await waiter
+    stats = controller.get_stats()
+    assert (stats["rejected"], stats["timeouts"], stats["waiting"]) == (1, 1, 0)
@@ -0,0 +1,263 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import chat_jobs as chat_jobs_api
+from app.api.chat_jobs import cancel_chat_job, create_job_events
+from app.models.chat_job import ChatJob, ChatJobEvent
+from app.storage import chat_jobs as chat_jobs_module
+from app.storage.chat_jobs import (
+    CANCEL_REASON_CANCELLED, CHAT_JOB_LEASE_SECONDS, CHAT_JOB_MAX_ATTEMPTS, CHAT_JOB_RETENTION,
+    ChatJobManager, _parse_event, current_job
+)
+from app.utils.sse import encode_event
+
+EVENTS = [
+    encode_event({"type": "start"}, event="start"),
+    encode_event({"type": "content", "content": "你好"}),
+    encode_event({"type": "content", "content": "世界"}),
+    encode_event({"type": "done", "full_content": "你好世界"}, event="done"),
+]
+
+
+@pytest.fixture
+def db(session_factory, monkeypatch):
+    monkeypatch.setattr(chat_jobs_module, "SessionLocal", session_factory)
+    monkeypatch.setattr(chat_jobs_module, "CHAT_JOB_FLUSH_INTERVAL", 0.01)
+    monkeypatch.setattr(chat_jobs_module, "CHAT_JOB_RETRY_DELAY", 0.01)
+    return session_factory
+
+
+def add_job(db, job_id, status="queued", attempts=0, heartbeat_age=None, finished_age=None, events=()):
+    now = datetime.now()
+    session = db()
+    session.add(ChatJob(
+        id=job_id, tenant=1, request={"user_message": "hi"}, status=status, attempts=attempts,
+        worker="other:1" if status == "running" else None,
+        heartbeat_at=now - timedelta(seconds=heartbeat_age) if heartbeat_age is not None else None,
+        finished_at=now - timedelta(seconds=finished_age) if finished_age is not None else None,
+    ))
+    for seq, data in enumerate(events, 1):
+        session.add(ChatJobEvent(job_id=job_id, seq=seq, data=data))
+    session.commit()
+    session.close()
+
+
+def job_row(db, job_id):
+    session = db()
+    try:
+        job = session.query(ChatJob).filter(ChatJob.id == job_id).first()
+        return None if job is None else SimpleNamespace(
+            status=job.status, worker=job.worker, error=job.error, result=job.result, attempts=job.attempts
+        )
+    finally:
+        session.close()
+
+
+def event_seqs(db, job_id):
+    session = db()
+    try:
+        rows = session.query(ChatJobEvent.seq).filter(ChatJobEvent.job_id == job_id).order_by(ChatJobEvent.seq)
+        return [row.seq for row in rows]
+    finally:
+        session.close()
+
+
+def manager_with(factory):
+    manager = ChatJobManager()
+    manager._factory = factory
+    return manager
+
+
+async def fixed_events(request, tenant):
+    for event in EVENTS:
+        yield event
+
+
+def test_expired_lease_requeued(db):
+    add_job(db, "stale", status="running", attempts=1, heartbeat_age=CHAT_JOB_LEASE_SECONDS * 2)
+    add_job(db, "alive", status="running", attempts=1, heartbeat_age=0)
+
+    assert ChatJobManager()._recover_expired() == (1, 0)
+    stale = job_row(db, "stale")
+    assert (stale.status, stale.worker) == ("queued", None)
+    assert job_row(db, "alive").status == "running"
+
+
+def test_expired_lease_fails_after_max_attempts(db):
+    add_job(db, "exhausted", status="running", attempts=CHAT_JOB_MAX_ATTEMPTS, heartbeat_age=CHAT_JOB_LEASE_SECONDS * 2)
+
+    assert ChatJobManager()._recover_expired() == (0, 1)
+    job = job_row(db, "exhausted")
+    assert job.status == "failed"
+    assert str(CHAT_JOB_MAX_ATTEMPTS) in job.error
+
+
+def test_claim_is_exclusive(db):
+    add_job(db, "job")
+    first, second = ChatJobManager(), ChatJobManager()
+    second.worker_id = "other:2"
+
+    request, tenant, events, seq, attempts = first._claim("job")
+    assert (request, tenant, events, seq, attempts) == ({"user_message": "hi"}, 1, "", 0, 1)
+    assert second._claim("job") is None
+    assert job_row(db, "job").worker == first.worker_id
+
+
+async def test_completed_job_replays_from_start(db):
+    manager = manager_with(fixed_events)
+    job = await manager.submit({"user_message": "hi"}, tenant=1)
+    await manager._execute(job["id"])
+
+    stored = await manager.get(job["id"])
+    assert (stored["status"], stored["result"], stored["attempts"]) == ("completed", "你好世界", 1)
+    # 已结束的任务从数据库回放，每次都从第一个事件开始
+    for _ in range(2):
+        assert "".join([event async for event in manager.subscribe(job["id"])]) == "".join(EVENTS)
+
+
+async def test_restarted_job_appends_after_prior_events(db):
+    add_job(db, "job", attempts=1, events=[EVENTS[0], EVENTS[1]])
+    manager = manager_with(fixed_events)
+    await manager._execute("job")
+
+    replay = "".join([event async for event in manager.subscribe("job")])
+    prior, restarted, rest = replay.partition('"status": "restarted"')
+    assert prior.startswith(EVENTS[0] + EVENTS[1]) and restarted
+    assert rest.endswith("".join(EVENTS))
+    # 之前的事件只保留一份（第一段），新事件追加为后续段
+    assert event_seqs(db, "job")[0] == 1 and len(event_seqs(db, "job")) >= 2
+    assert job_row(db, "job").attempts == 2
+
+
+async def test_cancel_running_job(db):
+    reasons = []
+
+    async def slow_events(request, tenant):
+        yield EVENTS[0]
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            reasons.append(current_job.get().cancel_reason)
+            raise
+        yield EVENTS[-1]
+
+    manager = manager_with(slow_events)
+    job = await manager.submit({"user_message": "hi"}, tenant=1)
+    execution = asyncio.ensure_future(manager._execute(job["id"]))
+    while job["id"] not in manager._live:
+        await asyncio.sleep(0.01)
+
+    assert await manager.cancel(job["id"])
+    await execution
+    assert reasons == [CANCEL_REASON_CANCELLED]
+    assert job_row(db, job["id"]).status == "cancelled"
+    # 取消前发出的事件仍可回放
+    assert "".join([event async for event in manager.subscribe(job["id"])]).startswith(EVENTS[0])
+    assert not await manager.cancel(job["id"])
+
+
+async def test_cancel_finished_job_returns_409(db):
+    add_job(db, "done", status="completed", finished_age=0)
+    with pytest.raises(HTTPException) as exc:
+        await cancel_chat_job("done", api_key=SimpleNamespace(id=1))
+    assert exc.value.status_code == 409
+
+    # 其他租户的任务按不存在处理
+    with pytest.raises(HTTPException) as exc:
+        await cancel_chat_job("done", api_key=SimpleNamespace(id=2))
+    assert exc.value.status_code == 404
+
+
+def test_retention_sweep(db):
+    add_job(db, "old", status="completed", finished_age=CHAT_JOB_RETENTION * 2, events=["a", "b"])
+    add_job(db, "recent", status="failed", finished_age=0, events=["c"])
+    add_job(db, "running", status="running", attempts=1, heartbeat_age=0, events=["d"])
+
+    assert ChatJobManager()._cleanup() == 1
+    assert job_row(db, "old") is None and event_seqs(db, "old") == []
+    assert job_row(db, "recent").status == "failed" and event_seqs(db, "recent") == [1]
+    assert job_row(db, "running").status == "running"
+
+
+def unavailable(code, retry_after=0):
+    return encode_event(
+        {"type": "error", "code": code, "retry_after": retry_after, "message": "上游繁忙"}, event="error"
+    )
+
+
+async def replayed(manager, job_id):
+    """回放任务事件流并逐个解析（数据库中的一段可能包含多个事件）"""
+    stream = "".join([chunk async for chunk in manager.subscribe(job_id)])
+    return [_parse_event(event) for event in stream.split("\n\n") if event]
+
+
+async def test_unavailable_upstream_retried_after_delay(db):
+    calls = []
+
+    async def busy_then_ok(request, tenant):
+        calls.append(1)
+        if len(calls) == 1:
+            yield EVENTS[0]
+            yield unavailable(429)
+            return
+        for event in EVENTS:
+            yield event
+
+    manager = manager_with(busy_then_ok)
+    job = await manager.submit({"user_message": "hi"}, tenant=1)
+    await manager._execute(job["id"])
+
+    stored = job_row(db, job["id"])
+    assert (stored.status, stored.result, stored.attempts) == ("completed", "你好世界", 2)
+    events = await replayed(manager, job["id"])
+    waiting = [e for e in events if e.get("status") == "waiting"]
+    assert len(waiting) == 1 and waiting[0]["code"] == 429 and waiting[0]["attempt"] == 2
+    # 暂时不可用的 error 事件不发送给订阅者
+    assert not [e for e in events if e.get("type") == "error"]
+    assert manager.get_stats()["retried"] == 1
+
+
+async def test_unavailable_upstream_fails_after_max_attempts(db, monkeypatch):
+    monkeypatch.setattr(chat_jobs_module, "CHAT_JOB_MAX_ATTEMPTS", 2)
+
+    async def always_unavailable(request, tenant):
+        yield unavailable(503)
+
+    manager = manager_with(always_unavailable)
+    job = await manager.submit({"user_message": "hi"}, tenant=1)
+    await manager._execute(job["id"])
+
+    stored = job_row(db, job["id"])
+    assert (stored.status, stored.attempts) == ("failed", 2)
+    assert "上游繁忙" in stored.error
+    events = await replayed(manager, job["id"])
+    assert [e["type"] for e in events] == ["stage", "error"]
+
+
+async def test_error_after_content_or_not_retryable_fails(db):
+    async def content_then_busy(request, tenant):
+        yield EVENTS[1]
+        yield unavailable(429)
+
+    async def not_found(request, tenant):
+        yield encode_event({"type": "error", "code": 404, "message": "workflow 不存在"}, event="error")
+
+    for factory in (content_then_busy, not_found):
+        manager = manager_with(factory)
+        job = await manager.submit({"user_message": "hi"}, tenant=1)
+        await manager._execute(job["id"])
+        stored = job_row(db, job["id"])
+        assert (stored.status, stored.attempts) == ("failed", 1)
+
+
+async def test_admission_rejection_carries_retry_after(monkeypatch):
+    def reject(request, **kwargs):
+        raise HTTPException(status_code=429, detail="上游繁忙", headers={"Retry-After": "3"})
+
+    monkeypatch.setattr(chat_jobs_api, "prepare_chat_generation", reject)
+    events = [_parse_event(e) async for e in create_job_events({"user_message": "hi"}, tenant=1)]
+    assert events == [{"type": "error", "code": 429, "message": "上游繁忙", "retry_after": 3}]
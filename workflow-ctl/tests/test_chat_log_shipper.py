@@ -0,0 +1,122 @@
+import json
+
+import httpx
+import pytest
+
+from app.storage import chat_log_shipper as shipper_module
+from app.storage.chat_log_shipper import ATTEMPTS_KEY, ChatLogShipper
+
+
+class FakeBackend:
+    """模拟 Backend 批量写入接口：按 status 返回，或对含 bad 字段的批次返回 422"""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.batches = []
+
+    def handle(self, request):
+        items = json.loads(request.content)["items"]
+        self.batches.append(items)
+        if self.status != 200:
+            return httpx.Response(self.status)
+        if any(item.get("bad") for item in items):
+            return httpx.Response(422, text="invalid")
+        return httpx.Response(200, json={"accepted": len(items), "rejected": 0, "errors": []})
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    backend = FakeBackend()
+    client = httpx.AsyncClient(transport=httpx.MockTransport(backend.handle))
+    monkeypatch.setattr(shipper_module, "data_dir", tmp_path)
+    monkeypatch.setattr(shipper_module, "get_http_client", lambda: client)
+    return backend
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def records(count, **extra):
+    return [{"id": i, **extra} for i in range(count)]
+
+
+async def test_retryable_failure_spooled_then_replayed(backend):
+    shipper = ChatLogShipper()
+    backend.status = 503
+    assert not await shipper._flush(records(2))
+    assert [r[ATTEMPTS_KEY] for r in read_lines(shipper.spool_path)] == [1, 1]
+
+    backend.status = 200
+    await shipper._replay_spool()
+    assert backend.batches[-1] == records(2)
+    assert not shipper.spool_path.exists()
+    stats = shipper.get_stats()
+    assert (stats["spooled"], stats["replayed"], stats["failed_batches"]) == (2, 2, 1)
+
+
+async def test_replay_failure_keeps_unsent_records(backend, monkeypatch):
+    monkeypatch.setattr(shipper_module, "CHAT_LOG_BATCH_SIZE", 2)
+    shipper = ChatLogShipper()
+    shipper._spool(records(5))
+
+    backend.status = 502
+    await shipper._replay_spool()
+    # 第一批计一次失败，其余未发送的原样写回
+    assert [r.get(ATTEMPTS_KEY) for r in read_lines(shipper.spool_path)] == [1, 1, None, None, None]
+    assert len(backend.batches) == 1
+
+
+async def test_permanent_failure_dead_letters_only_bad_record(backend):
+    shipper = ChatLogShipper()
+    batch = records(4)
+    batch[2]["bad"] = True
+
+    assert await shipper._flush(batch)
+    assert not shipper.spool_path.exists()
+    dead = read_lines(shipper.dead_letter_path)
+    assert [d["record"]["id"] for d in dead] == [2]
+    assert "422" in dead[0]["reason"]
+    stats = shipper.get_stats()
+    assert (stats["delivered"], stats["dead_lettered"]) == (3, 1)
+    assert stats["dead_letter_bytes"] > 0
+
+
+async def test_attempt_cap_dead_letters(backend, monkeypatch):
+    monkeypatch.setattr(shipper_module, "CHAT_LOG_SPOOL_MAX_ATTEMPTS", 2)
+    shipper = ChatLogShipper()
+    shipper._spool([{"id": 0, ATTEMPTS_KEY: 1}, {"id": 1}])
+
+    backend.status = 429
+    await shipper._replay_spool()
+    assert [r["id"] for r in read_lines(shipper.spool_path)] == [1]
+    assert [d["record"]["id"] for d in read_lines(shipper.dead_letter_path)] == [0]
+
+
+def test_spool_size_limit_drops(backend, monkeypatch):
+    monkeypatch.setattr(shipper_module, "CHAT_LOG_SPOOL_MAX_BYTES", 10)
+    shipper = ChatLogShipper()
+    shipper._spool(records(3))
+    assert not shipper.spool_path.exists()
+    assert shipper.get_stats()["dropped"] == 3
+
+
+async def test_queue_full_spools_off_event_loop(backend, monkeypatch):
+    monkeypatch.setattr(shipper_module, "CHAT_LOG_QUEUE_SIZE", 2)
+    monkeypatch.setattr(shipper_module, "CHAT_LOG_REPLAY_INTERVAL", 1e9)
+    shipper = ChatLogShipper()
+    for record in records(5):
+        shipper.submit(record)
+
+    # 队列满的日志交给落盘任务，submit 本身不写文件；落盘缓冲也满时丢弃
+    assert not shipper.spool_path.exists()
+    assert [r["id"] for r in shipper._overflow] == [2, 3]
+    assert shipper.get_stats()["dropped"] == 1
+
+    await shipper._overflow_task
+    assert [r["id"] for r in read_lines(shipper.spool_path)] == [2, 3]
+
+    await shipper.stop()
+    stats = shipper.get_stats()
+    assert (stats["delivered"], stats["spooled"], stats["queue_depth"]) == (2, 2, 0)
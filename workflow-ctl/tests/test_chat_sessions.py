@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import chat
+from app.models.chat_session import ChatSession
+from app.storage import chat_sessions as chat_sessions_module
+from app.storage.chat_sessions import CHAT_SESSION_IDLE_TTL, chat_sessions, trim_history
+from app.storage.single_flight import SingleFlightGroup
+from app.utils.sse import encode_event
+
+
+@pytest.fixture
+def db(session_factory, monkeypatch):
+    monkeypatch.setattr(chat_sessions_module, "SessionLocal", session_factory)
+    return session_factory
+
+
+def make_turns(*tokens):
+    return [{"user_message": f"q{i}", "reply": f"a{i}", "tokens": t} for i, t in enumerate(tokens)]
+
+
+def test_trim_keeps_most_recent_turns_within_budget():
+    messages, info = trim_history(make_turns(10, 20, 30, 40), max_tokens=75, max_turns=10)
+    # 从最近一轮往前选：40 + 30 = 70，再加 20 超出预算
+    assert info == {"turns": 2, "tokens": 70, "trimmed": 2}
+    assert messages == [
+        {"role": "user", "content": "q2"}, {"role": "assistant", "content": "a2"},
+        {"role": "user", "content": "q3"}, {"role": "assistant", "content": "a3"},
+    ]
+
+
+def test_trim_stops_at_first_turn_over_budget():
+    # 更早的轮次即使放得下也不再选取，保证历史连续
+    messages, info = trim_history(make_turns(5, 100, 5), max_tokens=50, max_turns=10)
+    assert info == {"turns": 1, "tokens": 5, "trimmed": 2}
+    assert [m["content"] for m in messages] == ["q2", "a2"]
+
+
+def test_trim_respects_max_turns():
+    _, info = trim_history(make_turns(1, 1, 1, 1), max_tokens=1000, max_turns=3)
+    assert info == {"turns": 3, "tokens": 3, "trimmed": 1}
+    assert trim_history([], max_tokens=10, max_turns=10) == ([], {"turns": 0, "tokens": 0, "trimmed": 0})
+
+
+async def test_session_owned_by_tenant(db):
+    session = await chat_sessions.create(tenant=1, workflow_id="wf")
+    assert (await chat_sessions.get(session["id"], tenant=1))["workflow_id"] == "wf"
+    assert await chat_sessions.get(session["id"], tenant=2) is None
+    assert not await chat_sessions.delete(session["id"], tenant=2)
+
+    request = chat.ChatRequest(user_message="hi", session_id=session["id"])
+    with pytest.raises(HTTPException) as exc:
+        await chat.load_chat_session(request, tenant=2)
+    assert exc.value.status_code == 404
+    assert (await chat.load_chat_session(request, tenant=1))["id"] == session["id"]
+
+
+async def test_idle_session_expires(db):
+    session = await chat_sessions.create(tenant=1)
+    with db() as s:
+        s.query(ChatSession).filter(ChatSession.id == session["id"]).update({
+            ChatSession.last_active_at: datetime.now() - timedelta(seconds=CHAT_SESSION_IDLE_TTL + 1)
+        })
+        s.commit()
+    assert await chat_sessions.get(session["id"], tenant=1) is None
+
+
+async def test_history_returned_in_order(db):
+    session = await chat_sessions.create(tenant=1)
+    for i in range(3):
+        assert await chat_sessions.append(session["id"], f"q{i}", f"a{i}")
+
+    loaded = await chat_sessions.get(session["id"], tenant=1, limit=2)
+    assert loaded["turns"] == 3
+    assert [turn["user_message"] for turn in loaded["history"]] == ["q1", "q2"]
+    assert all(turn["tokens"] > 0 for turn in loaded["history"])
+
+    assert await chat_sessions.delete(session["id"], tenant=1)
+    assert not await chat_sessions.append(session["id"], "q", "a")
+
+
+async def test_coalesced_request_appends_one_turn(db):
+    session = await chat_sessions.create(tenant=1)
+    log_info = {"workflow_type": "proprietary->general", "general_response": "回复"}
+
+    async def generation():
+        yield encode_event({"type": "content", "content": "回复"})
+        yield encode_event({"type": "done", "full_content": "回复"}, event="done")
+
+    def create_events():
+        return chat.record_session_turn(generation(), session["id"], "问题", log_info)
+
+    group = SingleFlightGroup()
+    flight, _ = group.join_or_start("k", create_events, window=10)
+    leader = flight.subscribe()
+    first = await leader.__anext__()
+    joined, is_leader = group.join_or_start("k", create_events, window=10)
+    assert not is_leader
+    follower = [event async for event in joined.subscribe()]
+    assert follower == [first] + [event async for event in leader]
+
+    loaded = await chat_sessions.get(session["id"], tenant=1)
+    assert loaded["turns"] == 1
+    assert [(t["user_message"], t["reply"]) for t in loaded["history"]] == [("问题", "回复")]
@@ -0,0 +1,80 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app.api import chat
+from app.utils.chunking import split_paragraphs
+
+PROMPT = SimpleNamespace(system_prompt="", user_prompt="{user_message}")
+CHUNK_CONFIG = {"max_chars": 8, "concurrency": 4, "separator": "\n"}
+
+
+def test_short_text_is_single_chunk():
+    assert split_paragraphs("短文本", 100) == ["短文本"]
+    assert split_paragraphs("任意长度" * 50, 0) == ["任意长度" * 50]
+
+
+def test_chunks_keep_order_and_respect_max_chars():
+    paragraphs = [f"第{i}段" + "字" * 30 for i in range(10)]
+    text = "\n\n".join(paragraphs)
+    chunks = split_paragraphs(text, 80)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 80 for chunk in chunks)
+    # 块内保留原有换行，按顺序拼回即得到原文
+    assert "\n\n".join(chunks) == text
+
+
+def test_long_paragraph_split_at_sentence_end():
+    sentences = [f"这是第{i}句话。" for i in range(20)]
+    chunks = split_paragraphs("".join(sentences), 30)
+
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert all(chunk.endswith("。") for chunk in chunks)
+    assert "".join(chunks) == "".join(sentences)
+
+
+def test_overlong_sentence_hard_split():
+    chunks = split_paragraphs("字" * 25, 10)
+    assert chunks == ["字" * 10, "字" * 10, "字" * 5]
+
+
+async def test_chunk_results_merged_in_source_order(monkeypatch):
+    async def fake_provider_call(providers, messages, tenant, stream=False, params=None, route=None):
+        content = messages[-1]["content"]
+        # 越靠前的块越晚完成
+        await asyncio.sleep(0.05 * (3 - int(content[-1])))
+        yield content.upper()
+
+    monkeypatch.setattr(chat, "iter_provider_call", fake_provider_call)
+    chunked = chat.build_chunked_messages(PROMPT, "chunk0\n\nchunk1\n\nchunk2\n\nchunk3", "", CHUNK_CONFIG)
+    assert chunked["chars"] == [6, 6, 6, 6]
+
+    results = [None] * 4
+    params = {}
+    events = [event async for event in chat.iter_chunked_provider_calls([], chunked, None, params, results)]
+
+    completed = [json.loads(event.split("data: ", 1)[1])["index"] for event in events]
+    assert completed == [3, 2, 1, 0]
+    assert results == ["CHUNK0", "CHUNK1", "CHUNK2", "CHUNK3"]
+    assert chunked["separator"].join(results) == "CHUNK0\nCHUNK1\nCHUNK2\nCHUNK3"
+    assert [chunk["status"] for chunk in params["chunks"]] == ["completed"] * 4
+
+
+async def test_chunk_failure_cancels_remaining(monkeypatch):
+    async def fake_provider_call(providers, messages, tenant, stream=False, params=None, route=None):
+        if messages[-1]["content"].endswith("1"):
+            raise RuntimeError("上游失败")
+        await asyncio.sleep(10)
+        yield "never"
+
+    monkeypatch.setattr(chat, "iter_provider_call", fake_provider_call)
+    chunked = chat.build_chunked_messages(PROMPT, "chunk0\n\nchunk1\n\nchunk2", "", CHUNK_CONFIG)
+
+    params = {}
+    with pytest.raises(RuntimeError):
+        async for _ in chat.iter_chunked_provider_calls([], chunked, None, params, [None] * 3):
+            pass
+    assert [chunk["status"] for chunk in params["chunks"]] == ["aborted", "failed", "aborted"]
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from app.utils.circuit_breaker import (
+    STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, CircuitOpenError
+)
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold):
+        breaker.acquire()
+        breaker.on_failure("boom")
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("upstream", threshold=3, cooldown=30, probes=1)
+    breaker.on_failure("boom")
+    breaker.on_failure("boom")
+    breaker.on_success()
+    breaker.on_failure("boom")
+    breaker.on_failure("boom")
+    assert breaker.state == STATE_CLOSED
+
+    breaker.on_failure("boom")
+    assert breaker.state == STATE_OPEN
+    assert not breaker.available()
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.acquire()
+    assert exc.value.retry_after >= 1
+
+
+def test_half_open_probe_success_closes():
+    breaker = CircuitBreaker("upstream", threshold=2, cooldown=30, probes=1)
+    open_breaker(breaker)
+    breaker.opened_at = time.monotonic() - 31
+
+    assert breaker.available()
+    assert breaker.acquire() is True
+    assert breaker.state == STATE_HALF_OPEN
+    # 探测名额已占满，其他请求仍被拒绝
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+    breaker.on_success(probe=True)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.acquire() is False
+
+
+def test_half_open_probe_failure_reopens():
+    breaker = CircuitBreaker("upstream", threshold=2, cooldown=30, probes=1)
+    open_breaker(breaker)
+    breaker.opened_at = time.monotonic() - 31
+
+    assert breaker.acquire() is True
+    breaker.on_failure("still down", probe=True)
+    assert breaker.state == STATE_OPEN
+    assert breaker.probing == 0
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+
+def test_cancelled_probe_returns_its_slot():
+    breaker = CircuitBreaker("upstream", threshold=1, cooldown=30, probes=1)
+    open_breaker(breaker)
+    breaker.opened_at = time.monotonic() - 31
+
+    assert breaker.acquire() is True
+    breaker.on_cancel(probe=True)
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.acquire() is True
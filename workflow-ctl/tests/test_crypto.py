@@ -0,0 +1,75 @@
+import pytest
+
+from app.utils import crypto
+
+
+@pytest.fixture(autouse=True)
+def empty_decrypt_cache():
+    crypto.clear_decrypt_cache()
+    yield
+    crypto.clear_decrypt_cache()
+
+
+def count_fernet_calls(monkeypatch):
+    calls = []
+    fernet = crypto._get_fernet()
+
+    def get_fernet():
+        calls.append(1)
+        return fernet
+
+    monkeypatch.setattr(crypto, "_get_fernet", get_fernet)
+    return calls
+
+
+def test_derived_key_computed_once():
+    crypto._get_fernet.cache_clear()
+    first = crypto._get_fernet()
+    assert crypto._get_fernet() is first
+    info = crypto._get_fernet.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+
+
+def test_decrypt_result_cached_by_ciphertext(monkeypatch):
+    encrypted = crypto.encrypt_api_key("sk-test")
+    calls = count_fernet_calls(monkeypatch)
+
+    assert crypto.decrypt_api_key(encrypted) == "sk-test"
+    assert crypto.decrypt_api_key(encrypted) == "sk-test"
+    assert len(calls) == 1
+
+    # 清空缓存后重新解密
+    crypto.clear_decrypt_cache()
+    assert crypto.decrypt_api_key(encrypted) == "sk-test"
+    assert len(calls) == 2
+
+
+def test_decrypt_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(crypto, "DECRYPT_CACHE_SIZE", 2)
+    first, second, third = (crypto.encrypt_api_key(f"sk-{i}") for i in range(3))
+    crypto.decrypt_api_key(first)
+    crypto.decrypt_api_key(second)
+    crypto.decrypt_api_key(first)
+    crypto.decrypt_api_key(third)
+    assert list(crypto._decrypt_cache) == [first, third]
+
+
+def test_is_encrypted():
+    encrypted = crypto.encrypt_api_key("sk-test")
+    assert crypto.is_encrypted(encrypted)
+    assert not crypto.is_encrypted("sk-plaintext-key")
+    assert not crypto.is_encrypted("")
+    # 结构像 token 但 HMAC 校验不通过
+    assert not crypto.is_encrypted(encrypted[:-8] + "AAAAAAA=")
+
+
+def test_failed_decrypt_not_cached():
+    # 未加密的明文密钥：原样返回，但不能作为"解密结果"写入缓存
+    assert crypto.decrypt_api_key("sk-plaintext-key") == "sk-plaintext-key"
+    assert not crypto._decrypt_cache
+
+    # 结构像 token 但无法解密的值同样不缓存，之后仍判定为未加密
+    forged = crypto.encrypt_api_key("sk-test")[:-8] + "AAAAAAA="
+    assert crypto.decrypt_api_key(forged) == forged
+    assert not crypto._decrypt_cache
+    assert not crypto.is_encrypted(forged)
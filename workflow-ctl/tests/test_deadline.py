@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from app.utils import deadline as deadline_module
+from app.utils.deadline import Deadline, DeadlineExceeded, iter_with_deadline, resolve_timeout
+
+
+def fixed_deadline(monkeypatch, remaining, **kwargs):
+    deadline = Deadline(remaining, **kwargs)
+    monkeypatch.setattr(deadline, "remaining", lambda: remaining)
+    return deadline
+
+
+def test_stage1_budget_is_share_of_remaining(monkeypatch):
+    deadline = fixed_deadline(monkeypatch, 100.0, stage1_share=0.6, stage2_min=10.0)
+    assert deadline.stage1_budget() == pytest.approx(60.0)
+
+
+def test_stage1_budget_leaves_stage2_minimum(monkeypatch):
+    # 30 × 0.6 = 18，只给第二步留 12 秒 -> 放宽到 30 - 15 = 15
+    deadline = fixed_deadline(monkeypatch, 30.0, stage1_share=0.6, stage2_min=15.0)
+    assert deadline.stage1_budget() == pytest.approx(15.0)
+
+
+def test_stage1_budget_keeps_half_of_share_when_short(monkeypatch):
+    # 剩余 12 秒不够第二步的 15 秒：第一步仍保留按比例的一半 12 × 0.6 / 2
+    deadline = fixed_deadline(monkeypatch, 12.0, stage1_share=0.6, stage2_min=15.0)
+    assert deadline.stage1_budget() == pytest.approx(3.6)
+
+
+def test_remaining_counts_down():
+    deadline = Deadline(10.0)
+    deadline.expires_at = time.monotonic() - 1
+    assert deadline.remaining() == 0.0
+
+
+def test_resolve_timeout(monkeypatch):
+    monkeypatch.setattr(deadline_module, "CHAT_DEFAULT_TIMEOUT", 0.0)
+    monkeypatch.setattr(deadline_module, "CHAT_MAX_TIMEOUT", 600.0)
+    assert resolve_timeout(None) is None
+    assert resolve_timeout(30.0, 120.0) == 30.0
+    assert resolve_timeout(None, 120.0) == 120.0
+    assert resolve_timeout(0, 120.0) == 120.0
+    assert resolve_timeout(9999.0) == 600.0
+
+    monkeypatch.setattr(deadline_module, "CHAT_DEFAULT_TIMEOUT", 90.0)
+    assert resolve_timeout(None, None) == 90.0
+
+
+async def test_iter_with_deadline_cancels_slow_upstream():
+    closed = []
+
+    async def upstream():
+        try:
+            yield "first"
+            await asyncio.sleep(10)
+            yield "never"
+        finally:
+            closed.append(True)
+
+    received = []
+    with pytest.raises(DeadlineExceeded) as exc:
+        async for item in iter_with_deadline(upstream(), 0.05, "proprietary"):
+            received.append(item)
+    assert received == ["first"]
+    assert closed == [True]
+    assert exc.value.stage == "proprietary"
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+from app.utils import generation_params
+from app.utils.generation_params import collect_parameter_defaults, compile_generation_params
+
+
+def make_parameter(name, default_value=None, validation=None, model_type="proprietary"):
+    return SimpleNamespace(name=name, default_value=default_value, validation=validation, model_type=model_type)
+
+
+def test_collect_parameter_defaults():
+    defaults = collect_parameter_defaults([
+        make_parameter("max_tokens", "1024", {"max": 4096}),
+        make_parameter("top_p", "0.9", model_type="general"),
+        make_parameter("top_p", "2"),
+        make_parameter("temperature", "0.5"),
+        make_parameter("max_tokens", "100", model_type="embedding"),
+    ])
+    assert defaults == {
+        "professional": {
+            "max_tokens": {"default": 1024, "validation": {"max": 4096}},
+            "top_p": {"default": None, "validation": None},
+        },
+        "general": {"top_p": {"default": 0.9, "validation": None}},
+    }
+
+
+def test_model_configuration_overrides_parameter_default():
+    defaults = {"max_tokens": {"default": 1024, "validation": None}, "top_p": {"default": 0.9, "validation": None}}
+    configurations = [
+        {"name": "other-model", "max_tokens": 10},
+        {"name": "m", "max_output_tokens": 2048, "stop": "###"},
+    ]
+    assert compile_generation_params("m", configurations, defaults) == {
+        "max_tokens": 2048, "top_p": 0.9, "stop": ["###"]
+    }
+    assert compile_generation_params("other-model", configurations, defaults) == {"max_tokens": 10, "top_p": 0.9}
+
+
+def test_validation_clamps_both_sources():
+    defaults = {
+        "max_tokens": {"default": None, "validation": {"min": 16, "max": 4096}},
+        "top_p": {"default": 0.01, "validation": {"min": 0.1}},
+    }
+    compiled = compile_generation_params("m", [{"name": "m", "max_tokens": 100000}], defaults)
+    assert compiled == {"max_tokens": 4096, "top_p": 0.1}
+    assert compile_generation_params("m", [{"name": "m", "max_tokens": 1}], defaults)["max_tokens"] == 16
+
+
+def test_invalid_values_ignored():
+    configurations = [{"name": "m", "max_tokens": -5, "top_p": "abc", "stop": [1, 2]}]
+    assert compile_generation_params("m", configurations) == {}
+    assert compile_generation_params("m", [{"name": "m", "max_tokens": True}]) == {}
+    # 空的 stop 不发送
+    assert compile_generation_params("m", [{"name": "m", "stop": ""}]) == {}
+
+
+def test_global_default_max_tokens(monkeypatch):
+    monkeypatch.setattr(generation_params, "UPSTREAM_DEFAULT_MAX_TOKENS", 512)
+    assert compile_generation_params("m", []) == {"max_tokens": 512}
+    assert compile_generation_params("m", [{"name": "m", "max_tokens": 64}]) == {"max_tokens": 64}
+
+
+def test_string_limits_cast_and_invalid_limits_skipped():
+    defaults = {
+        "max_tokens": {"default": None, "validation": {"min": "16", "max": "4096"}},
+        "top_p": {"default": None, "validation": {"min": "abc", "max": "0.8"}},
+    }
+    configurations = [{"name": "m", "max_tokens": 100000, "top_p": 0.95}]
+    assert compile_generation_params("m", configurations, defaults) == {"max_tokens": 4096, "top_p": 0.8}
+    assert compile_generation_params("m", [{"name": "m", "max_tokens": "8"}], defaults)["max_tokens"] == 16
+
+    # 无法转换为数值的范围被忽略，不影响参数本身
+    defaults = {"max_tokens": {"default": 512, "validation": {"min": [1], "max": "unbounded"}}}
+    assert compile_generation_params("m", [], defaults) == {"max_tokens": 512}
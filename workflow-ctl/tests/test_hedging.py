@@ -0,0 +1,58 @@
+from app.utils import hedging
+from app.utils.hedging import HedgeTracker
+
+
+def test_quantile_needs_min_samples(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_MIN_SAMPLES", 5)
+    tracker = HedgeTracker("t")
+    for latency in (0.4, 0.1, 0.3, 0.2):
+        tracker.observe(latency)
+    assert tracker.quantile(0.5) is None
+
+    tracker.observe(0.5)
+    assert tracker.quantile(0.5) == 0.3
+    assert tracker.quantile(0.95) == 0.5
+    assert tracker.quantile(0.0) == 0.1
+
+
+def test_quantile_uses_recent_window(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_MIN_SAMPLES", 1)
+    tracker = HedgeTracker("t", window_size=3)
+    for latency in (9.0, 1.0, 2.0, 3.0):
+        tracker.observe(latency)
+    assert tracker.quantile(1.0) == 3.0
+
+
+def test_hedge_delay(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_MIN_SAMPLES", 2)
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 5.0)
+    monkeypatch.setattr(hedging, "HEDGE_MIN_DELAY", 0.05)
+    tracker = HedgeTracker("t")
+    assert tracker.hedge_delay() == 5.0
+    assert tracker.hedge_delay(fixed_delay=1.5) == 1.5
+    assert tracker.hedge_delay(fixed_delay=-1) == 0.0
+
+    tracker.observe(0.01)
+    tracker.observe(0.02)
+    assert tracker.hedge_delay(quantile=0.5) == 0.05
+    tracker.observe(2.0)
+    assert tracker.hedge_delay(quantile=0.95) == 2.0
+
+
+def test_hedge_rate_cap(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_MAX_RATE", 0.25)
+    tracker = HedgeTracker("t")
+    assert tracker.allow_hedge()
+    tracker.record(hedged=True, hedge_won=True)
+
+    # 1 次对冲 / 1 次请求：再对冲会超过 25%
+    assert not tracker.allow_hedge()
+    for _ in range(6):
+        tracker.record(hedged=False, hedge_won=False)
+    # (1 + 1) / (7 + 1) = 25%
+    assert tracker.allow_hedge()
+
+    stats = tracker.get_stats()
+    assert (stats["requests"], stats["hedged"], stats["skipped"]) == (7, 1, 1)
+    assert (stats["hedge_wins"], stats["primary_wins"]) == (1, 6)
+    assert stats["hedge_rate"] == round(1 / 7, 4)
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+from app.utils.model_routing import (
+    ROUTE_DEFAULT, ROUTE_REQUESTED, ROUTE_SHORT_INPUT, ROUTE_SHORT_STAGE1, THRESHOLD_STAGE1,
+    FastModelStats, ModelRoute, select_model
+)
+
+
+def make_provider(custom_config=None, fast="fast-model"):
+    return SimpleNamespace(
+        name="p", default_model_name="big-model", fast_default_model_name=fast, custom_config=custom_config
+    )
+
+
+def test_input_threshold_routing():
+    provider = make_provider({"fast_input_chars": 100})
+    assert ModelRoute(100).select(provider) == ("fast-model", ROUTE_SHORT_INPUT)
+    assert ModelRoute(101).select(provider) == ("big-model", ROUTE_DEFAULT)
+
+
+def test_stage1_threshold_is_separate():
+    provider = make_provider({"fast_input_chars": 100, "fast_stage1_chars": 500})
+    assert ModelRoute(300, THRESHOLD_STAGE1).select(provider) == ("fast-model", ROUTE_SHORT_STAGE1)
+    assert ModelRoute(300).select(provider) == ("big-model", ROUTE_DEFAULT)
+
+
+def test_request_flag_overrides_threshold():
+    provider = make_provider({"fast_input_chars": 100})
+    assert ModelRoute(10_000, requested=True).select(provider) == ("fast-model", ROUTE_REQUESTED)
+    assert ModelRoute(10, requested=False).select(provider) == ("big-model", ROUTE_DEFAULT)
+
+
+def test_no_fast_model_or_threshold():
+    assert ModelRoute(10, requested=True).select(make_provider(fast=None)) == ("big-model", ROUTE_DEFAULT)
+    # 阈值为 0（或无效）时不按长度路由
+    assert ModelRoute(10).select(make_provider({"fast_input_chars": 0})) == ("big-model", ROUTE_DEFAULT)
+    assert ModelRoute(10).select(make_provider({"fast_input_chars": "x"})) == ("big-model", ROUTE_DEFAULT)
+    assert select_model(make_provider({"fast_input_chars": 100})) == ("big-model", ROUTE_DEFAULT)
+
+
+def test_fast_model_report():
+    stats = FastModelStats()
+    provider = make_provider()
+    stats.observe(provider, "stream", "big-model", 2.0, ttft=0.5)
+    stats.observe(provider, "stream", "big-model", 4.0)
+    stats.observe(provider, "stream", "fast-model", 1.0, ttft=0.2)
+    stats.observe(make_provider(fast=None), "stream", "big-model", 9.0)
+
+    report = stats.get_report()
+    assert list(report) == ["p/stream"]
+    item = report["p/stream"]
+    assert (item["default"]["requests"], item["fast"]["requests"]) == (2, 1)
+    assert item["fast_share"] == round(1 / 3, 4)
+    assert item["saved_per_request"] == 2.0
+    assert item["estimated_saved"] == 2.0
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.api import chat
+from app.utils.pipeline import USER_MESSAGE, PipelineError, parse_pipeline, run_transform
+
+STAGES = [
+    {"id": "draft_a", "category": "professional", "user_prompt": "A:{user_message}"},
+    {"id": "draft_b", "category": "professional", "user_prompt": "B:{user_message}"},
+    {"id": "merged", "type": "merge", "inputs": ["draft_a", "draft_b"], "separator": "|"},
+    {"id": "clean", "type": "filter", "input": "merged", "replace": {"|": " + "}, "max_chars": 40},
+    {"id": "final", "type": "template", "template": "结果：{clean}"},
+]
+
+
+def make_pipeline(stages=STAGES, **config):
+    return parse_pipeline({"pipeline": dict(config, stages=stages)})
+
+
+def parse_events(events):
+    return [json.loads(event.split("data: ", 1)[1]) for event in events if "data: " in event]
+
+
+def test_no_pipeline_config():
+    assert parse_pipeline(None) is None
+    assert parse_pipeline({"stage1_cache": {}}) is None
+
+
+def test_topological_order_and_ready():
+    pipeline = make_pipeline()
+    assert pipeline.output == "final"
+    assert pipeline.order == ("draft_a", "draft_b", "merged", "clean")
+    assert pipeline.stages["merged"].inputs == ("draft_a", "draft_b")
+    assert pipeline.stages["final"].inputs == ("clean",)
+
+    # 依赖未完成的阶段不会就绪
+    assert [s.id for s in pipeline.ready({USER_MESSAGE})] == ["draft_a", "draft_b"]
+    assert [s.id for s in pipeline.ready({USER_MESSAGE, "draft_a"})] == ["draft_b"]
+    assert [s.id for s in pipeline.ready({USER_MESSAGE, "draft_a", "draft_b"})] == ["merged"]
+
+
+def test_stages_not_needed_by_output_are_skipped():
+    pipeline = make_pipeline(output="merged")
+    assert pipeline.order == ("draft_a", "draft_b")
+
+
+@pytest.mark.parametrize("stages, message", [
+    ([{"id": "a", "type": "template", "template": "{b}"}, {"id": "b", "type": "template", "template": "{a}"}], "循环依赖"),
+    ([{"id": "a", "type": "merge", "inputs": ["missing"]}], "不存在"),
+    ([{"id": "a", "type": "template", "template": "x"}, {"id": "a", "type": "template", "template": "y"}], "重复"),
+    ([{"id": USER_MESSAGE, "type": "template", "template": "x"}], "保留名"),
+    ([{"id": "a", "category": "general"}], "prompt"),
+    ([{"id": "a", "type": "unknown"}], "不受支持"),
+])
+def test_invalid_pipeline(stages, message):
+    with pytest.raises(PipelineError, match=message):
+        make_pipeline(stages)
+
+
+def test_run_transform():
+    pipeline = make_pipeline()
+    values = {USER_MESSAGE: "u", "draft_a": "  甲  ", "draft_b": "乙" * 50}
+    values["merged"] = run_transform(pipeline.stages["merged"], values)
+    assert values["merged"] == "  甲  |" + "乙" * 50
+
+    values["clean"] = run_transform(pipeline.stages["clean"], values)
+    assert values["clean"] == ("甲   + " + "乙" * 50)[:40]
+    assert run_transform(pipeline.stages["final"], values) == "结果：" + values["clean"]
+
+
+async def run_pipeline(pipeline):
+    """执行 pipeline，返回解析后的事件"""
+    runtime = {
+        stage_id: (SimpleNamespace(system_prompt="", user_prompt=stage.user_prompt), [])
+        for stage_id, stage in pipeline.stages.items() if stage.user_prompt
+    }
+    log_info = {"start_time": time.time(), "general_params": {}}
+    return parse_events([
+        event async for event in chat.stream_pipeline_response(pipeline, runtime, "文章", log_info)
+    ])
+
+
+async def test_stages_run_after_dependencies(monkeypatch):
+    async def fake_provider_call(providers, messages, tenant, stream=False, params=None, route=None):
+        content = messages[-1]["content"]
+        await asyncio.sleep(0.05 if content.startswith("A") else 0.01)
+        yield content.lower()
+
+    logs = []
+    monkeypatch.setattr(chat, "iter_provider_call", fake_provider_call)
+    monkeypatch.setattr(chat, "save_chat_log", logs.append)
+    events = await run_pipeline(make_pipeline())
+
+    stages = [(e["stage"], e["status"]) for e in events if e["type"] == "stage"]
+    # 两个 model 阶段并发开始，merged 在两者都完成后才开始
+    assert stages[:2] == [("draft_a", "started"), ("draft_b", "started")]
+    assert stages.index(("merged", "started")) > stages.index(("draft_a", "completed"))
+    assert stages.index(("draft_b", "completed")) < stages.index(("draft_a", "completed"))
+    assert stages.index(("final", "started")) > stages.index(("clean", "completed"))
+
+    assert events[-1]["type"] == "done"
+    assert events[-1]["full_content"] == "结果：a:文章 + b:文章"
+    assert len(logs) == 1 and logs[0]["status"] == "completed"
+    assert set(logs[0]["proprietary_params"]["stages"]) == {"draft_a", "draft_b", "merged", "clean"}
+
+
+async def test_stage_failure_cancels_siblings_and_skips_dependents(monkeypatch):
+    cancelled = []
+
+    async def fake_provider_call(providers, messages, tenant, stream=False, params=None, route=None):
+        content = messages[-1]["content"]
+        if content.startswith("A"):
+            await asyncio.sleep(0.01)
+            raise RuntimeError("上游失败")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(content)
+            raise
+        yield content
+
+    logs = []
+    monkeypatch.setattr(chat, "iter_provider_call", fake_provider_call)
+    monkeypatch.setattr(chat, "save_chat_log", logs.append)
+    events = await run_pipeline(make_pipeline())
+
+    assert events[-1]["type"] == "error"
+    assert events[-1]["stage"] == "draft_a"
+    assert "上游失败" in events[-1]["message"]
+    assert cancelled == ["B:文章"]
+    # 失败阶段的下游从未开始
+    started = [e["stage"] for e in events if e["type"] == "stage" and e["status"] == "started"]
+    assert started == ["draft_a", "draft_b"]
+
+    assert len(logs) == 1 and logs[0]["status"] == "failed"
+    assert logs[0]["proprietary_params"]["stages"]["draft_a"]["status"] == "failed"
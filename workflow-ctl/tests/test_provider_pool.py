@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+from app.utils import provider_pool
+from app.utils.provider_pool import MODE_COMPLETE, MODE_STREAM, ProviderRouter
+
+
+def make_provider(provider_id, is_default=True):
+    return SimpleNamespace(id=provider_id, name=f"p{provider_id}", is_default_provider=is_default)
+
+
+def observe(router, provider, latency, mode=MODE_STREAM):
+    router._get(provider).observe(mode, latency)
+
+
+def names(providers):
+    return [p.name for p in providers]
+
+
+def test_ranks_by_latency_times_outstanding():
+    router = ProviderRouter()
+    a, b = make_provider(1), make_provider(2)
+    observe(router, a, 1.0)
+    observe(router, b, 2.0)
+    assert names(router.rank([b, a])) == ["p1", "p2"]
+
+    # a 上有两个进行中的请求：1.0 × 3 > 2.0 × 1
+    router.begin(a)
+    router.begin(a)
+    assert names(router.rank([a, b])) == ["p2", "p1"]
+    router.end(a)
+    router.end(a)
+    assert names(router.rank([a, b])) == ["p1", "p2"]
+
+
+def test_stream_and_complete_latencies_tracked_separately():
+    router = ProviderRouter()
+    a, b = make_provider(1), make_provider(2)
+    observe(router, a, 1.0, MODE_STREAM)
+    observe(router, b, 2.0, MODE_STREAM)
+    observe(router, a, 9.0, MODE_COMPLETE)
+    observe(router, b, 3.0, MODE_COMPLETE)
+    assert names(router.rank([a, b], MODE_STREAM)) == ["p1", "p2"]
+    assert names(router.rank([a, b], MODE_COMPLETE)) == ["p2", "p1"]
+
+
+def test_non_default_penalty(monkeypatch):
+    monkeypatch.setattr(provider_pool, "PROVIDER_NON_DEFAULT_PENALTY", 1.5)
+    router = ProviderRouter()
+    default, backup = make_provider(1), make_provider(2, is_default=False)
+    observe(router, default, 1.2)
+    observe(router, backup, 1.0)
+    # 1.0 × 1.5 > 1.2：偏好默认 provider
+    assert names(router.rank([backup, default])) == ["p1", "p2"]
+
+    monkeypatch.setattr(provider_pool, "PROVIDER_NON_DEFAULT_PENALTY", 1.1)
+    assert names(router.rank([default, backup])) == ["p2", "p1"]
+
+
+def test_unknown_provider_uses_best_known_latency():
+    router = ProviderRouter()
+    known, slow, new = make_provider(1), make_provider(2), make_provider(3)
+    observe(router, known, 0.5)
+    observe(router, slow, 4.0)
+    # 新 provider 按池内最小延迟计分，与最快的已知 provider 同分时保持配置顺序
+    assert names(router.rank([slow, new, known])) == ["p3", "p1", "p2"]
+
+
+def test_no_samples_keeps_configured_order():
+    router = ProviderRouter()
+    providers = [make_provider(3), make_provider(1), make_provider(2)]
+    assert router.rank(providers) == providers
+
+
+def test_failure_records_penalty_latency(monkeypatch):
+    monkeypatch.setattr(provider_pool, "PROVIDER_FAILURE_PENALTY", 30.0)
+    router = ProviderRouter()
+    a, b = make_provider(1), make_provider(2)
+    observe(router, a, 0.5)
+    observe(router, b, 1.0)
+    router.fail(a, MODE_STREAM, "connect error")
+    assert names(router.rank([a, b])) == ["p2", "p1"]
+    stats = router.get_stats()[1]
+    assert stats["failures"] == 1 and stats["last_error"] == "connect error"
+    assert stats["ewma_ttft"] > 1.0
+
+
+def test_rejection_does_not_penalize_latency():
+    router = ProviderRouter()
+    a, b = make_provider(1), make_provider(2)
+    observe(router, a, 0.5)
+    observe(router, b, 1.0)
+    router.reject(a, "HTTP 400")
+    assert names(router.rank([a, b])) == ["p1", "p2"]
+    stats = router.get_stats()[1]
+    assert (stats["rejections"], stats["failures"], stats["last_error"]) == (1, 0, "HTTP 400")
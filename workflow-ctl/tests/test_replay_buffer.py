@@ -0,0 +1,81 @@
+import asyncio
+
+from app.storage.replay_buffer import ResumableStream, ResumableStreamRegistry, parse_last_event_id
+
+
+async def numbered_events(count, delay=0.0):
+    for i in range(1, count + 1):
+        if delay:
+            await asyncio.sleep(delay)
+        yield f"data: {i}\n\n"
+
+
+def seqs(events):
+    return [int(event.split("\n", 1)[0].rpartition(":")[2]) for event in events]
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id("abc:12") == ("abc", 12)
+    assert parse_last_event_id(" abc:0 ") == ("abc", 0)
+    assert parse_last_event_id("abc") == (None, 0)
+    assert parse_last_event_id("abc:x") == (None, 0)
+    assert parse_last_event_id(None) == (None, 0)
+
+
+async def test_resume_replays_after_seq():
+    registry = ResumableStreamRegistry()
+    stream = registry.start(numbered_events(5), tenant=1, fingerprint="f")
+    first = [event async for event in stream.subscribe()]
+    assert seqs(first) == [1, 2, 3, 4, 5]
+    assert first[0] == f"id: {stream.id}:1\ndata: 1\n\n"
+
+    resumed = registry.resume(stream.id, 3, tenant=1, fingerprint="f")
+    assert resumed is stream
+    assert seqs([event async for event in resumed.subscribe(3)]) == [4, 5]
+    assert registry.get_stats()["resumed"] == 1
+
+
+async def test_resume_refuses_other_tenant_and_other_request():
+    registry = ResumableStreamRegistry()
+    stream = registry.start(numbered_events(3), tenant=1, fingerprint="f")
+    [event async for event in stream.subscribe()]
+
+    assert registry.resume(stream.id, 1, tenant=2, fingerprint="f") is None
+    assert registry.resume(stream.id, 1, tenant=1, fingerprint="other") is None
+    assert registry.resume("unknown", 1, tenant=1, fingerprint="f") is None
+    assert registry.resume(stream.id, 4, tenant=1, fingerprint="f") is None
+    assert registry.get_stats()["missed"] == 4
+
+
+async def test_cannot_resume_before_buffer_start():
+    stream = ResumableStream(numbered_events(10), tenant=1, buffer_size=4)
+    await stream._task
+    assert [seq for seq, _ in stream.buffer] == [7, 8, 9, 10]
+    # 缓冲区只保留 7..10：断点 6 之后的事件都还在，断点 5 之后的 6 已被淘汰
+    assert stream.can_resume(6)
+    assert not stream.can_resume(5)
+    assert not stream.can_resume(11)
+
+
+async def test_disconnect_cancels_without_grace():
+    registry = ResumableStreamRegistry()
+    stream = registry.start(numbered_events(100, delay=0.01), tenant=1, grace=0)
+    events = stream.subscribe()
+    await events.__anext__()
+    assert stream.subscribers == 1
+    await events.aclose()
+    await asyncio.sleep(0.02)
+    assert stream._task.cancelled()
+    assert registry.resume(stream.id, 1, tenant=1) is None
+
+
+async def test_grace_keeps_generation_for_reconnect():
+    registry = ResumableStreamRegistry()
+    stream = registry.start(numbered_events(5, delay=0.01), tenant=1, grace=5)
+    events = stream.subscribe()
+    await events.__anext__()
+    await events.aclose()
+    assert stream.subscribers == 0 and not stream._task.done()
+
+    resumed = registry.resume(stream.id, 1, tenant=1)
+    assert seqs([event async for event in resumed.subscribe(1)]) == [2, 3, 4, 5]
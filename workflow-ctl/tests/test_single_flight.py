@@ -0,0 +1,52 @@
+import asyncio
+
+from app.storage.single_flight import SingleFlightGroup, make_flight_key
+
+
+async def numbered_events(log, count=100, delay=0.01):
+    try:
+        for i in range(count):
+            await asyncio.sleep(delay)
+            yield f"data: {i}\n\n"
+    finally:
+        log.append("closed")
+
+
+def test_flight_key_depends_on_every_part():
+    key = make_flight_key(workflow_id=1, user_message="hi", timeout=None)
+    assert key == make_flight_key(timeout=None, user_message="hi", workflow_id=1)
+    assert key != make_flight_key(workflow_id=1, user_message="hi", timeout=30.0)
+
+
+async def test_joiner_replays_from_first_event():
+    group = SingleFlightGroup()
+    log = []
+    flight, is_leader = group.join_or_start("k", lambda: numbered_events(log, count=3), window=10)
+    leader = flight.subscribe()
+    first = await leader.__anext__()
+
+    joined, joined_is_leader = group.join_or_start("k", lambda: numbered_events(log), window=10)
+    assert is_leader and not joined_is_leader and joined is flight
+    follower = [event async for event in joined.subscribe()]
+    rest = [event async for event in leader]
+    assert follower == [first] + rest == ["data: 0\n\n", "data: 1\n\n", "data: 2\n\n"]
+    assert group.get_stats()["joiners"] == 1
+
+
+async def test_leader_cancelled_when_last_subscriber_leaves():
+    group = SingleFlightGroup()
+    log = []
+    flight, _ = group.join_or_start("k", lambda: numbered_events(log), window=10)
+    first, second = flight.subscribe(), flight.subscribe()
+    await first.__anext__()
+    await second.__anext__()
+
+    await first.aclose()
+    await asyncio.sleep(0.03)
+    assert not flight._task.done() and flight.subscribers == 1
+
+    await second.aclose()
+    await asyncio.sleep(0.03)
+    assert flight._task.cancelled()
+    assert log == ["closed"]
+    assert group.get_stats()["active"] == 0